@@ -5,10 +5,31 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 
 import argparse
+import json
 import logging
 import os
 import pathlib
 
+import yaml
+
+from .pool import PoolConfigLoader
+from .pool import PoolRepository
+from .pool import parse_time
+from .stagger import Stagger
+from .workflow import Workflow
+
+
+def parse_flag(value):
+    """Parse a boolean option given as a string, like an environment variable
+
+    Args:
+        value (str): option value, or None if unset
+
+    Returns:
+        bool: whether `value` is "1", "true" or "yes" (case insensitive)
+    """
+    return value is not None and str(value).strip().lower() in ("1", "true", "yes")
+
 
 def build_cli_parser(*args, **kwargs):
     parser = argparse.ArgumentParser(*args, **kwargs)
@@ -33,6 +54,12 @@ def build_cli_parser(*args, **kwargs):
         help="A git revision for the fuzzing git repository",
         default=os.environ.get("FUZZING_GIT_REVISION"),
     )
+    parser.add_argument(
+        "--git-cache",
+        type=pathlib.Path,
+        help="Directory keeping mirrors of the cloned git repositories between runs",
+        default=os.environ.get("FUZZING_GIT_CACHE"),
+    )
     group = parser.add_mutually_exclusive_group()
     group.add_argument(
         "--quiet",
@@ -52,3 +79,74 @@ def build_cli_parser(*args, **kwargs):
     )
     parser.set_defaults(log_level=logging.INFO)
     return parser
+
+
+def compile_main(args=None):
+    """Compile a fuzzing configuration checkout into a pool bundle"""
+    parser = argparse.ArgumentParser(prog="fuzzing-pool-compile")
+    parser.add_argument(
+        "config_dir", type=pathlib.Path, help="Fuzzing configuration checkout"
+    )
+    parser.add_argument(
+        "--output", "-o", type=pathlib.Path, required=True, help="Bundle to write"
+    )
+    parser.add_argument(
+        "--revision",
+        help="Revision of the fuzzing configuration (default: git HEAD of config_dir)",
+    )
+    args = parser.parse_args(args=args)
+
+    logging.basicConfig(level=logging.INFO)
+
+    revision = args.revision or Workflow.git_revision(args.config_dir)
+    assert revision is not None, f"{args.config_dir} revision could not be found"
+    bundle = PoolConfigLoader.compile(args.config_dir, revision)
+    args.output.write_text(json.dumps(bundle, separators=(",", ":"), sort_keys=True))
+    logging.info(f"Compiled {len(bundle['pools'])} pools to {args.output}")
+
+
+def stagger_main(args=None):
+    """Choose schedule_start offsets spreading the load of all pools"""
+    parser = argparse.ArgumentParser(prog="fuzzing-pool-stagger")
+    parser.add_argument(
+        "config_dir", type=pathlib.Path, help="Fuzzing configuration checkout"
+    )
+    parser.add_argument(
+        "--resolution",
+        type=parse_time,
+        default="5m",
+        help="Granularity of the chosen offsets (default: 5m)",
+    )
+    parser.add_argument(
+        "--reassign",
+        action="store_true",
+        help="Also move the pools which already set schedule_start",
+    )
+    parser.add_argument(
+        "--output", "-o", type=pathlib.Path, help="Write the offsets to a YAML file"
+    )
+    args = parser.parse_args(args=args)
+
+    logging.basicConfig(level=logging.INFO)
+
+    repository = PoolRepository(args.config_dir, PoolConfigLoader)
+    stagger = Stagger.from_pools(repository.pools, args.resolution, args.reassign)
+    before = stagger.current()
+    after = stagger.optimize()
+
+    offsets = {
+        pool_id: Stagger.schedule_start(phase).isoformat()
+        for pool_id, phase in sorted(after.items())
+        if not stagger.pools[pool_id].fixed
+    }
+    if args.output is not None:
+        args.output.write_text(yaml.safe_dump(offsets, default_flow_style=False))
+    else:
+        for pool_id, offset in offsets.items():
+            print(f"{pool_id:<40} {offset}")
+
+    peaks = (stagger.report(before), stagger.report(after))
+    header = f"peak in {int(args.resolution)}s"
+    print(f"{header:<40} {'before':>10} {'after':>10}")
+    for metric in ("hooks", "tasks", "cores"):
+        print(f"{metric:<40} {peaks[0][metric]:>10} {peaks[1][metric]:>10}")
@@ -5,10 +5,18 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 
 import abc
+import bisect
+import collections.abc
+import copy
+import fractions
+import functools
+import hashlib
 import itertools
+import json
 import logging
 import pathlib
 import re
+import sys
 import types
 from datetime import datetime
 from datetime import timedelta
@@ -19,6 +27,118 @@ import yaml
 
 LOG = logging.getLogger("fuzzing_tc.common.pool")
 
+
+class Size(int):
+    """A size in bytes, parsed from a human readable string like "4g"."""
+
+    KILOBYTE = 1024
+    MEGABYTE = 1024 * KILOBYTE
+    GIGABYTE = 1024 * MEGABYTE
+    TERABYTE = 1024 * GIGABYTE
+    PATTERN = re.compile(r"\s*(\d+\.\d*|\.\d+|\d+)\s*([kmgt]?)b?\s*", re.IGNORECASE)
+    MULTIPLIERS = types.MappingProxyType(
+        {"": 1, "k": KILOBYTE, "m": MEGABYTE, "g": GIGABYTE, "t": TERABYTE}
+    )
+
+    @classmethod
+    def parse(cls, size):
+        """Parse a size like "4g" into (4 * 1024 * 1024 * 1024)
+
+        Args:
+            size (str/int/float/Size): size, with si prefixes allowed
+
+        Returns:
+            Size: size with si prefix expanded, rounded down to a whole byte
+        """
+        if isinstance(size, cls):
+            return size
+        return _parse_size(str(size))
+
+    @property
+    def gigabytes(self):
+        """float: size in GB"""
+        return self / self.GIGABYTE
+
+    def __repr__(self):
+        return f"{type(self).__name__}({int(self)})"
+
+
+class Duration(int):
+    """A duration in seconds, parsed from a human readable string like "1h30m" or
+    an ISO-8601 duration like "PT1H30M"."""
+
+    PATTERN = re.compile(r"\s*(\d+)\s*([wdhms]?)\s*(.*)", re.IGNORECASE)
+    ISO8601_PATTERN = re.compile(
+        r"P(?:(?P<w>\d+)W)?(?:(?P<d>\d+)D)?"
+        r"(?:T(?:(?P<h>\d+)H)?(?:(?P<m>\d+)M)?(?:(?P<s>\d+)S)?)?",
+        re.IGNORECASE,
+    )
+    MULTIPLIERS = types.MappingProxyType(
+        {"w": 7 * 24 * 60 * 60, "d": 24 * 60 * 60, "h": 60 * 60, "m": 60, "s": 1}
+    )
+
+    @classmethod
+    def parse(cls, time):
+        """Parse a duration like 1h30m, 30m10s or PT1H30M
+
+        Args:
+            time (str/int/Duration): duration, as a number of seconds or a string
+
+        Returns:
+            Duration: duration in seconds
+        """
+        if isinstance(time, cls):
+            return time
+        return _parse_time(str(time))
+
+    def __repr__(self):
+        return f"{type(self).__name__}({int(self)})"
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_size(size):
+    match = Size.PATTERN.fullmatch(size)
+    if match is None:
+        raise ValueError("size should be a number followed by optional si prefix")
+    multiplier = Size.MULTIPLIERS[match.group(2).lower()]
+    return Size(fractions.Fraction(match.group(1)) * multiplier)
+
+
+@functools.lru_cache(maxsize=None)
+def _parse_time(time):
+    match = Duration.ISO8601_PATTERN.fullmatch(time.strip())
+    if match is not None:
+        if not any(match.groups()) or time.strip().upper().endswith("T"):
+            raise ValueError("no time could be parsed")
+        return Duration(
+            sum(
+                int(value) * Duration.MULTIPLIERS[unit]
+                for unit, value in match.groupdict().items()
+                if value is not None
+            )
+        )
+    result = 0
+    got_anything = False
+    while time:
+        match = Duration.PATTERN.match(time)
+        if match is None:
+            raise ValueError("time should be a number followed by optional unit")
+        if match.group(2):
+            multiplier = Duration.MULTIPLIERS[match.group(2).lower()]
+        else:
+            if match.group(3):
+                raise ValueError("trailing data")
+            if got_anything:
+                raise ValueError("multipart time must specify all units")
+            multiplier = 1
+        got_anything = True
+        result += int(match.group(1)) * multiplier
+        time = match.group(3)
+    if not got_anything:
+        raise ValueError("no time could be parsed")
+    return Duration(result)
+
+
 # fields that must exist in pool.yml (once flattened), and their types
 COMMON_FIELD_TYPES = types.MappingProxyType(
     {
@@ -28,14 +148,15 @@ COMMON_FIELD_TYPES = types.MappingProxyType(
         "container": (str, dict),
         "cores_per_task": int,
         "cpu": str,
-        "cycle_time": (int, str),
-        "disk_size": (int, str),
+        "cycle_time": (int, str, Duration),
+        "disk_size": (int, str, Size),
         "imageset": str,
         "macros": dict,
-        "max_run_time": (int, str),
+        "max_run_time": (int, str, Duration),
         "metal": bool,
-        "minimum_memory_per_core": (float, str),
+        "minimum_memory_per_core": (float, str, Size),
         "name": str,
+        "pack_tasks": bool,
         "platform": str,
         "preprocess": str,
         "schedule_start": (datetime, str),
@@ -43,6 +164,15 @@ COMMON_FIELD_TYPES = types.MappingProxyType(
         "tasks": int,
     }
 )
+# fields parsed into a typed value
+TYPED_FIELDS = types.MappingProxyType(
+    {
+        "cycle_time": Duration,
+        "disk_size": Size,
+        "max_run_time": Duration,
+        "minimum_memory_per_core": Size,
+    }
+)
 # fields that must exist in every pool.yml
 COMMON_REQUIRED_FIELDS = frozenset(("name",))
 POOL_CONFIG_FIELD_TYPES = types.MappingProxyType(
@@ -64,6 +194,38 @@ CPU_ALIASES = types.MappingProxyType(
 )
 PROVIDERS = frozenset(("aws", "gcp"))
 ARCHITECTURES = frozenset(("x64", "arm64"))
+CONTAINER_KEYS = types.MappingProxyType(
+    {
+        "docker-image": frozenset(("type", "name")),
+        "indexed-image": frozenset(("type", "path", "namespace")),
+        "task-image": frozenset(("type", "path", "taskId")),
+    }
+)
+ARTIFACT_TYPES = frozenset(("file", "directory"))
+# flattened parent configurations, keyed by (class, path) of the pool.yml, with the
+# (mtime, size) of that file and of every ancestor it was flattened from
+_RESOLVED_PARENTS = {}
+# compiled PoolValidator for each configuration class
+_VALIDATORS = {}
+
+
+def package_version():
+    """Get the installed version of fuzzing-tc
+
+    Returns:
+        str: package version, or "unknown" if it is not installed
+    """
+    try:
+        try:
+            from importlib.metadata import version
+        except ImportError:  # python < 3.8
+            from pkg_resources import get_distribution
+
+            return get_distribution("fuzzing-tc").version
+        return version("fuzzing-tc")
+    except Exception:
+        LOG.debug("fuzzing-tc version could not be determined")
+        return "unknown"
 
 
 def parse_size(size):
@@ -73,19 +235,9 @@ def parse_size(size):
         size (str): size as a string, with si prefixes allowed
 
     Returns:
-        float: size with si prefix expanded
+        Size: size with si prefix expanded
     """
-    match = re.match(r"\s*(\d+\.\d*|\.\d+|\d+)\s*([kmgt]?)b?\s*", size, re.IGNORECASE)
-    assert match is not None, "size should be a number followed by optional si prefix"
-    result = float(match.group(1))
-    multiplier = {
-        "": 1,
-        "k": 1024,
-        "m": 1024 * 1024,
-        "g": 1024 * 1024 * 1024,
-        "t": 1024 * 1024 * 1024 * 1024,
-    }[match.group(2).lower()]
-    return result * multiplier
+    return Size.parse(size)
 
 
 def parse_time(time):
@@ -95,30 +247,435 @@ def parse_time(time):
         time (str): time as a string
 
     Returns:
-        int: time in seconds
+        Duration: time in seconds
     """
-    result = 0
-    got_anything = False
-    while time:
-        match = re.match(r"\s*(\d+)\s*([wdhms]?)\s*(.*)", time, re.IGNORECASE)
-        assert match is not None, "time should be a number followed by optional unit"
-        if match.group(2):
-            multiplier = {
-                "w": 7 * 24 * 60 * 60,
-                "d": 24 * 60 * 60,
-                "h": 60 * 60,
-                "m": 60,
-                "s": 1,
-            }[match.group(2).lower()]
+    return Duration.parse(time)
+
+
+def _type_name(value):
+    return type(value).__name__
+
+
+def _check_container(value):
+    if not isinstance(value, dict):
+        return
+    if "type" not in value:
+        yield "container", "'container' missing required key: 'type'"
+        return
+    if value["type"] not in CONTAINER_KEYS:
+        yield "container.type", f"unknown 'container.type': {value['type']}"
+        return
+    required_keys = CONTAINER_KEYS[value["type"]]
+    missing_keys = required_keys - set(value)
+    extra_keys = set(value) - required_keys
+    if missing_keys:
+        yield "container", (
+            f"missing required keys for 'container' with type '{value['type']}': "
+            f"{', '.join(sorted(missing_keys))}"
+        )
+    if extra_keys:
+        yield "container", (
+            f"unknown keys for 'container' with type '{value['type']}': "
+            f"{', '.join(sorted(extra_keys, key=str))}"
+        )
+    for k, v in value.items():
+        if not isinstance(v, str):
+            yield f"container.{k}", (
+                f"unexpected type for 'container.{k}': {_type_name(v)}"
+            )
+
+
+def _check_artifacts(value):
+    for key, artifact in value.items():
+        if not isinstance(key, str):
+            yield "artifacts", (
+                f"expected artifact '{key!r}' name to be 'str', got '{_type_name(key)}'"
+            )
+            continue
+        if not isinstance(artifact, dict):
+            yield f"artifacts.{key}", (
+                f"expected artifact '{key}' value to be 'dict', "
+                f"got '{_type_name(artifact)}'"
+            )
+            continue
+        if set(artifact) != {"url", "type"}:
+            yield f"artifacts.{key}", (
+                f"expected artifact '{key}' object to contain only keys: url, type"
+            )
+            continue
+        if not isinstance(artifact["url"], str):
+            yield f"artifacts.{key}.url", (
+                f"expected artifact '{key}' .url to be 'str', "
+                f"got '{_type_name(artifact['url'])}'"
+            )
+        if artifact["type"] not in ARTIFACT_TYPES:
+            yield f"artifacts.{key}.type", (
+                f"expected artifact '{key}' .type to be one of: file, directory"
+            )
+
+
+def _check_macros(value):
+    for key, macro in value.items():
+        if not isinstance(key, str):
+            yield "macros", (
+                f"expected macro '{key!r}' name to be 'str', got '{_type_name(key)}'"
+            )
+        elif not isinstance(macro, (int, str)):
+            yield f"macros.{key}", (
+                f"expected macro '{key}' value to be 'int' or 'str', "
+                f"got '{_type_name(macro)}'"
+            )
+
+
+def _check_cpu(value):
+    if value.lower() not in CPU_ALIASES:
+        yield "cpu", f"unknown 'cpu': {value} - use {', '.join(sorted(CPU_ALIASES))}"
+
+
+def _check_cloud(value):
+    if value not in PROVIDERS:
+        yield "cloud", f"Invalid cloud - use {','.join(sorted(PROVIDERS))}"
+
+
+def _check_parsed(field, parse, value):
+    try:
+        parse(value)
+    except ValueError as exc:
+        yield field, f"invalid '{field}': {exc}"
+
+
+def _check_schedule_start(value):
+    if isinstance(value, str):
+        try:
+            dateutil.parser.isoparse(value)
+        except ValueError as exc:
+            yield "schedule_start", f"invalid 'schedule_start': {exc}"
+
+
+# (low, high) bounds of each cron field: second, minute, hour, day, month, weekday
+CRON_FIELDS = ((0, 59), (0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def _cron_field(values, low, high):
+    """Format a set of values as a cron field, using steps, ranges and lists"""
+    if values is None or values == set(range(low, high + 1)):
+        return "*"
+    values = sorted(values)
+    if len(values) >= 3:
+        step = values[1] - values[0]
+        if values == list(range(values[0], values[-1] + 1, step)):
+            if step == 1:
+                return f"{values[0]}-{values[-1]}"
+            if values == list(range(low, high + 1, step)):
+                return f"*/{step}"
+            return f"{values[0]}-{values[-1]}/{step}"
+    # list of consecutive runs
+    runs = []
+    for value in values:
+        if runs and runs[-1][1] == value - 1:
+            runs[-1][1] = value
         else:
-            assert not match.group(3), "trailing data"
-            assert not got_anything, "multipart time must specify all units"
-            multiplier = 1
-        got_anything = True
-        result += int(match.group(1)) * multiplier
-        time = match.group(3)
-    assert got_anything, "no time could be parsed"
-    return result
+            runs.append([value, value])
+    return ",".join(
+        str(first)
+        if first == last
+        else (f"{first},{last}" if last == first + 1 else f"{first}-{last}")
+        for first, last in runs
+    )
+
+
+def compress_crons(occurrences):
+    """Find a short list of cron patterns matching exactly the given times
+
+    Patterns which only differ by one field are merged, until no more can be.
+
+    Args:
+        occurrences (list): (second, minute, hour, day, month, weekday) tuples, with
+                            None for fields which match anything
+
+    Returns:
+        list of str: patterns in simple cron format, in order of first occurrence
+    """
+    entries = [
+        tuple(None if value is None else frozenset((value,)) for value in occurrence)
+        for occurrence in occurrences
+    ]
+    # merge the least significant fields first: day, weekday, month, hour, ...
+    order = (3, 5, 4, 2, 1, 0)
+    merged = True
+    while merged:
+        merged = False
+        for field in order:
+            groups = {}
+            for entry in entries:
+                key = entry[:field] + entry[field + 1 :]
+                if key in groups:
+                    values = groups[key][field]
+                    if entry[field] is not None:
+                        values = values | entry[field]
+                    groups[key] = key[:field] + (values,) + key[field:]
+                else:
+                    groups[key] = entry
+            merged = merged or len(groups) < len(entries)
+            entries = list(groups.values())
+    return [
+        " ".join(
+            _cron_field(values, low, high)
+            for values, (low, high) in zip(entry, CRON_FIELDS)
+        )
+        for entry in entries
+    ]
+
+
+class PoolConfigError(AssertionError):
+    """Invalid pool configuration.
+
+    This is raised explicitly rather than with `assert`, so configurations are still
+    validated under `python -O`. It derives from AssertionError, which configuration
+    checks have always raised.
+
+    Attributes:
+        source (str): file the configuration was loaded from
+        errors (list of (str, str)): key path and message for each problem found
+    """
+
+    def __init__(self, source, errors):
+        self.source = source
+        self.errors = list(errors)
+        super().__init__(
+            "\n".join(f"{source}: {message}" for _, message in self.errors)
+        )
+
+
+class PoolValidator:
+    """Validator for the raw data of one configuration type (see `FIELD_TYPES`).
+
+    The checks for each field are looked up once, and a validation reports every
+    problem found rather than stopping at the first. Results are cached by content
+    and types (see `_tagged`), so the same data is only checked once.
+    """
+
+    # additional checks for fields which passed the type check
+    VALUE_CHECKS = types.MappingProxyType(
+        {
+            "artifacts": _check_artifacts,
+            "cloud": _check_cloud,
+            "container": _check_container,
+            "cpu": _check_cpu,
+            "macros": _check_macros,
+            "schedule_start": _check_schedule_start,
+        }
+    )
+
+    def __init__(self, field_types, required_fields):
+        self.fields = frozenset(field_types)
+        self.required_fields = frozenset(required_fields)
+        self._checks = []
+        for field, cls in field_types.items():
+            if not isinstance(cls, tuple):
+                cls = (cls,)
+            expected = " or ".join(f"'{c.__name__}'" for c in cls)
+            if field in TYPED_FIELDS:
+                parse = TYPED_FIELDS[field].parse
+                check = functools.partial(_check_parsed, field, parse)
+            else:
+                check = self.VALUE_CHECKS.get(field)
+            self._checks.append((field, cls, expected, check))
+        self._results = {}
+
+    def errors(self, data):
+        """Find all problems in a configuration
+
+        Args:
+            data (dict): pool.yml contents
+
+        Returns:
+            list of (str, str): key path and message for each problem found
+        """
+        try:
+            key = _tagged(data)
+            cached = self._results.get(key)
+        except TypeError:
+            # unhashable values, don't cache
+            key = cached = None
+        if cached is not None:
+            return list(cached)
+
+        if not isinstance(data, dict):
+            result = [
+                ("", f"expected configuration to be 'dict', got {_type_name(data)}")
+            ]
+        else:
+            result = []
+            missing = sorted(self.required_fields - set(data))
+            extra = sorted(set(data) - self.fields, key=str)
+            if missing:
+                result.append(("", f"configuration is missing fields: {missing!r}"))
+            if extra:
+                result.append(("", f"configuration has extra fields: {extra!r}"))
+            for field, cls, expected, check in self._checks:
+                value = data.get(field)
+                if value is None:
+                    if field in self.required_fields and field in data:
+                        result.append(
+                            (field, f"{field} is required for every configuration")
+                        )
+                elif not isinstance(value, cls):
+                    result.append(
+                        (
+                            field,
+                            f"expected '{field}' to be {expected}, "
+                            f"got '{_type_name(value)}'",
+                        )
+                    )
+                elif check is not None:
+                    result.extend(check(value))
+
+        if key is not None:
+            self._results[key] = tuple(result)
+        return result
+
+    def validate(self, data, source):
+        """Check a configuration, raising if it has any problem
+
+        Args:
+            data (dict): pool.yml contents
+            source (str): where `data` was loaded from, for error messages
+
+        Raises:
+            PoolConfigError: if any problem is found
+        """
+        errors = self.errors(data)
+        if errors:
+            raise PoolConfigError(source, errors)
+
+
+class FrozenMapping(collections.abc.Mapping):
+    """Immutable and hashable mapping, used for dict fields of a ResolvedPool"""
+
+    __slots__ = ("_data", "_hash")
+
+    def __init__(self, data):
+        self._data = dict(data)
+        self._hash = None
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(frozenset(self._data.items()))
+        return self._hash
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._data!r})"
+
+
+def _tagged(value):
+    """Key of a configuration value which also compares the types of its items, as
+    True == 1 == 1.0 and [1] == (1,) for Python, but not for a pool configuration
+    """
+    if isinstance(value, (tuple, list)):
+        return (type(value), tuple(_tagged(v) for v in value))
+    if isinstance(value, (FrozenMapping, dict)):
+        return (
+            type(value),
+            frozenset((_tagged(k), _tagged(v)) for k, v in value.items()),
+        )
+    return (type(value), value)
+
+
+def freeze(value, interned=None):
+    """Convert a configuration value to an immutable one.
+
+    Dicts become FrozenMapping and lists become tuples, recursively. Strings are
+    interned, and so are containers if `interned` is given, so equal values are
+    stored only once.
+
+    Args:
+        value: value of a configuration field
+        interned (dict): canonical instance of each frozen container, by `_tagged()`
+                         key, shared by the values to deduplicate
+
+    Returns:
+        hashable equivalent of `value`
+    """
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, collections.abc.Mapping):
+        value = FrozenMapping(
+            (freeze(k, interned), freeze(v, interned)) for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple)):
+        value = tuple(freeze(v, interned) for v in value)
+    else:
+        return value
+    if interned is None:
+        return value
+    return interned.setdefault(_tagged(value), value)
+
+
+class ResolvedPool:
+    """Immutable, hashable view of a flattened pool configuration.
+
+    Dict and list fields are stored as FrozenMapping and tuples, and shared between
+    all pools frozen with the same `interned` table (see `freeze()`). Pools compare
+    equal when all their fields are equal and of the same types.
+
+    Attributes:
+        pool_id (str): basename of the pool on disk
+
+    and each field of COMMON_FIELD_TYPES, as documented in CommonPoolConfiguration.
+    """
+
+    __slots__ = ("pool_id",) + tuple(sorted(COMMON_FIELD_TYPES)) + ("_hash",)
+    FIELDS = __slots__[:-1]
+
+    def __init__(self, interned=None, **fields):
+        missing = set(self.FIELDS) - set(fields)
+        extra = set(fields) - set(self.FIELDS)
+        if missing or extra:
+            raise TypeError(
+                f"ResolvedPool missing fields {sorted(missing)!r}, "
+                f"with unknown fields {sorted(extra)!r}"
+            )
+        for field in self.FIELDS:
+            object.__setattr__(self, field, freeze(fields[field], interned))
+        object.__setattr__(self, "_hash", None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    __delattr__ = __setattr__
+
+    def __reduce__(self):
+        return (_resolved_pool, (dict(zip(self.FIELDS, self._values())),))
+
+    def _values(self):
+        return tuple(getattr(self, field) for field in self.FIELDS)
+
+    def __eq__(self, other):
+        if not isinstance(other, ResolvedPool):
+            return NotImplemented
+        return self is other or _tagged(self._values()) == _tagged(other._values())
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash(self._values()))
+        return self._hash
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.pool_id!r})"
+
+
+def _resolved_pool(fields):
+    return ResolvedPool(**fields)
 
 
 class MachineTypes:
@@ -131,20 +688,96 @@ class MachineTypes:
                 assert arch in ARCHITECTURES, f"unknown architecture: {provider}.{arch}"
                 for machine, spec in machines.items():
                     missing = list({"cpu", "ram"} - set(spec))
-                    extra = list(set(spec) - {"cpu", "ram", "metal", "zone_blacklist"})
+                    extra = list(
+                        set(spec) - {"cpu", "ram", "metal", "price", "zone_blacklist"}
+                    )
                     assert (
                         not missing
                     ), f"machine {provider}.{arch}.{machine} missing required keys: {missing!r}"
                     assert (
                         not extra
                     ), f"machine {provider}.{arch}.{machine} has unknown keys: {extra!r}"
+                    for price in self._iter_prices(spec.get("price")):
+                        assert isinstance(price, (int, float)) and price >= 0, (
+                            f"machine {provider}.{arch}.{machine} has invalid price: "
+                            f"{price!r}"
+                        )
         self._data = machines_data
 
+        # (provider, arch, cpu, metal) -> ([ram per cpu], [(position, name, cpu,
+        # blacklist, price)]) sorted by ram per cpu, so machines with enough ram are
+        # found by bisection
+        index = {}
+        for provider, provider_archs in machines_data.items():
+            for arch, machines in provider_archs.items():
+                for position, (machine, spec) in enumerate(machines.items()):
+                    entry = (
+                        spec["ram"] / spec["cpu"],
+                        position,
+                        machine,
+                        spec["cpu"],
+                        frozenset(spec.get("zone_blacklist", [])),
+                        min(self._iter_prices(spec.get("price")), default=None),
+                    )
+                    # a machine is a candidate for non-metal requirements in any case
+                    index.setdefault((provider, arch, spec["cpu"], False), []).append(
+                        entry
+                    )
+                    if spec.get("metal", False):
+                        index.setdefault(
+                            (provider, arch, spec["cpu"], True), []
+                        ).append(entry)
+        # (provider, arch, metal) -> cpu counts available
+        self._cpus = {}
+        for provider, arch, cpu, metal in index:
+            self._cpus.setdefault((provider, arch, metal), set()).add(cpu)
+        self._index = {}
+        for key, entries in index.items():
+            entries.sort()
+            self._index[key] = (
+                [entry[0] for entry in entries],
+                [entry[1:] for entry in entries],
+            )
+        # results of query(), shared by every pool with the same requirements
+        self._queries = {}
+
     @classmethod
     def from_file(cls, machines_yml):
         assert machines_yml.is_file()
         return cls(yaml.safe_load(machines_yml.read_text()))
 
+    @classmethod
+    def _iter_prices(cls, price):
+        """Generate every price in a `price` table (see `price()`)"""
+        if isinstance(price, dict):
+            for value in price.values():
+                yield from cls._iter_prices(value)
+        elif price is not None:
+            yield price
+
+    def price(self, provider, architecture, machine, region=None, zone=None):
+        """Get the hourly price of a machine, from the optional `price` in machines.yml
+
+        `price` is either a single price, or a mapping of region to price, or of
+        region to a mapping of zone to price.
+
+        Args:
+            provider (str): the cloud provider (aws or google)
+            architecture (str): the cpu architecture (x64 or arm64)
+            machine (str): the machine type name
+            region (str): the region the machine would run in
+            zone (str): the zone the machine would run in
+
+        Returns:
+            float: hourly price of one instance, or None if it is unknown
+        """
+        price = self._data[provider][architecture][machine].get("price")
+        if isinstance(price, dict):
+            price = price.get(region)
+        if isinstance(price, dict):
+            price = price.get(zone)
+        return price
+
     def cpus(self, provider, architecture, machine):
         return self._data[provider][architecture][machine]["cpu"]
 
@@ -166,13 +799,73 @@ class MachineTypes:
         Returns:
             generator of str: machine type names for the given provider/architecture
         """
-        for name, spec in self._data[provider][architecture].items():
-            if (
-                spec["cpu"] == min_cpu
-                and (spec["ram"] / spec["cpu"]) >= min_ram_per_cpu
-            ):
-                if not metal or (metal and spec.get("metal", False)):
-                    yield name
+        for name, _, _ in self.query(
+            provider, architecture, min_cpu, min_ram_per_cpu, metal
+        ):
+            yield name
+
+    def query(
+        self, provider, architecture, min_cpu, min_ram_per_cpu, metal=False, pack=False
+    ):
+        """Find the machine types which fit the given requirements.
+
+        Results are cached, so pools with the same requirements share them.
+
+        Args:
+            provider (str): the cloud provider (aws or google)
+            architecture (str): the cpu architecture (x64 or arm64)
+            min_cpu (int): the number of cpu cores required
+            min_ram_per_cpu (float): the least amount of memory acceptable per cpu core
+            metal (bool): whether a bare-metal instance is required
+            pack (bool): also accept machines with a multiple of `min_cpu` cores, so
+                         several tasks can run on one instance
+
+        Returns:
+            tuple of (str, int, frozenset): name, number of cpus and zone blacklist of
+                each machine. in machines.yml order, or if `pack` is set, cheapest
+                first (by lowest price per cpu if every machine has a price, or else
+                by ram per cpu)
+        """
+        key = (provider, architecture, min_cpu, min_ram_per_cpu, bool(metal), pack)
+        result = self._queries.get(key)
+        if result is None:
+            # unknown provider/architecture raise KeyError
+            self._data[provider][architecture]
+            if pack:
+                cpu_counts = [
+                    cpu
+                    for cpu in self._cpus.get((provider, architecture, bool(metal)), ())
+                    if cpu % min_cpu == 0
+                ]
+            else:
+                cpu_counts = [min_cpu]
+            # (ram per cpu, position, name, cpus, zone blacklist, price)
+            found = []
+            for cpu in cpu_counts:
+                ratios, machines = self._index.get(
+                    (provider, architecture, cpu, bool(metal)), ((), ())
+                )
+                start = bisect.bisect_left(ratios, min_ram_per_cpu)
+                found.extend(
+                    (ratio,) + machine
+                    for ratio, machine in zip(ratios[start:], machines[start:])
+                )
+            by_price = pack and all(machine[-1] is not None for machine in found)
+
+            def _rank(machine):
+                ratio, position, _, cpus, _, price = machine
+                if by_price:
+                    return (price / cpus, position)
+                if pack:
+                    return (ratio, position)
+                return (position,)
+
+            result = tuple(
+                (name, cpus, zone_blacklist)
+                for _, _, name, cpus, zone_blacklist, _ in sorted(found, key=_rank)
+            )
+            self._queries[key] = result
+        return result
 
 
 class CommonPoolConfiguration(abc.ABC):
@@ -186,104 +879,43 @@ class CommonPoolConfiguration(abc.ABC):
             https://docs.taskcluster.net/docs/reference/workers/docker-worker/payload
         cores_per_task (int): number of cores to be allocated per task
         cpu (int): cpu architecture (eg. x64/arm64)
-        cycle_time (int): schedule for running this pool in seconds
-        disk_size (int): disk size in GB
+        cycle_time (Duration): schedule for running this pool in seconds
+        disk_size (Size): disk size in bytes
         imageset (str): imageset name in community-tc-config/config/imagesets.yml
         macros (dict): dictionary of environment variables passed to the target
-        max_run_time (int): maximum run time of this pool in seconds
+        max_run_time (Duration): maximum run time of this pool in seconds
         metal (bool): whether or not the target requires to be run on bare metal
-        minimum_memory_per_core (float): minimum RAM to be made available per core in GB
+        minimum_memory_per_core (Size): minimum RAM to be made available per core
         name (str): descriptive name of the configuration
+        pack_tasks (bool): whether instances with a multiple of `cores_per_task` cores
+            can be used, to run several tasks per instance
         platform (str): operating system of the target (linux, windows)
         pool_id (str): basename of the pool on disk (eg. "pool1" for pool1.yml)
         preprocess (str): name of pool configuration to apply and run before fuzzing tasks
-        schedule_start (datetime): reference date for `cycle_time` scheduling
+        schedule_start (datetime): reference date for `cycle_time` scheduling (derived
+            from the pool id if unset)
         scopes (list): list of taskcluster scopes required by the target
         tasks (int): number of tasks to run (each with `cores_per_task`)
     """
 
     def __init__(self, pool_id, data, base_dir=None):
         LOG.debug(f"creating pool {pool_id}")
-        extra = list(set(data) - set(self.FIELD_TYPES))
-        missing = list(set(self.REQUIRED_FIELDS) - set(data))
-        assert not missing, f"configuration is missing fields: {missing!r}"
-        assert not extra, f"configuration has extra fields: {extra!r}"
+        self.validator().validate(
+            data, str(base_dir / f"{pool_id}.yml") if base_dir else pool_id
+        )
 
         # "normal" fields
         self.pool_id = pool_id
         self.base_dir = base_dir or pathlib.Path.cwd()
-
-        # check that all fields are of the right type (or None)
-        for field, cls in self.FIELD_TYPES.items():
-            if data.get(field) is not None:
-                if isinstance(cls, tuple):
-                    expected = f"'{cls[0].__name__}' or '{cls[1].__name__}'"
-                else:
-                    expected = f"'{cls.__name__}'"
-                assert isinstance(
-                    data[field], cls
-                ), f"expected '{field}' to be {expected}, got '{type(data[field]).__name__}'"
-        if isinstance(data.get("container"), dict):
-            value = data["container"]
-            assert "type" in value, "'container' missing required key: 'type'"
-            assert value["type"] in {
-                "docker-image",
-                "indexed-image",
-                "task-image",
-            }, f"unknown 'container.type': {value['type']}"
-            required_keys = {
-                "docker-image": {"type", "name"},
-                "indexed-image": {"type", "path", "namespace"},
-                "task-image": {"type", "path", "taskId"},
-            }[value["type"]]
-            have_keys = set(value.keys())
-            missing_keys = required_keys - have_keys
-            extra_keys = have_keys - required_keys
-            assert (
-                not missing_keys
-            ), f"missing required keys for 'container' with type '{value['type']}': {', '.join(missing_keys)}"
-            assert (
-                not extra_keys
-            ), f"unknown keys for 'container' with type '{value['type']}': {', '.join(extra_keys)}"
-            for k, v in value.items():
-                assert isinstance(
-                    v, str
-                ), f"unexpected type for 'container.{k}': {type(v).__name__}"
-        for key, value in data.get("artifacts", {}).items():
-            assert isinstance(key, str), (
-                f"expected artifact '{key!r}' name to be 'str', "
-                f"got '{type(key).__name__}'"
-            )
-            assert isinstance(value, dict), (
-                f"expected artifact '{key}' value to be 'dict', "
-                f"got '{type(value).__name__}'"
-            )
-            assert set(value.keys()) == {
-                "url",
-                "type",
-            }, f"expected artifact '{key}' object to contain only keys: url, type"
-            assert isinstance(value["url"], str), (
-                f"expected artifact '{key}' .url to be 'str', "
-                f"got '{type(value['url']).__name__}'"
-            )
-            assert value["type"] in {
-                "file",
-                "directory",
-            }, f"expected artifact '{key}' .type to be one of: file, directory"
-        for key, value in data.get("macros", {}).items():
-            assert isinstance(
-                key, str
-            ), f"expected macro '{key!r}' name to be 'str', got '{type(key).__name__}'"
-            assert isinstance(
-                value, (int, str)
-            ), f"expected macro '{key}' value to be 'int' or 'str', got '{type(value).__name__}'"
+        # compiled bundle this configuration was loaded from (see PoolConfigLoader)
+        self._bundle = None
 
         self.container = data.get("container")
         self.cores_per_task = data.get("cores_per_task")
         self.imageset = data.get("imageset")
         self.metal = data.get("metal")
+        self.pack_tasks = data.get("pack_tasks")
         self.name = data["name"]
-        assert self.name is not None, "name is required for every configuration"
         self.platform = data.get("platform")
         self.tasks = data.get("tasks")
         self.preprocess = data.get("preprocess")
@@ -303,19 +935,17 @@ class CommonPoolConfiguration(abc.ABC):
         # size fields
         self.minimum_memory_per_core = self.disk_size = None
         if data.get("minimum_memory_per_core") is not None:
-            self.minimum_memory_per_core = parse_size(
-                str(data["minimum_memory_per_core"])
-            ) / parse_size("1g")
+            self.minimum_memory_per_core = Size.parse(data["minimum_memory_per_core"])
         if data.get("disk_size") is not None:
-            self.disk_size = int(parse_size(str(data["disk_size"])) / parse_size("1g"))
+            self.disk_size = Size.parse(data["disk_size"])
 
         # time fields
         self.cycle_time = None
         if data.get("cycle_time") is not None:
-            self.cycle_time = parse_time(str(data["cycle_time"]))
+            self.cycle_time = Duration.parse(data["cycle_time"])
         self.max_run_time = None
         if data.get("max_run_time") is not None:
-            self.max_run_time = parse_time(str(data["max_run_time"]))
+            self.max_run_time = Duration.parse(data["max_run_time"])
         self.schedule_start = None
         if data.get("schedule_start") is not None:
             if isinstance(data["schedule_start"], datetime):
@@ -326,15 +956,21 @@ class CommonPoolConfiguration(abc.ABC):
         # other special fields
         self.cpu = None
         if data.get("cpu") is not None:
-            cpu = self.alias_cpu(data["cpu"])
-            assert cpu in ARCHITECTURES
-            self.cpu = cpu
-        self.cloud = None
-        if data.get("cloud") is not None:
-            assert data["cloud"] in PROVIDERS, "Invalid cloud - use {}".format(
-                ",".join(PROVIDERS)
-            )
-            self.cloud = data["cloud"]
+            self.cpu = self.alias_cpu(data["cpu"])
+        self.cloud = data.get("cloud")
+
+    @classmethod
+    def validator(cls):
+        """Get the validator for this configuration type, built on first use
+
+        Returns:
+            PoolValidator: validator for `FIELD_TYPES` and `REQUIRED_FIELDS`
+        """
+        validator = _VALIDATORS.get(cls)
+        if validator is None:
+            validator = PoolValidator(cls.FIELD_TYPES, cls.REQUIRED_FIELDS)
+            _VALIDATORS[cls] = validator
+        return validator
 
     @classmethod
     def from_file(cls, pool_yml, **kwds):
@@ -346,6 +982,83 @@ class CommonPoolConfiguration(abc.ABC):
             **kwds,
         )
 
+    def _error(self, errors, pool_id=None):
+        """Build the error for problems found in a configuration file.
+
+        Args:
+            errors (list of (str, str)): key path and message for each problem
+            pool_id (str): configuration the problems are in, if not this one
+
+        Returns:
+            PoolConfigError: the error to raise
+        """
+        source = self.base_dir / f"{pool_id or self.pool_id}.yml"
+        return PoolConfigError(str(source), errors)
+
+    @classmethod
+    def _cache_key(cls, pool_yml):
+        return (cls, pool_yml.resolve())
+
+    @staticmethod
+    def _stamp(pool_yml):
+        stat = pool_yml.stat()
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def to_resolved(self):
+        """Serialize the resolved configuration, for use in a compiled bundle.
+
+        Returns:
+            dict: JSON serializable field values, as accepted by `from_resolved()`
+        """
+        result = {field: getattr(self, field) for field in self.FIELD_TYPES}
+        if result["schedule_start"] is not None:
+            result["schedule_start"] = result["schedule_start"].isoformat()
+        return result
+
+    def freeze(self, interned=None):
+        """Get an immutable copy of this configuration.
+
+        Args:
+            interned (dict): table of shared sub-structures (see `freeze()`)
+
+        Returns:
+            ResolvedPool: the configuration, with sub-structures shared with any other
+                          ResolvedPool frozen with the same table
+        """
+        return ResolvedPool(
+            interned,
+            pool_id=self.pool_id,
+            **{field: getattr(self, field) for field in COMMON_FIELD_TYPES},
+        )
+
+    @classmethod
+    def from_resolved(cls, pool_id, data, base_dir=None, bundle=None):
+        """Create a configuration from values produced by `to_resolved()`.
+
+        The values are trusted: no validation or flattening is done.
+
+        Args:
+            pool_id (str): id of the configuration
+            data (dict): resolved field values
+            base_dir (pathlib.Path): directory containing the pool.yml files
+            bundle (dict): compiled bundle `data` was loaded from
+
+        Returns:
+            CommonPoolConfiguration: the configuration
+        """
+        result = cls.__new__(cls)
+        result.pool_id = pool_id
+        result.base_dir = base_dir or pathlib.Path.cwd()
+        result._bundle = bundle
+        for field in cls.FIELD_TYPES:
+            setattr(result, field, copy.deepcopy(data[field]))
+        for field, field_type in TYPED_FIELDS.items():
+            if getattr(result, field) is not None:
+                setattr(result, field, field_type(getattr(result, field)))
+        if result.schedule_start is not None:
+            result.schedule_start = dateutil.parser.isoparse(result.schedule_start)
+        return result
+
     def get_machine_list(self, machine_types):
         """
         Args:
@@ -354,22 +1067,72 @@ class CommonPoolConfiguration(abc.ABC):
         Returns:
             generator of machine (name, capacity): instance type name and task capacity
         """
-        yielded = False
-        for machine in machine_types.filter(
+        machines = machine_types.query(
             self.cloud,
             self.cpu,
             self.cores_per_task,
-            self.minimum_memory_per_core,
+            self.minimum_memory_per_core.gigabytes,
             self.metal,
-        ):
-            cpus = machine_types.cpus(self.cloud, self.cpu, machine)
-            zone_blacklist = machine_types.zone_blacklist(self.cloud, self.cpu, machine)
+            bool(self.pack_tasks),
+        )
+        assert machines, "No available machines match specified configuration"
+        for machine, cpus, zone_blacklist in machines:
             yield (machine, cpus // self.cores_per_task, zone_blacklist)
-            yielded = True
-        assert yielded, "No available machines match specified configuration"
+
+    def machine_prices(self, machine_types):
+        """
+        Args:
+            machine_types (MachineTypes): database of all machine types
+
+        Returns:
+            callable: (instance, region, zone) -> hourly price of an instance, or None
+        """
+        return functools.partial(machine_types.price, self.cloud, self.cpu)
+
+    def schedule_phase(self):
+        """Get a stable reference date for `cycle_time` scheduling, when
+        `schedule_start` is not set.
+
+        The offset in the cycle is derived from the pool id, so schedules don't change
+        between runs, and pools are spread evenly over the cycle.
+
+        Returns:
+            datetime: reference date, within one cycle of the epoch
+        """
+        digest = hashlib.sha256(self.pool_id.encode("utf-8")).hexdigest()
+        phase = int(digest, 16) % int(self.cycle_time)
+        return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=phase)
+
+    def schedule_anchor(self):
+        """Get the UTC reference date of `cycle_time` scheduling: schedule_start, or
+        `schedule_phase()` if it isn't set.
+
+        Returns:
+            datetime: the hook fires at this date plus any multiple of cycle_time
+        """
+        if self.schedule_start is None:
+            return self.schedule_phase()
+        if self.schedule_start.utcoffset() is None:
+            # no timezone was specified. treat it as UTC
+            return self.schedule_start.replace(tzinfo=timezone.utc)
+        # timezone was given, shift the datetime to be equivalent but in UTC
+        return self.schedule_start.astimezone(timezone.utc)
+
+    def iterconfigs(self):
+        """Generate the configurations the resources of this pool are built from:
+        itself, the pools of a map and their preprocess configurations.
+        """
+        yield self
+        for pool in self.iterpools():
+            if pool is not self:
+                yield pool
+            preprocess = pool.create_preprocess()
+            if preprocess is not None:
+                yield preprocess
 
     def cycle_crons(self):
-        """Generate cron patterns that correspond to cycle_time (starting from now)
+        """Generate cron patterns that correspond to cycle_time (starting from
+        `schedule_anchor()`)
 
         Args:
             None
@@ -378,43 +1141,44 @@ class CommonPoolConfiguration(abc.ABC):
             generator of str: One or more strings in simple cron format. If all patterns
                               are installed, the result should correspond to cycle_time.
         """
-        if self.schedule_start is not None:
-            now = self.schedule_start
-            if now.utcoffset() is None:
-                # no timezone was specified. treat it as UTC
-                now = now.replace(tzinfo=timezone.utc)
-            else:
-                # timezone was given, shift the datetime to be equivalent but in UTC
-                now = now.astimezone(timezone.utc)
-        else:
-            now = datetime.now(timezone.utc)
+        now = self.schedule_anchor()
         interval = timedelta(seconds=self.cycle_time)
 
-        # special case if the cycle time is a factor of 24 hours
+        # the schedule is generated for the shortest period in which the cycle fits
+        #   evenly: a day, a week, or if the cycle can't be represented as a daily or
+        #   weekly pattern, a year.
+        # an annual schedule will glitch if it really runs for the full year, and
+        #   either have dead time or overlapping runs, happening once around the
+        #   anniversary.
         if (24 * 60 * 60) % self.cycle_time == 0:
             stop = now + timedelta(days=1)
-            while now < stop:
-                now += interval
-                yield f"{now.second} {now.minute} {now.hour} * * *"
-            return
 
-        # special case if the cycle time is a factor of 7 days
-        if (7 * 24 * 60 * 60) % self.cycle_time == 0:
+            def _fields(when):
+                return (when.second, when.minute, when.hour, None, None, None)
+
+        elif (7 * 24 * 60 * 60) % self.cycle_time == 0:
             stop = now + timedelta(days=7)
-            while now < stop:
-                now += interval
-                weekday = now.isoweekday() % 7
-                yield f"{now.second} {now.minute} {now.hour} * * {weekday}"
-            return
 
-        # if the cycle can't be represented as a daily or weekly pattern, then it is
-        #   awkward to represent in cron format: resort to generating an annual schedule
-        # the cycle will glitch if it really runs for the full year, and either have
-        #   dead time or overlapping runs, happening once around the anniversary.
-        stop = now + timedelta(days=365)
+            def _fields(when):
+                weekday = when.isoweekday() % 7
+                return (when.second, when.minute, when.hour, None, None, weekday)
+
+        else:
+            stop = now + timedelta(days=365)
+            drift = (365 * 24 * 60 * 60) % self.cycle_time
+            LOG.info(
+                f"{self.pool_id}: cycle_time doesn't divide a day or a week, the "
+                f"annual schedule drifts by {drift}s at each anniversary"
+            )
+
+            def _fields(when):
+                return (when.second, when.minute, when.hour, when.day, when.month, None)
+
+        occurrences = []
         while now < stop:
             now += interval
-            yield f"{now.second} {now.minute} {now.hour} {now.day} {now.month} *"
+            occurrences.append(_fields(now))
+        yield from compress_crons(occurrences)
 
     @staticmethod
     def alias_cpu(cpu_name):
@@ -450,27 +1214,38 @@ class PoolConfiguration(CommonPoolConfiguration):
             _flattened = {self.pool_id}
         self._flatten(_flattened)
         if top_level:
-            # set defaults
-            if self.artifacts is None:
-                self.artifacts = {}
-            if self.command is None:
-                self.command = []
-            if self.macros is None:
-                self.macros = {}
-            if self.max_run_time is None:
-                self.max_run_time = self.cycle_time
-            if self.parents is None:
-                self.parents = []
-            if self.preprocess is None:
-                self.preprocess = ""
-            if self.scopes is None:
-                self.scopes = []
-            # assert complete
-            missing = {
-                field for field in self.FIELD_TYPES if getattr(self, field) is None
-            }
-            missing.discard("schedule_start")  # this field can be null
-            assert not missing, f"Pool is missing fields: {list(missing)!r}"
+            self._set_defaults()
+
+    def _set_defaults(self):
+        """Set defaults for fields left empty once flattened, and check that the
+        configuration is complete.
+        """
+        if self.artifacts is None:
+            self.artifacts = {}
+        if self.command is None:
+            self.command = []
+        if self.macros is None:
+            self.macros = {}
+        if self.max_run_time is None:
+            self.max_run_time = self.cycle_time
+        if self.pack_tasks is None:
+            self.pack_tasks = False
+        if self.parents is None:
+            self.parents = []
+        if self.preprocess is None:
+            self.preprocess = ""
+        if self.scopes is None:
+            self.scopes = []
+        # check complete
+        missing = {field for field in self.FIELD_TYPES if getattr(self, field) is None}
+        missing.discard("schedule_start")  # this field can be null
+        if missing:
+            raise self._error(
+                [
+                    (field, f"Pool is missing field: {field}")
+                    for field in sorted(missing)
+                ]
+            )
 
     def create_preprocess(self):
         """
@@ -478,11 +1253,16 @@ class PoolConfiguration(CommonPoolConfiguration):
         """
         if not self.preprocess:
             return None
-        data = yaml.safe_load((self.base_dir / f"{self.preprocess}.yml").read_text())
         pool_id = self.pool_id + "/preprocess"
-        assert data["tasks"] == 1 or (
-            self.tasks == 1 and data["tasks"] is None
-        ), f"{self.preprocess} must set tasks = 1"
+        if self._bundle is not None:
+            return type(self).from_resolved(
+                pool_id, self._bundle["pools"][pool_id], self.base_dir, self._bundle
+            )
+        data = yaml.safe_load((self.base_dir / f"{self.preprocess}.yml").read_text())
+        if data["tasks"] != 1 and (self.tasks != 1 or data["tasks"] is not None):
+            raise self._error(
+                [("tasks", f"{self.preprocess} must set tasks = 1")], self.preprocess
+            )
         cannot_set = [
             "disk_size",
             "cores_per_task",
@@ -492,18 +1272,72 @@ class PoolConfiguration(CommonPoolConfiguration):
             "imageset",
             "metal",
             "minimum_memory_per_core",
+            "pack_tasks",
             "platform",
             "preprocess",
             "schedule_start",
         ]
-        for field in cannot_set:
-            assert data.get(field) is None, f"{self.preprocess} cannot set {field}"
+        errors = [
+            (field, f"{self.preprocess} cannot set {field}")
+            for field in cannot_set
+            if data.get(field) is not None
+        ]
+        if errors:
+            raise self._error(errors, self.preprocess)
         data["preprocess"] = ""  # blank the preprocess field to avoid inheritance
         data["parents"] = [self.pool_id] + data.get("parents", [])
         result = type(self)(pool_id, data, self.base_dir)
         result.name = f"{self.name} ({result.name})"
         return result
 
+    def iterpools(self):
+        yield self
+
+    @classmethod
+    def _resolve_parent(cls, pool_yml, flattened):
+        """Load a parent configuration, flattened.
+
+        The result is cached for as long as the file and all its ancestors on disk are
+        unchanged, so a config inherited by many pools is only parsed and flattened
+        once. The returned object is shared and must not be modified.
+
+        Args:
+            pool_yml (pathlib.Path): path to the parent pool.yml
+            flattened (set): ids of the configurations being resolved (for cycles)
+
+        Returns:
+            PoolConfiguration: the flattened parent (without defaults applied)
+        """
+        assert pool_yml.is_file()
+        key = cls._cache_key(pool_yml)
+        cached = _RESOLVED_PARENTS.get(key)
+        if cached is not None:
+            stamps, result = cached
+            if all(
+                path.is_file() and cls._stamp(path) == stamp
+                for path, stamp in stamps.items()
+            ):
+                cycle = {path.stem for path in stamps if path != key[1]} & flattened
+                if cycle:
+                    raise result._error(
+                        [
+                            (
+                                "parents",
+                                "attempt to resolve cyclic configuration, "
+                                f"{', '.join(sorted(cycle))} already encountered",
+                            )
+                        ]
+                    )
+                LOG.debug(f"using cached pool {result.pool_id}")
+                return result
+        stamps = {key[1]: cls._stamp(pool_yml)}
+        result = cls.from_file(pool_yml, _flattened=flattened)
+        for parent_id in result.parents:
+            parent_key = cls._cache_key(result.base_dir / f"{parent_id}.yml")
+            stamps.update(_RESOLVED_PARENTS[parent_key][0])
+        _RESOLVED_PARENTS[key] = (stamps, result)
+        return result
+
     def _flatten(self, flattened):
         overwriting_fields = (
             "cloud",
@@ -518,6 +1352,7 @@ class PoolConfiguration(CommonPoolConfiguration):
             "metal",
             "minimum_memory_per_core",
             "name",
+            "pack_tasks",
             "platform",
             "preprocess",
             "schedule_start",
@@ -534,12 +1369,20 @@ class PoolConfiguration(CommonPoolConfiguration):
         }
 
         for parent_id in self.parents:
-            assert (
-                parent_id not in flattened
-            ), f"attempt to resolve cyclic configuration, {parent_id} already encountered"
-            flattened.add(parent_id)
-            parent_obj = self.from_file(
-                self.base_dir / f"{parent_id}.yml", _flattened=flattened
+            # `flattened` holds the ancestors on the current path only, so a config
+            # may be reached more than once through different parents
+            if parent_id in flattened:
+                raise self._error(
+                    [
+                        (
+                            "parents",
+                            f"attempt to resolve cyclic configuration, {parent_id} "
+                            "already encountered",
+                        )
+                    ]
+                )
+            parent_obj = self._resolve_parent(
+                self.base_dir / f"{parent_id}.yml", flattened | {parent_id}
             )
 
             # "normal" overwriting fields
@@ -549,7 +1392,8 @@ class PoolConfiguration(CommonPoolConfiguration):
                         LOG.debug(
                             f"overwriting field {field} in {self.pool_id} from {parent_id}"
                         )
-                    setattr(self, field, getattr(parent_obj, field))
+                    # parent_obj is shared, don't alias its mutable values
+                    setattr(self, field, copy.deepcopy(getattr(parent_obj, field)))
 
             # merged dict fields
             for field in merge_dict_fields:
@@ -557,7 +1401,7 @@ class PoolConfiguration(CommonPoolConfiguration):
                     LOG.debug(
                         f"merging dict field {field} in {self.pool_id} from {parent_id}"
                     )
-                getattr(self, field).update(getattr(parent_obj, field))
+                getattr(self, field).update(copy.deepcopy(getattr(parent_obj, field)))
 
             # merged list fields
             for field in merge_list_fields:
@@ -568,7 +1412,7 @@ class PoolConfiguration(CommonPoolConfiguration):
                 setattr(
                     self,
                     field,
-                    list(set(getattr(self, field)) | set(getattr(parent_obj, field))),
+                    sorted(set(getattr(self, field)) | set(getattr(parent_obj, field))),
                 )
 
         # dict values defined in self take precedence over values defined in parents
@@ -587,12 +1431,32 @@ class PoolConfigMap(CommonPoolConfiguration):
     REQUIRED_FIELDS = POOL_MAP_REQUIRED_FIELDS
     RESULT_TYPE = PoolConfiguration
 
-    def __init__(self, pool_id, data, base_dir=None):
+    def __init__(self, pool_id, data, base_dir=None, lazy=False):
         super().__init__(pool_id, data, base_dir)
 
         # specific fields defined in pool config
         self.apply_to = data["apply_to"].copy()
 
+        # member pools are resolved once and shared by every later call
+        # if `lazy` is set, this is deferred until `pools` is first used
+        self._pools = None
+        if not lazy:
+            self._resolve_pools()
+
+    @classmethod
+    def from_resolved(cls, pool_id, data, base_dir=None, bundle=None):
+        result = super().from_resolved(pool_id, data, base_dir, bundle)
+        result._pools = None
+        return result
+
+    @property
+    def pools(self):
+        """tuple of PoolConfiguration: this map applied to each pool in `apply_to`"""
+        if self._pools is None:
+            self._resolve_pools()
+        return self._pools
+
+    def _resolve_pools(self):
         # while these fields are not required to be defined here, they must be the same for the entire set
         # .. at least for now
         same_fields = (
@@ -604,50 +1468,79 @@ class PoolConfigMap(CommonPoolConfiguration):
             "imageset",
             "metal",
             "minimum_memory_per_core",
+            "pack_tasks",
             "platform",
             "schedule_start",
         )
         not_allowed = ("preprocess",)
-        pools = list(self.iterpools())
+        if self._bundle is not None:
+            # already checked when the bundle was compiled
+            self._pools = tuple(
+                self.RESULT_TYPE.from_resolved(
+                    f"{parent}/{self.pool_id}",
+                    self._bundle["pools"][f"{parent}/{self.pool_id}"],
+                    self.base_dir,
+                    self._bundle,
+                )
+                for parent in self.apply_to
+            )
+            return
+        pools = tuple(self.apply(parent) for parent in self.apply_to)
+        errors = []
         for field in same_fields:
-            assert (
-                len({getattr(pool, field) for pool in pools}) == 1
-            ), f"{field} has multiple values"
+            if len({getattr(pool, field) for pool in pools}) != 1:
+                errors.append((field, f"{field} has multiple values"))
+                continue
             # set the field on self, so it can easily be used by decision
             setattr(self, field, getattr(pools[0], field))
         for field in not_allowed:
-            assert not any(
-                getattr(pool, field) for pool in pools
-            ), f"{field} cannot be defined"
+            if any(getattr(pool, field) for pool in pools):
+                errors.append((field, f"{field} cannot be defined"))
+        if errors:
+            raise self._error(errors)
+        self._pools = pools
 
     def apply(self, parent):
         pool_id = f"{parent}/{self.pool_id}"
         data = {k: getattr(self, k, None) for k in COMMON_FIELD_TYPES}
-        # convert special fields
-        for gig_field in ("disk_size", "minimum_memory_per_core"):
-            if data[gig_field] is not None:
-                data[gig_field] *= 1024 * 1024 * 1024
-        if data["schedule_start"] is not None:
-            data["schedule_start"] = data["schedule_start"].isoformat()
         # override fields
         data["parents"] = [parent]
-        name = self.RESULT_TYPE.from_file(self.base_dir / f"{parent}.yml").name
+        name = self.RESULT_TYPE._resolve_parent(
+            self.base_dir / f"{parent}.yml", {pool_id, parent}
+        ).name
         data["name"] = f"{name} ({self.name})"
         return self.RESULT_TYPE(pool_id, data, self.base_dir)
 
     def iterpools(self):
-        for parent in self.apply_to:
-            yield self.apply(parent)
+        yield from self.pools
 
 
 class PoolConfigLoader:
-    @staticmethod
-    def from_file(pool_yml):
+    POOL_TYPES = (PoolConfiguration, PoolConfigMap)
+
+    @classmethod
+    def identify(cls, data):
+        """Find the configuration type matching the keys of a pool.yml
+
+        Args:
+            data (dict): pool.yml contents
+
+        Returns:
+            type: one of `POOL_TYPES`, or None
+        """
+        if isinstance(data, dict):
+            for pool_cls in cls.POOL_TYPES:
+                if set(pool_cls.FIELD_TYPES) >= set(data) >= pool_cls.REQUIRED_FIELDS:
+                    return pool_cls
+        return None
+
+    @classmethod
+    def from_file(cls, pool_yml):
         assert pool_yml.is_file()
         data = yaml.safe_load(pool_yml.read_text())
-        for cls in (PoolConfiguration, PoolConfigMap):
-            if set(cls.FIELD_TYPES) >= set(data.keys()) >= cls.REQUIRED_FIELDS:
-                return cls(pool_yml.stem, data, base_dir=pool_yml.parent)
+        pool_cls = cls.identify(data)
+        if pool_cls is not None:
+            return pool_cls(pool_yml.stem, data, base_dir=pool_yml.parent)
         LOG.error(
             f"{pool_yml} has keys {data.keys()} and expected all of either "
             f"{PoolConfiguration.REQUIRED_FIELDS} or {PoolConfigMap.REQUIRED_FIELDS} to "
@@ -655,6 +1548,275 @@ class PoolConfigLoader:
         )
         raise RuntimeError(f"{pool_yml} type could not be identified!")
 
+    @classmethod
+    def compile(cls, config_dir, revision):
+        """Resolve every pool in a fuzzing configuration directory.
+
+        This includes the pools in each map, and the preprocess configuration of
+        each pool.
+
+        Args:
+            config_dir (pathlib.Path): fuzzing configuration directory
+            revision (str): git revision of `config_dir`
+
+        Returns:
+            dict: bundle to be serialized as JSON, and loaded with `from_bundle()`
+        """
+        pools = {}
+        for pool in PoolRepository(config_dir, cls).pools.values():
+            pools[pool.pool_id] = pool.to_resolved()
+            if isinstance(pool, PoolConfigMap):
+                for member in pool.pools:
+                    pools[member.pool_id] = member.to_resolved()
+            else:
+                preprocess = pool.create_preprocess()
+                if preprocess is not None:
+                    pools[preprocess.pool_id] = preprocess.to_resolved()
+        return {"revision": revision, "version": package_version(), "pools": pools}
+
+    @staticmethod
+    def load_bundle(bundle_json, revision):
+        """Load a compiled bundle, if it can be used for the given revision.
+
+        Args:
+            bundle_json (pathlib.Path): bundle written from the result of `compile()`
+            revision (str): git revision of the fuzzing configuration in use
+
+        Returns:
+            dict: the bundle, or None if it is missing or was compiled for another
+                  revision or version of fuzzing-tc
+        """
+        if not bundle_json.is_file():
+            LOG.warning(f"Pool bundle {bundle_json} does not exist")
+            return None
+        bundle = json.loads(bundle_json.read_text())
+        if revision is None or bundle.get("revision") != revision:
+            LOG.warning(
+                f"Pool bundle is for revision {bundle.get('revision')}, not {revision}"
+            )
+            return None
+        if bundle.get("version") != package_version():
+            LOG.warning(
+                f"Pool bundle is for fuzzing-tc {bundle.get('version')}, "
+                f"not {package_version()}"
+            )
+            return None
+        return bundle
+
+    @classmethod
+    def from_bundle(cls, bundle, pool_id, base_dir=None):
+        """Load a single resolved configuration from a compiled bundle.
+
+        Args:
+            bundle (dict): bundle from `compile()` or `load_bundle()`
+            pool_id (str): id of the configuration (eg. "pool1", "pool1/map1" or
+                           "pool1/preprocess")
+            base_dir (pathlib.Path): fuzzing configuration directory
+
+        Returns:
+            CommonPoolConfiguration: the configuration
+        """
+        assert pool_id in bundle["pools"], f"Missing pool {pool_id}"
+        data = bundle["pools"][pool_id]
+        for pool_cls in cls.POOL_TYPES:
+            if set(pool_cls.FIELD_TYPES) == set(data):
+                return pool_cls.from_resolved(pool_id, data, base_dir, bundle)
+        raise RuntimeError(f"{pool_id} type could not be identified!")
+
+
+class PoolRepository:
+    """All pool configurations in a fuzzing configuration directory.
+
+    Every pool*.yml and the configurations it references through `parents`,
+    `apply_to` and `preprocess` are read once, and these references are checked up
+    front. Other YAML files in the directory are ignored. Configurations are then
+    resolved in dependency order, so each one is flattened exactly once. All missing
+    references, cycles and invalid configurations are reported together.
+
+    Attributes:
+        base_dir (pathlib.Path): fuzzing configuration directory
+        edges (dict): pool id -> {"parents": [...], "apply_to": [...], "preprocess": [...]}
+        pools (dict): pool id -> resolved configuration, for each pool*.yml
+    """
+
+    EDGE_KINDS = ("parents", "apply_to", "preprocess")
+
+    def __init__(self, base_dir, loader=None):
+        self.base_dir = base_dir
+        self._loader = loader or PoolConfigLoader
+        self._data = {}
+        self._types = {}
+        self._keys = {}
+        self._stamps = {}
+        self._flattened = {}
+        self.edges = {}
+        self.pools = {}
+
+        errors = []
+        self._scan(errors)
+        self._resolve(self._sort(errors), errors)
+        if errors:
+            for error in errors:
+                LOG.error(error)
+            raise RuntimeError(
+                f"{len(errors)} error(s) in pool configuration:\n" + "\n".join(errors)
+            )
+
+    def __getitem__(self, pool_id):
+        return self.pools[pool_id]
+
+    def resolved(self):
+        """Get an immutable copy of every configuration the resources of each pool
+        are built from: the pool, the pools of a map and the preprocess configuration.
+
+        Values shared between configurations are only stored once.
+
+        Returns:
+            dict: pool id -> tuple of ResolvedPool, the pool first
+        """
+        interned = {}
+        return {
+            pool_id: tuple(config.freeze(interned) for config in pool.iterconfigs())
+            for pool_id, pool in self.pools.items()
+        }
+
+    def _scan(self, errors):
+        # only pool*.yml and the configurations they reference are read, other YAML
+        # files in the directory aren't pool configurations
+        pending = sorted(pool_yml.stem for pool_yml in self.base_dir.glob("pool*.yml"))
+        seen = set(pending)
+        invalid = set()
+        while pending:
+            pool_id = pending.pop(0)
+            pool_yml = self.base_dir / f"{pool_id}.yml"
+            if not pool_yml.is_file():
+                continue
+            stat = pool_yml.stat()
+            try:
+                data = yaml.safe_load(pool_yml.read_text())
+            except yaml.YAMLError as exc:
+                errors.append(f"{pool_id}: YAML could not be parsed: {exc}")
+                invalid.add(pool_id)
+                continue
+            pool_cls = self._loader.identify(data)
+            if pool_cls is None:
+                errors.append(f"{pool_id}: type could not be identified")
+                invalid.add(pool_id)
+                continue
+            self._data[pool_id] = data
+            self._types[pool_id] = pool_cls
+            self._keys[pool_id] = pool_cls._cache_key(pool_yml)
+            self._stamps[pool_id] = {
+                self._keys[pool_id][1]: (stat.st_mtime_ns, stat.st_size)
+            }
+
+            edges = {kind: data.get(kind) or [] for kind in self.EDGE_KINDS}
+            if isinstance(edges["preprocess"], str):
+                edges["preprocess"] = [edges["preprocess"]]
+            for kind, targets in edges.items():
+                if not isinstance(targets, list):
+                    # the type is reported when the configuration is validated
+                    edges[kind] = targets = []
+                for target in targets:
+                    if isinstance(target, str) and target not in seen:
+                        seen.add(target)
+                        pending.append(target)
+            self.edges[pool_id] = edges
+
+        for pool_id, edges in self.edges.items():
+            for kind, targets in edges.items():
+                for target in targets:
+                    if target in invalid:
+                        # already reported
+                        continue
+                    if target not in self._data:
+                        errors.append(f"{pool_id}: {kind} {target!r} does not exist")
+                    elif issubclass(self._types[target], PoolConfigMap):
+                        errors.append(f"{pool_id}: {kind} {target!r} is a pool map")
+
+    def _sort(self, errors):
+        """Order pools so each one comes after everything in its `parents` and
+        `apply_to`. Preprocess configurations are resolved as children of the pool
+        using them, so they are not ordered.
+        """
+        order = []
+        visiting = set()
+        done = set()
+
+        def _visit(pool_id, path):
+            visiting.add(pool_id)
+            edges = self.edges[pool_id]
+            for dep in edges["parents"] + edges["apply_to"]:
+                if dep in visiting:
+                    cycle = path[path.index(dep) :] + [dep]
+                    errors.append(f"cyclic configuration: {' -> '.join(cycle)}")
+                elif dep in self._data and dep not in done:
+                    _visit(dep, path + [dep])
+            visiting.discard(pool_id)
+            done.add(pool_id)
+            order.append(pool_id)
+
+        for pool_id in self._data:
+            if pool_id not in done:
+                _visit(pool_id, [pool_id])
+        return order
+
+    def _resolve(self, order, errors):
+        # anything depending on a missing, cyclic or invalid configuration is skipped
+        # without error, since the cause has already been reported
+        for pool_id in order:
+            pool_cls = self._types[pool_id]
+            if issubclass(pool_cls, PoolConfigMap):
+                continue
+            if not all(
+                dep in self._flattened for dep in self.edges[pool_id]["parents"]
+            ):
+                continue
+            try:
+                flattened = pool_cls(
+                    pool_id,
+                    copy.deepcopy(self._data[pool_id]),
+                    base_dir=self.base_dir,
+                    _flattened={pool_id},
+                )
+            except PoolConfigError as exc:
+                errors.extend(f"{pool_id}: {message}" for _, message in exc.errors)
+                continue
+            except AssertionError as exc:
+                errors.append(f"{pool_id}: {exc}")
+                continue
+            # children find their parents through the cache in _resolve_parent()
+            for parent_id in self.edges[pool_id]["parents"]:
+                self._stamps[pool_id].update(self._stamps[parent_id])
+            _RESOLVED_PARENTS[self._keys[pool_id]] = (self._stamps[pool_id], flattened)
+            self._flattened[pool_id] = flattened
+
+        for pool_id in sorted(self._data):
+            if not pool_id.startswith("pool"):
+                continue
+            pool_cls = self._types[pool_id]
+            if issubclass(pool_cls, PoolConfigMap):
+                deps = self.edges[pool_id]["apply_to"]
+            else:
+                deps = [pool_id]
+            if not all(dep in self._flattened for dep in deps):
+                continue
+            try:
+                if issubclass(pool_cls, PoolConfigMap):
+                    pool = pool_cls(
+                        pool_id, copy.deepcopy(self._data[pool_id]), self.base_dir
+                    )
+                else:
+                    pool = copy.deepcopy(self._flattened[pool_id])
+                    pool._set_defaults()
+            except PoolConfigError as exc:
+                errors.extend(f"{pool_id}: {message}" for _, message in exc.errors)
+                continue
+            except AssertionError as exc:
+                errors.append(f"{pool_id}: {exc}")
+                continue
+            self.pools[pool_id] = pool
+
 
 def test_main():
     import argparse
@@ -676,7 +1838,7 @@ def test_main():
     parser.add_argument("--metal", help="bare metal machines", action="store_true")
     args = parser.parse_args()
 
-    ram = parse_size(args.ram) / parse_size("1g")
+    ram = parse_size(args.ram).gigabytes
     type_list = MachineTypes.from_file(args.input)
     for machine in type_list.filter(
         args.provider, args.cpu, args.cores, ram, args.metal
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import math
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+WEEK = 7 * 24 * 60 * 60
+
+# load of one pool, each time its hook fires:
+#   cycle: seconds between firings
+#   duration: seconds the tasks run for (until max_run_time, or the next firing)
+#   tasks: tasks created, including the decision task and preprocess
+#   cores: cores used by the tasks
+#   phase: seconds from the epoch to the first firing, modulo cycle
+#   fixed: phase is kept by `optimize()`
+PoolDemand = collections.namedtuple(
+    "PoolDemand", "cycle duration tasks cores phase fixed"
+)
+
+
+def pool_demand(pool, fixed=False):
+    """Model the load created by a pool or a pool map
+
+    Args:
+        pool (CommonPoolConfiguration): pool configuration
+        fixed (bool): whether the schedule of the pool should be kept
+
+    Returns:
+        PoolDemand: load of the pool
+    """
+    members = tuple(pool.iterpools())
+    cycle = int(pool.cycle_time)
+    anchor = pool.schedule_anchor()
+    return PoolDemand(
+        cycle=cycle,
+        duration=min(cycle, max(int(member.max_run_time) for member in members)),
+        tasks=1 + sum(member.tasks + bool(member.preprocess) for member in members),
+        cores=sum(member.tasks * member.cores_per_task for member in members),
+        phase=int((anchor - EPOCH).total_seconds()) % cycle,
+        fixed=fixed,
+    )
+
+
+def _window_max(values, length):
+    """Maximum of each circular window of `length` values
+
+    Args:
+        values (list): values over a circular timeline
+        length (int): length of the windows
+
+    Returns:
+        list: maximum of values[i:i + length], for each i
+    """
+    extended = values + values[: length - 1]
+    window = collections.deque()
+    result = []
+    for index, value in enumerate(extended):
+        while window and extended[window[-1]] <= value:
+            window.pop()
+        window.append(index)
+        if window[0] <= index - length:
+            window.popleft()
+        if index >= length - 1:
+            result.append(extended[window[0]])
+    return result
+
+
+class Stagger:
+    """Spread the `cycle_time` schedules of pools, to limit how many tasks are
+    created at once.
+
+    Time is modelled as a circular timeline of `resolution` second slots, covering
+    a week (or the longest cycle). Cycles which don't divide the timeline are
+    approximated by wrapping around it.
+
+    Attributes:
+        resolution (int): duration of a slot, in seconds
+        slots (int): number of slots in the timeline
+        pools (dict): pool id -> PoolDemand
+    """
+
+    def __init__(self, pools, resolution=300):
+        assert resolution > 0, "resolution must be positive"
+        self.resolution = resolution
+        self.pools = pools
+        horizon = max([WEEK] + [demand.cycle for demand in pools.values()])
+        self.slots = math.ceil(horizon / resolution)
+
+    @classmethod
+    def from_pools(cls, pools, resolution=300, reassign=False):
+        """
+        Args:
+            pools (dict): pool id -> CommonPoolConfiguration
+            resolution (int): duration of a slot, in seconds
+            reassign (bool): also move pools which set schedule_start
+
+        Returns:
+            Stagger: model of the given pools
+        """
+        return cls(
+            {
+                pool_id: pool_demand(
+                    pool, fixed=not reassign and pool.schedule_start is not None
+                )
+                for pool_id, pool in pools.items()
+            },
+            resolution,
+        )
+
+    def _starts(self, cycle, phase):
+        """Slots in which a pool fires"""
+        count = math.ceil(self.slots * self.resolution / cycle)
+        return sorted(
+            {
+                ((phase + cycle * occurrence) // self.resolution) % self.slots
+                for occurrence in range(count)
+            }
+        )
+
+    def _length(self, demand):
+        """Slots in which the tasks of a pool run"""
+        return max(1, math.ceil(demand.duration / self.resolution))
+
+    def profile(self, phases):
+        """Compute the load over the timeline
+
+        Args:
+            phases (dict): pool id -> phase in seconds
+
+        Returns:
+            tuple of (list, list, list): hooks fired, tasks created and cores running
+                in each slot
+        """
+        hooks = [0] * self.slots
+        tasks = [0] * self.slots
+        cores = [0] * self.slots
+        for pool_id, demand in self.pools.items():
+            length = self._length(demand)
+            for start in self._starts(demand.cycle, phases[pool_id]):
+                hooks[start] += 1
+                tasks[start] += demand.tasks
+                for slot in range(start, start + length):
+                    cores[slot % self.slots] += demand.cores
+        return hooks, tasks, cores
+
+    def current(self):
+        """
+        Returns:
+            dict: pool id -> phase of the current schedule, in seconds
+        """
+        return {pool_id: demand.phase for pool_id, demand in self.pools.items()}
+
+    def optimize(self):
+        """Choose phases which minimize the peak of tasks created in a slot.
+
+        Pools are placed greedily, the largest and most frequent first, each in the
+        slot of its cycle where the peak is lowest. Ties are broken by the total
+        tasks already created in its slots, then the peak of cores running while its
+        tasks do, and then by keeping the current phase when possible.
+
+        Returns:
+            dict: pool id -> phase in seconds
+        """
+        phases = {}
+        tasks = [0] * self.slots
+        cores = [0] * self.slots
+
+        def _place(pool_id, demand, phase):
+            phases[pool_id] = phase
+            length = self._length(demand)
+            for start in self._starts(demand.cycle, phase):
+                tasks[start] += demand.tasks
+                for slot in range(start, start + length):
+                    cores[slot % self.slots] += demand.cores
+
+        for pool_id, demand in sorted(self.pools.items()):
+            if demand.fixed:
+                _place(pool_id, demand, demand.phase)
+
+        movable = sorted(
+            (item for item in self.pools.items() if not item[1].fixed),
+            key=lambda item: (-item[1].tasks, item[1].cycle, -item[1].cores, item[0]),
+        )
+        for pool_id, demand in movable:
+            running = _window_max(cores, self._length(demand))
+            best = None
+            for step in range(max(1, demand.cycle // self.resolution)):
+                phase = step * self.resolution
+                starts = self._starts(demand.cycle, phase)
+                score = (
+                    max(tasks[slot] for slot in starts),
+                    sum(tasks[slot] for slot in starts),
+                    max(running[slot] for slot in starts),
+                    abs(phase - demand.phase),
+                )
+                if best is None or score < best[0]:
+                    best = (score, phase)
+            _place(pool_id, demand, best[1])
+        return phases
+
+    def report(self, phases):
+        """
+        Args:
+            phases (dict): pool id -> phase in seconds
+
+        Returns:
+            dict: "hooks"/"tasks"/"cores" -> peak in a slot
+        """
+        hooks, tasks, cores = self.profile(phases)
+        return {"hooks": max(hooks), "tasks": max(tasks), "cores": max(cores)}
+
+    @staticmethod
+    def schedule_start(phase):
+        """
+        Args:
+            phase (int): phase in seconds
+
+        Returns:
+            datetime: a schedule_start giving this phase
+        """
+        return EPOCH + timedelta(seconds=phase)
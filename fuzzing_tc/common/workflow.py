@@ -4,9 +4,13 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import fcntl
+import hashlib
 import logging
 import os
 import pathlib
+import re
+import shutil
 import subprocess
 import tempfile
 
@@ -20,6 +24,7 @@ logger = logging.getLogger()
 class Workflow:
     def __init__(self):
         taskcluster.auth()
+        self.git_cache_dir = None
 
     @property
     def in_taskcluster(self):
@@ -31,8 +36,14 @@ class Workflow:
         secret=None,
         fuzzing_git_repository=None,
         fuzzing_git_revision=None,
+        git_cache_dir=None,
     ):
-        """Load configuration either from local file or Taskcluster secret"""
+        """Load configuration either from local file or Taskcluster secret
+
+        Remote repositories are cloned through mirrors kept in `git_cache_dir`, if
+        given (see `git_clone_cached`).
+        """
+        self.git_cache_dir = git_cache_dir
 
         if local_path is not None:
             assert local_path.is_file(), f"Missing configuration in {local_path}"
@@ -95,6 +106,12 @@ class Workflow:
             # Clone from remote repository
             path = pathlib.Path(tempfile.mkdtemp(suffix=url[url.rindex("/") + 1 :]))
 
+            if self.git_cache_dir is not None and self.git_clone_cached(
+                url, path, revision
+            ):
+                logger.info(f"Using config files checked out in {path}")
+                return path
+
             # Clone the configuration repository
             logger.info(f"Cloning {url}")
             cmd = ["git", "clone", "--quiet", url, str(path)]
@@ -117,3 +134,126 @@ class Workflow:
                 subprocess.check_output(cmd, cwd=str(path))
 
         return path
+
+    def git_clone_cached(self, url, path, revision=None):
+        """Check out a revision using a bare mirror of the repository in
+        `git_cache_dir`.
+
+        Only the requested revision is fetched into the mirror (shallowly), then it
+        is checked out in `path` as a worktree of the mirror, so warm runs only
+        download what changed.
+
+        Args:
+            url (str): remote repository
+            path (pathlib.Path): empty directory to check out into
+            revision (str): commit or branch to check out (default: remote HEAD)
+
+        Returns:
+            bool: False if the checkout failed, `path` is then left empty
+        """
+        cache_dir = pathlib.Path(self.git_cache_dir)
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:16]
+        mirror = cache_dir / f"{digest}.git"
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            # concurrent runs share the mirrors
+            with (cache_dir / f"{digest}.lock").open("w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                if not mirror.is_dir():
+                    logger.info(f"Creating mirror of {url} in {mirror}")
+                    cmd = ["git", "init", "--bare", "--quiet", str(mirror)]
+                    subprocess.check_output(cmd)
+                cmd = ["git", "worktree", "prune"]
+                subprocess.check_output(cmd, cwd=str(mirror))
+                commit = "FETCH_HEAD"
+                if revision is not None and self.git_has_commit(mirror, revision):
+                    # a commit fetched by a previous run
+                    commit = revision
+                else:
+                    logger.info(f"Fetching {revision or 'HEAD'} from {url}")
+                    cmd = ["git", "fetch", "--quiet", "--depth", "1", url]
+                    cmd.append(revision or "HEAD")
+                    subprocess.check_output(cmd, cwd=str(mirror))
+                cmd = ["git", "worktree", "add", "--detach", "--quiet", str(path)]
+                cmd.append(commit)
+                subprocess.check_output(cmd, cwd=str(mirror))
+        except (OSError, subprocess.CalledProcessError) as exc:
+            logger.warning(f"Mirror checkout of {url} failed ({exc}), cloning")
+            shutil.rmtree(str(path), ignore_errors=True)
+            path.mkdir()
+            return False
+        return True
+
+    @staticmethod
+    def git_has_commit(path, revision):
+        """Check whether a repository has a commit, given by its full hash"""
+        if not re.fullmatch(r"[0-9a-f]{40}", revision):
+            # branches and tags may have moved
+            return False
+        try:
+            cmd = ["git", "cat-file", "-e", f"{revision}^{{commit}}"]
+            subprocess.check_output(cmd, cwd=str(path), stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError):
+            return False
+        return True
+
+    @staticmethod
+    def git_revision(path):
+        """Get the commit checked out in a repository, or None if it isn't one"""
+        try:
+            cmd = ["git", "rev-parse", "HEAD"]
+            output = subprocess.check_output(
+                cmd, cwd=str(path), stderr=subprocess.DEVNULL
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return output.decode("ascii").strip()
+
+    @staticmethod
+    def git_clean(path):
+        """Check that a repository has no uncommitted changes or untracked files"""
+        try:
+            cmd = ["git", "status", "--porcelain", "--untracked-files=all"]
+            output = subprocess.check_output(
+                cmd, cwd=str(path), stderr=subprocess.DEVNULL
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return False
+        return not output.strip()
+
+    @staticmethod
+    def git_changed_files(path, old_revision, new_revision=None):
+        """List files changed in a repository since a given commit
+
+        Args:
+            path (pathlib.Path): repository
+            old_revision (str): commit to compare from
+            new_revision (str): commit to compare to (default: the working tree)
+
+        Returns:
+            set of str: paths relative to the repository root, or None if the
+                        revisions can't be compared
+        """
+        cmd = ["git", "diff", "--name-only", old_revision]
+        if new_revision is not None:
+            cmd.append(new_revision)
+        cmd.append("--")
+        try:
+            output = subprocess.check_output(
+                cmd, cwd=str(path), stderr=subprocess.DEVNULL
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return set(output.decode("utf-8").splitlines())
+
+    @staticmethod
+    def git_show(path, revision, file):
+        """Read a file as it was at a given commit, or None if it didn't exist"""
+        try:
+            cmd = ["git", "show", f"{revision}:{file}"]
+            output = subprocess.check_output(
+                cmd, cwd=str(path), stderr=subprocess.DEVNULL
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return output.decode("utf-8")
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import hashlib
+import json
+import logging
+
+import yaml
+from tcadmin.resources.resources import Resource
+
+from ..common.pool import PoolConfigLoader
+from ..common.pool import package_version
+from ..common.workflow import Workflow
+
+LOG = logging.getLogger("fuzzing_tc.decision.cache")
+
+# community config files, and the pool field they affect
+COMMUNITY_CLOUD_FILES = {"config/aws.yml": "aws", "config/gcp.yml": "gcp"}
+COMMUNITY_IMAGESETS_FILE = "config/imagesets.yml"
+
+
+def machines_digest(fuzzing_config_dir):
+    """Hash the machine types of a fuzzing configuration
+
+    Args:
+        fuzzing_config_dir (pathlib.Path): fuzzing configuration checkout
+
+    Returns:
+        str: hex digest of machines.yml
+    """
+    return hashlib.sha256(
+        (fuzzing_config_dir / "machines.yml").read_bytes()
+    ).hexdigest()
+
+
+class ResourceCache:
+    """Resources generated for each pool by a previous tc-admin run.
+
+    Used to reuse all of them if neither configuration changed since that run, or
+    else to only regenerate the pools affected by the changes.
+
+    Attributes:
+        path (pathlib.Path): JSON file the cache is stored in
+        revisions (dict): "fuzzing"/"community" -> git revision the cache was generated from
+        env (dict): environment passed to the decision tasks of the cached pools
+        clean (bool): both configurations were clean checkouts of `revisions`
+        machines (str): digest of the machines.yml the cache was generated with
+        max_launch_configs (int): launch configs limit the cache was generated with
+        pools (dict): pool id -> list of resources as JSON
+        configs (dict): pool id -> list of [config id, resolved values] the
+            resources of the pool were built from (see `iterconfigs()`)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.revisions = {}
+        self.env = None
+        self.clean = False
+        self.machines = None
+        self.max_launch_configs = None
+        self.pools = {}
+        self.configs = {}
+        if not path.is_file():
+            return
+        data = json.loads(path.read_text())
+        if data.get("version") != package_version():
+            LOG.info(
+                f"Resource cache is for fuzzing-tc {data.get('version')}, ignoring"
+            )
+            return
+        self.revisions = data["revisions"]
+        self.env = data["env"]
+        self.clean = data.get("clean", False)
+        self.machines = data.get("machines")
+        self.max_launch_configs = data.get("max_launch_configs")
+        self.pools = data["pools"]
+        self.configs = data.get("configs", {})
+
+    def resolved(self, pool_id):
+        """Get the configurations the cached resources of a pool were built from
+
+        Args:
+            pool_id (str): id of the pool
+
+        Returns:
+            tuple of ResolvedPool: as returned by `PoolRepository.resolved()`
+        """
+        bundle = {"pools": dict(self.configs[pool_id])}
+        return tuple(
+            PoolConfigLoader.from_bundle(bundle, config_id).freeze()
+            for config_id in bundle["pools"]
+        )
+
+    def resources(self, pool_id):
+        """Get the cached resources for a pool
+
+        Args:
+            pool_id (str): id of the pool
+
+        Returns:
+            list of Resource: the WorkerPool, Hook and Role for the pool
+        """
+        # from_json modifies its argument
+        return [
+            Resource.from_json(json.loads(json.dumps(resource)))
+            for resource in self.pools[pool_id]
+        ]
+
+    def up_to_date(
+        self, fuzzing_config_dir, community_config_dir, env, max_launch_configs=None
+    ):
+        """Check whether all the cached resources can be reused as they are.
+
+        This is the case when both configurations are clean checkouts of the cached
+        revisions, and the decision task environment, machine types and options are
+        the same, so the configurations don't need to be parsed at all.
+
+        Args:
+            fuzzing_config_dir (pathlib.Path): fuzzing configuration checkout
+            community_config_dir (pathlib.Path): community configuration checkout
+            env (dict): environment passed to decision tasks in this run
+            max_launch_configs (int): launch configs limit of this run
+
+        Returns:
+            bool: True if nothing needs to be generated again
+        """
+        if (
+            not self.pools
+            or not self.clean
+            or self.env != env
+            or self.max_launch_configs != max_launch_configs
+        ):
+            return False
+        for name, path in (
+            ("fuzzing", fuzzing_config_dir),
+            ("community", community_config_dir),
+        ):
+            revision = self.revisions.get(name)
+            if revision is None or Workflow.git_revision(path) != revision:
+                return False
+            if not Workflow.git_clean(path):
+                return False
+        return self.machines == machines_digest(fuzzing_config_dir)
+
+    def invalidated(
+        self,
+        repository,
+        fuzzing_config_dir,
+        community_config_dir,
+        env,
+        max_launch_configs=None,
+    ):
+        """Find the pools that need to be generated again.
+
+        Args:
+            repository (PoolRepository): current fuzzing configuration
+            fuzzing_config_dir (pathlib.Path): fuzzing configuration checkout
+            community_config_dir (pathlib.Path): community configuration checkout
+            env (dict): environment passed to decision tasks in this run
+            max_launch_configs (int): launch configs limit of this run
+
+        Returns:
+            set of str: pool ids to generate again, or None if the cache can't be used
+        """
+        if (
+            not self.pools
+            or not self.configs
+            or self.revisions.get("community") is None
+        ):
+            return None
+        if self.env != env:
+            LOG.info("Decision task environment changed, regenerating all pools")
+            return None
+        if self.max_launch_configs != max_launch_configs:
+            LOG.info("Launch configs limit changed, regenerating all pools")
+            return None
+        if self.machines != machines_digest(fuzzing_config_dir):
+            LOG.info("machines.yml changed, regenerating all pools")
+            return None
+
+        # pools whose resolved configurations changed, or which weren't generated in
+        # the cached run
+        result = {
+            pool_id
+            for pool_id, configs in repository.resolved().items()
+            if pool_id not in self.configs or self.resolved(pool_id) != configs
+        }
+
+        # community config changes invalidate the pools using the changed cloud/imageset
+        changed = Workflow.git_changed_files(
+            community_config_dir, self.revisions.get("community")
+        )
+        if changed is None:
+            LOG.info("Community config can't be compared, regenerating all pools")
+            return None
+        clouds = {
+            cloud for path, cloud in COMMUNITY_CLOUD_FILES.items() if path in changed
+        }
+        imagesets = set()
+        if COMMUNITY_IMAGESETS_FILE in changed:
+            old = yaml.safe_load(
+                Workflow.git_show(
+                    community_config_dir,
+                    self.revisions["community"],
+                    COMMUNITY_IMAGESETS_FILE,
+                )
+                or "{}"
+            )
+            new = yaml.safe_load(
+                (community_config_dir / COMMUNITY_IMAGESETS_FILE).read_text()
+            )
+            imagesets = {
+                name for name in set(old) | set(new) if old.get(name) != new.get(name)
+            }
+        for pool_id, pool in repository.pools.items():
+            if pool.cloud in clouds or pool.imageset in imagesets:
+                result.add(pool_id)
+
+        return result
+
+    def save(
+        self,
+        revisions,
+        env,
+        pools,
+        configs=None,
+        clean=False,
+        machines=None,
+        max_launch_configs=None,
+    ):
+        """Store resources generated in this run
+
+        Args:
+            revisions (dict): "fuzzing"/"community" -> git revision of the configuration
+            env (dict): environment passed to decision tasks in this run
+            pools (dict): pool id -> list of Resource generated for that pool
+            configs (dict): pool id -> CommonPoolConfiguration the resources were
+                generated from
+            clean (bool): both configurations are clean checkouts of `revisions`
+            machines (str): digest of machines.yml (see `machines_digest`)
+            max_launch_configs (int): launch configs limit of this run
+        """
+        self.revisions = revisions
+        self.env = env
+        self.clean = clean
+        self.machines = machines
+        self.max_launch_configs = max_launch_configs
+        self.pools = {
+            pool_id: [resource.to_json() for resource in pool_resources]
+            for pool_id, pool_resources in pools.items()
+        }
+        self.configs = {
+            pool_id: [
+                [config.pool_id, config.to_resolved()] for config in pool.iterconfigs()
+            ]
+            for pool_id, pool in (configs or {}).items()
+        }
+        self.path.write_text(
+            json.dumps(
+                {
+                    "version": package_version(),
+                    "revisions": self.revisions,
+                    "clean": self.clean,
+                    "configs": self.configs,
+                    "env": self.env,
+                    "machines": self.machines,
+                    "max_launch_configs": self.max_launch_configs,
+                    "pools": self.pools,
+                },
+                sort_keys=True,
+            )
+        )
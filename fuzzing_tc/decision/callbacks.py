@@ -6,27 +6,86 @@
 
 import logging
 
+from tcadmin.appconfig import AppConfig
 from tcadmin.resources import Hook
 from tcadmin.resources import WorkerPool
 
 from fuzzing_tc.common import taskcluster
+from fuzzing_tc.common.cli import parse_flag
 from fuzzing_tc.decision.pool import cancel_tasks
 
 logger = logging.getLogger()
 
 
+def hook_fingerprints(task):
+    """Fingerprints of the fuzzing tasks of each pool member, stored in the `extra`
+    of a hook task (see `task_fingerprints`)
+    """
+    return task.get("extra", {}).get("fuzzing", {}).get("fingerprints")
+
+
 async def cancel_pool_tasks(action, resource):
-    """Cancel all the tasks on a WorkerPool being updated or deleted"""
+    """Cancel all the tasks on a WorkerPool being deleted.
+
+    Updating a WorkerPool doesn't change the tasks it runs, they are replaced
+    through its hook (see `HookTrigger`).
+    """
     assert isinstance(resource, WorkerPool)
+    if action != "delete":
+        logger.info(f"Keeping the tasks of {resource.workerPoolId} running")
+        return
 
     _, worker_type = resource.workerPoolId.split("/")
     cancel_tasks(worker_type)
 
 
-async def trigger_hook(action, resource):
-    """Trigger a Hook after it is created or updated"""
-    assert isinstance(resource, Hook)
+class HookTrigger:
+    """Callbacks triggering Hooks which are created, or updated with new task
+    definitions.
+
+    The task fingerprints of each deployed Hook are recorded by `check` before it
+    is updated, and compared by `trigger` once it is. Use one instance per run.
+    """
+
+    def __init__(self):
+        # hook id -> task fingerprints of the deployed hook
+        self._deployed = {}
+
+    async def check(self, action, resource):
+        """Record the task fingerprints of a Hook before it is updated.
+
+        If a fingerprint changes and --fuzzing-cancel-first is set, the tasks of the
+        changed members are cancelled right away. Otherwise, the decision task
+        triggered for the updated hook replaces them as its new tasks start.
+        """
+        assert isinstance(resource, Hook)
+
+        hooks = taskcluster.get_service("hooks")
+        deployed = hooks.hook(resource.hookGroupId, resource.hookId)
+        fingerprints = hook_fingerprints(deployed["task"])
+        self._deployed[resource.hookId] = fingerprints
+        new_fingerprints = hook_fingerprints(resource.task)
+        if fingerprints == new_fingerprints:
+            return
+        if parse_flag(AppConfig.current().options.get("fuzzing_cancel_first")):
+            keep = {
+                fingerprint: [] for fingerprint in (new_fingerprints or {}).values()
+            }
+            cancel_tasks(resource.hookId, keep=keep)
+
+    async def trigger(self, action, resource):
+        """Trigger a Hook after it is created, or updated with new task definitions"""
+        assert isinstance(resource, Hook)
+
+        fingerprints = hook_fingerprints(resource.task)
+        deployed = self._deployed.pop(resource.hookId, None)
+        if action == "update" and fingerprints is not None and deployed == fingerprints:
+            logger.info(
+                f"Tasks of hook {resource.hookGroupId} / {resource.hookId} are "
+                "unchanged, not triggering it"
+            )
+            return
 
-    hooks = taskcluster.get_service("hooks")
-    logger.info(f"Triggering hook {resource.hookGroupId} / {resource.hookId}")
-    hooks.triggerHook(resource.hookGroupId, resource.hookId, {})
+        hooks = taskcluster.get_service("hooks")
+        logger.info(f"Triggering hook {resource.hookGroupId} / {resource.hookId}")
+        hooks.triggerHook(resource.hookGroupId, resource.hookId, {})
@@ -6,8 +6,13 @@
 
 import logging
 import os
+import pathlib
+
+import yaml
 
 from fuzzing_tc.common.cli import build_cli_parser
+from fuzzing_tc.common.cli import parse_flag
+from fuzzing_tc.common.pool import parse_time
 
 from .workflow import Workflow
 
@@ -23,11 +28,31 @@ def main():
         help="Taskcluster decision task creating new fuzzing tasks",
         default=os.environ.get("TASK_ID"),
     )
+    parser.add_argument(
+        "--pool-bundle",
+        type=pathlib.Path,
+        help="Compiled pool configurations to use instead of the fuzzing repository "
+        "YAML, if they match its revision",
+        default=os.environ.get("FUZZING_POOL_BUNDLE"),
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
         help="Build the task group, but exit before creating tasks in Taskcluster.",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of Taskcluster requests made at once to cancel and create tasks",
+        default=int(os.environ.get("FUZZING_CREATE_CONCURRENCY", 8)),
+    )
+    parser.add_argument(
+        "--cancel-first",
+        action="store_true",
+        help="Cancel the previous tasks of the pool before creating new ones, instead "
+        "of as the new ones start",
+        default=parse_flag(os.environ.get("FUZZING_CANCEL_FIRST")),
+    )
     args = parser.parse_args()
 
     # We need both task & task group information
@@ -44,10 +69,109 @@ def main():
         secret=args.taskcluster_secret,
         fuzzing_git_repository=args.git_repository,
         fuzzing_git_revision=args.git_revision,
+        git_cache_dir=args.git_cache,
     )
 
     # Retrieve remote repositories
     workflow.clone(config)
 
     # Build all task definitions for that pool
-    workflow.build_tasks(args.pool_name, args.task_id, config, dry_run=args.dry_run)
+    workflow.build_tasks(
+        args.pool_name,
+        args.task_id,
+        config,
+        dry_run=args.dry_run,
+        pool_bundle=args.pool_bundle,
+        concurrency=args.concurrency,
+        cancel_first=args.cancel_first,
+    )
+
+
+def cost_main(args=None):
+    parser = build_cli_parser(prog="fuzzing-pool-cost")
+    args = parser.parse_args(args=args)
+
+    # Setup logger
+    logging.basicConfig(level=args.log_level)
+
+    workflow = Workflow()
+    config = workflow.configure(
+        local_path=args.configuration,
+        secret=args.taskcluster_secret,
+        fuzzing_git_repository=args.git_repository,
+        fuzzing_git_revision=args.git_revision,
+        git_cache_dir=args.git_cache,
+    )
+    workflow.clone(config)
+
+    def _cost(value):
+        return "-" if value is None else f"{value:.4f}"
+
+    print(f"{'pool':<40} {'max capacity':>12} {'$/slot/h':>10} {'$/h':>10}")
+    total = 0
+    for pool_id, capacity, slot_cost, cost in workflow.cost_report():
+        print(f"{pool_id:<40} {capacity:>12} {_cost(slot_cost):>10} {_cost(cost):>10}")
+        total += cost or 0
+    print(f"{'total (known prices)':<40} {'':>12} {'':>10} {_cost(total):>10}")
+
+
+def simulate_main(args=None):
+    parser = build_cli_parser(prog="fuzzing-pool-simulate")
+    parser.add_argument(
+        "--horizon",
+        type=parse_time,
+        default="7d",
+        help="Time to simulate each pool for (default: 7d)",
+    )
+    parser.add_argument(
+        "--samples",
+        type=pathlib.Path,
+        help="YAML file of recorded start_latency/decision/preprocess/duration times",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=parse_time,
+        default="10m",
+        help="Time an idle worker waits for a task before shutting down",
+    )
+    parser.add_argument(
+        "--cancel",
+        action="store_true",
+        help="Cancel the tasks of the previous fire, as when triggered manually",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args(args=args)
+
+    # Setup logger
+    logging.basicConfig(level=args.log_level)
+
+    workflow = Workflow()
+    config = workflow.configure(
+        local_path=args.configuration,
+        secret=args.taskcluster_secret,
+        fuzzing_git_repository=args.git_repository,
+        fuzzing_git_revision=args.git_revision,
+        git_cache_dir=args.git_cache,
+    )
+    workflow.clone(config)
+
+    samples = None
+    if args.samples is not None:
+        samples = yaml.safe_load(args.samples.read_text())
+
+    print(
+        f"{'pool':<40} {'max capacity':>12} {'peak':>6} {'mean':>8} "
+        f"{'workers':>8} {'idle core-h':>12}"
+    )
+    for result in workflow.simulation_report(
+        args.horizon,
+        samples,
+        idle_timeout=args.idle_timeout,
+        cancel=args.cancel,
+        seed=args.seed,
+    ):
+        print(
+            f"{result.pool_id:<40} {result.max_capacity:>12} "
+            f"{result.peak_capacity:>6} {result.mean_capacity:>8.1f} "
+            f"{result.peak_workers:>8} {result.idle_core_hours:>12.1f}"
+        )
@@ -4,24 +4,32 @@
 # v. 2.0. If a copy of the MPL was not distributed with this file, You can
 # obtain one at http://mozilla.org/MPL/2.0/.
 
+import base64
+import concurrent.futures
+import hashlib
 import itertools
+import json
 import logging
 import math
 import os
+import threading
+import time
 from datetime import datetime
 from datetime import timedelta
+from datetime import timezone
 
-import yaml
+import dateutil.parser
+from taskcluster.exceptions import TaskclusterConnectionError
 from taskcluster.exceptions import TaskclusterFailure
 from taskcluster.exceptions import TaskclusterRestFailure
 from taskcluster.utils import fromNow
-from taskcluster.utils import slugId
 from taskcluster.utils import stringDate
 from tcadmin.resources import Hook
 from tcadmin.resources import Role
 from tcadmin.resources import WorkerPool
 
 from ..common import taskcluster
+from ..common.pool import PoolConfigLoader as CommonPoolConfigLoader
 from ..common.pool import PoolConfigMap as CommonPoolConfigMap
 from ..common.pool import PoolConfiguration as CommonPoolConfiguration
 from ..common.pool import parse_time
@@ -39,6 +47,17 @@ DESCRIPTION = """*DO NOT EDIT* - This resource is configured automatically.
 
 Fuzzing workers generated by decision task"""
 
+# retries of a Taskcluster call failing with a transient error, and the delay before
+# the first retry (doubled for each further retry)
+TASKCLUSTER_RETRIES = 5
+TASKCLUSTER_BACKOFF = 1.0
+
+# rolling replacement: delay between checks of the new tasks, and time to wait for
+# them to start before cancelling all the previous tasks (new workers have 15
+# minutes to register, and the decision task runs for at most an hour)
+ROLLING_POLL_INTERVAL = 60
+ROLLING_TIMEOUT = 40 * 60
+
 DOCKER_WORKER_DEVICES = (
     "cpu",
     "hostSharedMemory",
@@ -62,78 +81,448 @@ def add_capabilities_for_scopes(task):
         del capabilities["devices"]
 
 
-def cancel_tasks(worker_type):
+def retry_call(
+    method, *args, retries=TASKCLUSTER_RETRIES, backoff=TASKCLUSTER_BACKOFF, **kwds
+):
+    """Call a Taskcluster client method, retrying transient errors (connection
+    errors, 5xx and 429 responses) with an exponential backoff
+
+    Args:
+        method (callable): client method
+        *args: arguments of the call
+        **kwds: keyword arguments of the call
+        retries (int): retries before giving up
+        backoff (float): seconds before the first retry, doubled for each retry
+
+    Returns:
+        the result of the call
+    """
+    for attempt in range(retries + 1):
+        try:
+            return method(*args, **kwds)
+        except (TaskclusterConnectionError, TaskclusterRestFailure) as exc:
+            transient = isinstance(exc, TaskclusterConnectionError) or (
+                exc.status_code >= 500 or exc.status_code == 429
+            )
+            if not transient or attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            LOG.warning(f"Taskcluster call failed, retry in {delay}s: {exc}")
+            time.sleep(delay)
+
+
+def thread_clients(service_name):
+    """Get a function returning a Taskcluster client for the current thread, as
+    clients can't be shared between threads
+
+    Args:
+        service_name (str): Taskcluster service
+
+    Returns:
+        callable: () -> client of the service, created once for each thread
+    """
+    clients = threading.local()
+
+    def _client():
+        if not hasattr(clients, "client"):
+            clients.client = taskcluster.get_service(service_name)
+        return clients.client
+
+    return _client
+
+
+def previous_tasks(worker_type, max_run_time=None, concurrency=1, keep=None):
+    """Find the pending and running tasks of the previous fires of a hook
+
+    Task groups are listed `concurrency` at once.
+
+    Args:
+        worker_type (str): hook id
+        max_run_time (int): fires older than this (plus the decision task deadline)
+            are skipped, as their tasks can't be running anymore
+        concurrency (int): number of Taskcluster requests made at once
+        keep (dict): task fingerprint -> list. Tasks with one of these fingerprints
+            (see `task_fingerprints`) are left out, and their ids added to its list.
+
+    Returns:
+        dict: task id -> "pending" or "running". Empty if this decision task was
+            scheduled, as prior tasks must then remain running.
+    """
     # Avoid cancelling self
     self_task_id = os.getenv("TASK_ID")
 
     hooks = taskcluster.get_service("hooks")
-    queue = taskcluster.get_service("queue")
-
-    # Get tasks by hook
-    def iter_tasks_by_hook(hook_id):
-        try:
-            for fire in hooks.listLastFires(HOOK_PREFIX, hook_id)["lastFires"]:
-                if fire["result"] != "success":
-                    continue
-                try:
-                    result = queue.listTaskGroup(fire["taskId"])
-                except TaskclusterFailure as exc:
-                    if "No task-group with taskGroupId" in str(exc):
-                        continue
-                    raise
-                while result.get("continuationToken"):
-                    yield from [
-                        (task, (fire["firedBy"] == "schedule"))
-                        for task in result["tasks"]
-                    ]
-                    result = queue.listTaskGroup(
-                        fire["taskId"],
-                        query={"continuationToken": result["continuationToken"]},
-                    )
-                yield from [
-                    (task, (fire["firedBy"] == "schedule")) for task in result["tasks"]
-                ]
-        except TaskclusterRestFailure as msg:
-            if "No such hook" in str(msg):
-                return
-            raise
-
-    tasks_to_cancel = []
-    for task, scheduled in iter_tasks_by_hook(worker_type):
+    queue = thread_clients("queue")
+
+    try:
+        fires = retry_call(hooks.listLastFires, HOOK_PREFIX, worker_type)["lastFires"]
+    except TaskclusterRestFailure as msg:
+        if "No such hook" in str(msg):
+            return {}
+        raise
+    fires = [fire for fire in fires if fire["result"] == "success"]
+
+    for fire in fires:
+        if fire["taskId"] == self_task_id and fire["firedBy"] == "schedule":
+            # if this decision task was the result of a scheduled hook, don't
+            # cancel anything. if cycle_time is shorter than max_run_time, we
+            # want prior tasks to remain running
+            LOG.info(f"{self_task_id} is scheduled, not cancelling tasks")
+            return {}
+
+    if max_run_time is not None:
+        # tasks expire max_run_time after the decision task created them, which is
+        # at most its deadline after the fire
+        oldest = datetime.now(timezone.utc) - timedelta(
+            seconds=max_run_time + parse_time("1h")
+        )
+        fires = [
+            fire
+            for fire in fires
+            if dateutil.parser.isoparse(fire["taskCreateTime"]) >= oldest
+        ]
+
+    def _list_task_group(task_group_id):
+        tasks = []
+        kwds = {}
+        while True:
+            try:
+                result = retry_call(queue().listTaskGroup, task_group_id, **kwds)
+            except TaskclusterFailure as exc:
+                if "No task-group with taskGroupId" in str(exc):
+                    return tasks
+                raise
+            tasks.extend(result["tasks"])
+            if not result.get("continuationToken"):
+                return tasks
+            kwds = {"query": {"continuationToken": result["continuationToken"]}}
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        groups = executor.map(_list_task_group, [fire["taskId"] for fire in fires])
+    result = {}
+    for task in itertools.chain.from_iterable(groups):
         task_id = task["status"]["taskId"]
-
         if task_id == self_task_id:
-            if scheduled:
-                # if this decision task was the result of a scheduled hook, don't
-                # cancel anything. if cycle_time is shorter than max_run_time, we
-                # want prior tasks to remain running
-                LOG.info(f"{self_task_id} is scheduled, not cancelling tasks")
-                return
             # avoid cancelling self
             continue
+        if task["status"]["taskGroupId"] == self_task_id:
+            # created by an earlier run of this decision task, and kept by this one
+            continue
 
         # State can be pending,running,completed,failed,exception
         # We only cancel pending & running tasks
-        if any(
-            run["state"] in {"pending", "running"} for run in task["status"]["runs"]
-        ):
-            tasks_to_cancel.append(task_id)
-    LOG.info(f"{self_task_id} is cancelling {len(tasks_to_cancel)} tasks")
-
-    for task_id in tasks_to_cancel:
-        # Cancel the task
+        states = {run["state"] for run in task["status"]["runs"]}
+        if not states & {"running", "pending"}:
+            continue
+        fingerprint = (
+            task.get("task", {}).get("extra", {}).get("fuzzing", {}).get("fingerprint")
+        )
+        if keep is not None and fingerprint in keep:
+            keep[fingerprint].append(task_id)
+        elif "running" in states:
+            result[task_id] = "running"
+        else:
+            result[task_id] = "pending"
+    return result
+
+
+def cancel_task_ids(task_ids, concurrency=1):
+    """Cancel tasks, `concurrency` at once
+
+    Args:
+        task_ids (list): tasks to cancel
+        concurrency (int): number of Taskcluster requests made at once
+    """
+    queue = thread_clients("queue")
+
+    def _cancel(task_id):
         try:
             LOG.warning(f"=> cancelling: {task_id}")
-            queue.cancelTask(task_id)
+            retry_call(queue().cancelTask, task_id)
         except Exception:
             LOG.exception(f"Exception calling cancelTask({task_id})")
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(_cancel, task_ids))
+
+
+def cancel_tasks(worker_type, max_run_time=None, concurrency=1, keep=None):
+    """Cancel the pending and running tasks of the previous fires of a hook
+
+    Args:
+        worker_type (str): hook id
+        max_run_time (int): fires older than this (plus the decision task deadline)
+            are skipped, as their tasks can't be running anymore
+        concurrency (int): number of Taskcluster requests made at once
+        keep (dict): fingerprints of the tasks to keep (see `previous_tasks`)
+    """
+    tasks = previous_tasks(worker_type, max_run_time, concurrency, keep)
+    LOG.info(f"{os.getenv('TASK_ID')} is cancelling {len(tasks)} tasks")
+    cancel_task_ids(list(tasks), concurrency)
+
+
+def replace_tasks(
+    previous,
+    new_task_ids,
+    max_capacity,
+    concurrency=1,
+    poll_interval=ROLLING_POLL_INTERVAL,
+    timeout=ROLLING_TIMEOUT,
+):
+    """Cancel the previous tasks of a pool as its new tasks start, so the pool keeps
+    fuzzing while new workers boot.
+
+    Pending previous tasks are cancelled at once, and enough running ones to leave
+    room for all new tasks under `max_capacity`. Then a running previous task is
+    cancelled for each new task which started. Any left once all new tasks started,
+    or after `timeout`, are cancelled.
+
+    Args:
+        previous (dict): task id -> "pending" or "running", from `previous_tasks()`
+        new_task_ids (list): tasks which were just created
+        max_capacity (int): maxCapacity of the worker pool
+        concurrency (int): number of Taskcluster requests made at once
+        poll_interval (int): seconds between checks of the new tasks
+        timeout (int): seconds to wait for new tasks to start
+    """
+    running = [task_id for task_id, state in previous.items() if state == "running"]
+    cancel = [task_id for task_id, state in previous.items() if state != "running"]
+    # the decision task also uses a slot of the worker pool
+    excess = len(running) + len(new_task_ids) + 1 - max_capacity
+    if excess > 0:
+        cancel.extend(running[:excess])
+        running = running[excess:]
+    LOG.info(
+        f"Replacing {len(previous)} tasks: cancelling {len(cancel)} now, "
+        f"{len(running)} as new tasks start"
+    )
+    cancel_task_ids(cancel, concurrency)
+
+    queue = thread_clients("queue")
+
+    def _started(task_id):
+        status = retry_call(queue().status, task_id)["status"]
+        return status["state"] not in {"unscheduled", "pending"}
+
+    waiting = list(new_task_ids)
+    replaced = 0
+    stop = time.monotonic() + timeout
+    while running:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            started = list(executor.map(_started, waiting))
+        waiting = [task_id for task_id, done in zip(waiting, started) if not done]
+        if waiting and time.monotonic() < stop:
+            # one previous task for each new task which started
+            count = len(new_task_ids) - len(waiting) - replaced
+        else:
+            count = len(running)
+        cancel_task_ids(running[:count], concurrency)
+        running = running[count:]
+        replaced += count
+        if running:
+            time.sleep(poll_interval)
+
+
+def slot_cost(pool, providers, machine_types):
+    """Find the cheapest hourly cost of a task slot for a pool
+
+    Args:
+        pool (PoolConfiguration or PoolConfigMap): pool configuration
+        providers (dict): cloud providers
+        machine_types (MachineTypes): database of all machine types
+
+    Returns:
+        float: hourly cost of the cheapest launch config per task slot, or None if
+               no launch config has a price
+    """
+    ranked = providers[pool.cloud].rank_placements(
+        pool.imageset,
+        pool.get_machine_list(machine_types),
+        pool.machine_prices(machine_types),
+    )
+    return min((cost for _, cost in ranked if cost is not None), default=None)
+
+
+def task_slug(parent_task_id, pool_id, index, preprocess=False):
+    """Derive the id of a task created by a decision task.
+
+    The same task gets the same id if the decision task is retried, so the tasks
+    created by an earlier run aren't created again.
+
+    Args:
+        parent_task_id (str): decision task
+        pool_id (str): pool the task belongs to
+        index (int): index of the task in the pool
+        preprocess (bool): whether this is the preprocess task of the pool
+
+    Returns:
+        str: a "nice" slugId (url-safe base64 of a v4 UUID, starting with [A-Za-f])
+    """
+    key = f"{parent_task_id}/{pool_id}/{index}/{int(preprocess)}".encode("utf-8")
+    data = bytearray(hashlib.sha256(key).digest()[:16])
+    data[0] &= 0x7F
+    data[6] = (data[6] & 0x0F) | 0x40  # version 4
+    data[8] = (data[8] & 0x3F) | 0x80  # RFC 4122 variant
+    return base64.urlsafe_b64encode(bytes(data))[:-2].decode("ascii")
+
+
+def task_fingerprints(pool):
+    """Fingerprint the tasks a decision task creates for each member of a pool.
+
+    Covers what the tasks run: image, command, macros, scopes, capabilities, max run
+    time and artifacts, of the member and its preprocess task. Anything else
+    (schedule, machines, number of tasks, git revision, ...) can change without
+    restarting the running tasks. The tasks of a map member are only restarted when
+    that member changes.
+
+    Args:
+        pool (PoolConfiguration or PoolConfigMap): pool configuration
+
+    Returns:
+        dict: member pool id -> hex digest
+    """
+    result = {}
+    for member in pool.iterpools():
+        definitions = []
+        for config in (member.create_preprocess(), member):
+            if config is None:
+                continue
+            scopes = sorted(set(config.scopes))
+            task = {"scopes": scopes, "payload": {"capabilities": {}}}
+            add_capabilities_for_scopes(task)
+            definitions.append(
+                {
+                    "pool_id": config.pool_id,
+                    "image": config.container,
+                    "command": config.command,
+                    "macros": config.macros,
+                    "scopes": scopes,
+                    "capabilities": task["payload"]["capabilities"],
+                    "max_run_time": config.max_run_time,
+                    "artifacts": config.artifacts,
+                }
+            )
+        data = json.dumps(definitions, sort_keys=True, default=dict)
+        result[member.pool_id] = hashlib.sha256(data.encode("utf-8")).hexdigest()
+    return result
+
+
+class TaskTemplate:
+    """Fields shared by the tasks a decision task creates for a pool.
+
+    Dates, artifacts, scopes, capabilities and environment are computed once, then
+    `stamp()` copies the template for each task, only setting its id, name and
+    dependencies.
+
+    Args:
+        pool (PoolConfiguration): configuration of the tasks
+        parent_task_id (str): decision task
+        now (datetime): creation date of the tasks
+        worker_type (str): worker type the tasks run on
+        artifacts (dict): payload artifacts
+        env (dict): environment added to the tasks
+        extra_env (dict): environment specific to these tasks
+        fingerprint (str): fingerprint of the tasks (see `task_fingerprints`)
+    """
+
+    def __init__(
+        self,
+        pool,
+        parent_task_id,
+        now,
+        worker_type,
+        artifacts,
+        env=None,
+        extra_env=None,
+        fingerprint=None,
+    ):
+        task_env = {
+            "TASKCLUSTER_FUZZING_POOL": pool.pool_id,
+            "TASKCLUSTER_SECRET": DECISION_TASK_SECRET,
+        }
+        if extra_env is not None:
+            task_env.update(extra_env)
+        task = {
+            "taskGroupId": parent_task_id,
+            "dependencies": [],
+            "created": stringDate(now),
+            "deadline": stringDate(now + timedelta(seconds=pool.max_run_time)),
+            "expires": stringDate(fromNow("1 week", now)),
+            "extra": {},
+            "metadata": {
+                "description": DESCRIPTION,
+                "name": None,
+                "owner": OWNER_EMAIL,
+                "source": "https://github.com/MozillaSecurity/fuzzing-tc",
+            },
+            "payload": {
+                "artifacts": artifacts,
+                "cache": {},
+                "capabilities": {},
+                "env": task_env,
+                "features": {"taskclusterProxy": True},
+                "image": pool.container,
+                "maxRunTime": pool.max_run_time,
+            },
+            "priority": "high",
+            "provisionerId": PROVISIONER_ID,
+            "workerType": worker_type,
+            "retries": 5,
+            "routes": [],
+            "schedulerId": SCHEDULER_ID,
+            "scopes": pool.scopes + [f"secrets:get:{DECISION_TASK_SECRET}"],
+            "tags": {},
+        }
+        if fingerprint is not None:
+            task["extra"]["fuzzing"] = {"fingerprint": fingerprint}
+        add_capabilities_for_scopes(task)
+        if env is not None:
+            assert set(task_env).isdisjoint(set(env))
+            task_env.update(env)
+        # decoding JSON is the fastest way to get independent copies
+        self._json = json.dumps(task)
+
+    def stamp(self, task_id, name, dependencies):
+        """Create a task from the template
+
+        Args:
+            task_id (str): id of the new task
+            name (str): task name
+            dependencies (list): ids of the tasks it depends on
+
+        Returns:
+            tuple of (str, dict): task id and task definition
+        """
+        task = json.loads(self._json)
+        task["metadata"]["name"] = name
+        task["dependencies"] = list(dependencies)
+        return task_id, task
+
 
 class PoolConfiguration(CommonPoolConfiguration):
     @property
     def task_id(self):
         return f"{self.platform}-{self.pool_id}"
 
+    def max_capacity(self):
+        """Number of task slots the worker pool is allowed to run"""
+        # add +1 to expected size, so if we manually trigger the hook, the new
+        # decision can run without also manually cancelling a task
+        # * 2 since Taskcluster seems to not reuse workers very quickly in some cases,
+        # so we end up with a lot of pending tasks.
+        return (
+            max(1, math.ceil(self.max_run_time / self.cycle_time)) * self.tasks * 2 + 1
+        )
+
+    def hourly_cost(self, providers, machine_types):
+        """Expected hourly cost of the pool when running at `max_capacity()`
+
+        Returns:
+            float: cost, or None if machine prices are unknown
+        """
+        cost = slot_cost(self, providers, machine_types)
+        return None if cost is None else cost * self.max_capacity()
+
     def build_resources(self, providers, machine_types, env=None):
         """Build the full tc-admin resources to compare and build the pool"""
 
@@ -145,16 +534,12 @@ class PoolConfiguration(CommonPoolConfiguration):
         machines = self.get_machine_list(machine_types)
         config = {
             "minCapacity": 0,
-            "maxCapacity": (
-                # add +1 to expected size, so if we manually trigger the hook, the new
-                # decision can run without also manually cancelling a task
-                # * 2 since Taskcluster seems to not reuse workers very quickly in some cases,
-                # so we end up with a lot of pending tasks.
-                max(1, math.ceil(self.max_run_time / self.cycle_time)) * self.tasks * 2
-                + 1
-            ),
+            "maxCapacity": self.max_capacity(),
             "launchConfigs": provider.build_launch_configs(
-                self.imageset, machines, self.disk_size
+                self.imageset,
+                machines,
+                self.disk_size,
+                prices=self.machine_prices(machine_types),
             ),
             "lifecycle": {
                 # give workers 15 minutes to register before assuming they're broken
@@ -177,7 +562,7 @@ class PoolConfiguration(CommonPoolConfiguration):
             "created": {"$fromNow": "0 seconds"},
             "deadline": {"$fromNow": "1 hour"},
             "expires": {"$fromNow": "1 week"},
-            "extra": {},
+            "extra": {"fuzzing": {"fingerprints": task_fingerprints(self)}},
             "metadata": {
                 "description": DESCRIPTION,
                 "name": f"Fuzzing decision {self.task_id}",
@@ -262,103 +647,63 @@ class PoolConfiguration(CommonPoolConfiguration):
         }
         return result
 
-    def build_tasks(self, parent_task_id, env=None):
-        """Create fuzzing tasks and attach them to a decision task"""
+    def build_tasks(self, parent_task_id, env=None, members=None):
+        """Create fuzzing tasks and attach them to a decision task
+
+        The tasks don't depend on the decision task, which waits for them to start
+        to replace the previous tasks (see `replace_tasks`).
+
+        Args:
+            parent_task_id (str): decision task
+            env (dict): environment added to the tasks
+            members (set): ids of the members to create tasks for (default: all)
+        """
+        if members is not None and self.pool_id not in members:
+            return
         now = datetime.utcnow()
-        deps = [parent_task_id]
+        expires = stringDate(fromNow("1 week", now))
+        deps = []
+        fingerprint = task_fingerprints(self)[self.pool_id]
 
         preprocess = self.create_preprocess()
         if preprocess is not None:
-            task_id = slugId()
-            task = {
-                "taskGroupId": parent_task_id,
-                "dependencies": [parent_task_id],
-                "created": stringDate(now),
-                "deadline": stringDate(
-                    now + timedelta(seconds=preprocess.max_run_time)
-                ),
-                "expires": stringDate(fromNow("1 week", now)),
-                "extra": {},
-                "metadata": {
-                    "description": DESCRIPTION,
-                    "name": f"Fuzzing task {self.task_id} - preprocess",
-                    "owner": OWNER_EMAIL,
-                    "source": "https://github.com/MozillaSecurity/fuzzing-tc",
+            template = TaskTemplate(
+                preprocess,
+                parent_task_id,
+                now,
+                self.task_id,
+                preprocess.artifact_map(expires),
+                env,
+                {
+                    "TASKCLUSTER_FUZZING_POOL": self.pool_id,
+                    "TASKCLUSTER_FUZZING_PREPROCESS": "1",
                 },
-                "payload": {
-                    "artifacts": preprocess.artifact_map(
-                        stringDate(fromNow("1 week", now))
-                    ),
-                    "cache": {},
-                    "capabilities": {},
-                    "env": {
-                        "TASKCLUSTER_FUZZING_POOL": self.pool_id,
-                        "TASKCLUSTER_SECRET": DECISION_TASK_SECRET,
-                        "TASKCLUSTER_FUZZING_PREPROCESS": "1",
-                    },
-                    "features": {"taskclusterProxy": True},
-                    "image": preprocess.container,
-                    "maxRunTime": preprocess.max_run_time,
-                },
-                "priority": "high",
-                "provisionerId": PROVISIONER_ID,
-                "workerType": self.task_id,
-                "retries": 5,
-                "routes": [],
-                "schedulerId": SCHEDULER_ID,
-                "scopes": preprocess.scopes + [f"secrets:get:{DECISION_TASK_SECRET}"],
-                "tags": {},
-            }
-            add_capabilities_for_scopes(task)
-            if env is not None:
-                assert set(task["payload"]["env"]).isdisjoint(set(env))
-                task["payload"]["env"].update(env)
+                fingerprint,
+            )
+            task_id, task = template.stamp(
+                task_slug(parent_task_id, self.pool_id, 0, preprocess=True),
+                f"Fuzzing task {self.task_id} - preprocess",
+                deps,
+            )
             deps.append(task_id)
 
             yield task_id, task
 
+        template = TaskTemplate(
+            self,
+            parent_task_id,
+            now,
+            self.task_id,
+            self.artifact_map(expires),
+            env,
+            fingerprint=fingerprint,
+        )
         for i in range(1, self.tasks + 1):
-            task_id = slugId()
-            task = {
-                "taskGroupId": parent_task_id,
-                "dependencies": deps,
-                "created": stringDate(now),
-                "deadline": stringDate(now + timedelta(seconds=self.max_run_time)),
-                "expires": stringDate(fromNow("1 week", now)),
-                "extra": {},
-                "metadata": {
-                    "description": DESCRIPTION,
-                    "name": f"Fuzzing task {self.task_id} - {i}/{self.tasks}",
-                    "owner": OWNER_EMAIL,
-                    "source": "https://github.com/MozillaSecurity/fuzzing-tc",
-                },
-                "payload": {
-                    "artifacts": self.artifact_map(stringDate(fromNow("1 week", now))),
-                    "cache": {},
-                    "capabilities": {},
-                    "env": {
-                        "TASKCLUSTER_FUZZING_POOL": self.pool_id,
-                        "TASKCLUSTER_SECRET": DECISION_TASK_SECRET,
-                    },
-                    "features": {"taskclusterProxy": True},
-                    "image": self.container,
-                    "maxRunTime": self.max_run_time,
-                },
-                "priority": "high",
-                "provisionerId": PROVISIONER_ID,
-                "workerType": self.task_id,
-                "retries": 5,
-                "routes": [],
-                "schedulerId": SCHEDULER_ID,
-                "scopes": self.scopes + [f"secrets:get:{DECISION_TASK_SECRET}"],
-                "tags": {},
-            }
-            add_capabilities_for_scopes(task)
-            if env is not None:
-                assert set(task["payload"]["env"]).isdisjoint(set(env))
-                task["payload"]["env"].update(env)
-
-            yield task_id, task
+            yield template.stamp(
+                task_slug(parent_task_id, self.pool_id, i),
+                f"Fuzzing task {self.task_id} - {i}/{self.tasks}",
+                deps,
+            )
 
 
 class PoolConfigMap(CommonPoolConfigMap):
@@ -368,6 +713,19 @@ class PoolConfigMap(CommonPoolConfigMap):
     def task_id(self):
         return f"{self.platform}-{self.pool_id}"
 
+    def max_capacity(self):
+        """Number of task slots the worker pool is allowed to run"""
+        return max(sum(pool.tasks for pool in self.pools) * 2, 3)
+
+    def hourly_cost(self, providers, machine_types):
+        """Expected hourly cost of the pool when running at `max_capacity()`
+
+        Returns:
+            float: cost, or None if machine prices are unknown
+        """
+        cost = slot_cost(self, providers, machine_types)
+        return None if cost is None else cost * self.max_capacity()
+
     def build_resources(self, providers, machine_types, env=None):
         """Build the full tc-admin resources to compare and build the pool"""
 
@@ -375,18 +733,21 @@ class PoolConfigMap(CommonPoolConfigMap):
         assert self.cloud in providers, f"Cloud Provider {self.cloud} not available"
         provider = providers[self.cloud]
 
-        pools = list(self.iterpools())
+        pools = self.pools
         all_scopes = tuple(
-            set(itertools.chain.from_iterable(pool.scopes for pool in pools))
+            sorted(set(itertools.chain.from_iterable(pool.scopes for pool in pools)))
         )
 
         # Build the pool configuration for selected machines
         machines = self.get_machine_list(machine_types)
         config = {
             "minCapacity": 0,
-            "maxCapacity": max(sum(pool.tasks for pool in pools) * 2, 3),
+            "maxCapacity": self.max_capacity(),
             "launchConfigs": provider.build_launch_configs(
-                self.imageset, machines, self.disk_size
+                self.imageset,
+                machines,
+                self.disk_size,
+                prices=self.machine_prices(machine_types),
             ),
             "lifecycle": {
                 # give workers 15 minutes to register before assuming they're broken
@@ -408,7 +769,7 @@ class PoolConfigMap(CommonPoolConfigMap):
             "created": {"$fromNow": "0 seconds"},
             "deadline": {"$fromNow": "1 hour"},
             "expires": {"$fromNow": "1 week"},
-            "extra": {},
+            "extra": {"fuzzing": {"fingerprints": task_fingerprints(self)}},
             "metadata": {
                 "description": DESCRIPTION,
                 "name": f"Fuzzing decision {self.task_id}",
@@ -475,73 +836,48 @@ class PoolConfigMap(CommonPoolConfigMap):
 
         return [pool, hook, role]
 
-    def build_tasks(self, parent_task_id, env=None):
-        """Create fuzzing tasks and attach them to a decision task"""
+    def build_tasks(self, parent_task_id, env=None, members=None):
+        """Create fuzzing tasks and attach them to a decision task
+
+        The tasks don't depend on the decision task, which waits for them to start
+        to replace the previous tasks (see `replace_tasks`).
+
+        Args:
+            parent_task_id (str): decision task
+            env (dict): environment added to the tasks
+            members (set): ids of the members to create tasks for (default: all)
+        """
         now = datetime.utcnow()
-        deps = [parent_task_id]
+        expires = stringDate(fromNow("1 week", now))
+        deps = []
+        artifacts = {
+            "project/fuzzing/private/logs": {
+                "expires": expires,
+                "path": "/logs/",
+                "type": "directory",
+            }
+        }
 
-        for pool in self.iterpools():
+        fingerprints = task_fingerprints(self)
+        for pool in self.pools:
+            if members is not None and pool.pool_id not in members:
+                continue
+            template = TaskTemplate(
+                pool,
+                parent_task_id,
+                now,
+                self.task_id,
+                artifacts,
+                env,
+                fingerprint=fingerprints[pool.pool_id],
+            )
             for i in range(1, pool.tasks + 1):
-                task_id = slugId()
-                task = {
-                    "taskGroupId": parent_task_id,
-                    "dependencies": deps,
-                    "created": stringDate(now),
-                    "deadline": stringDate(now + timedelta(seconds=pool.max_run_time)),
-                    "expires": stringDate(fromNow("1 week", now)),
-                    "extra": {},
-                    "metadata": {
-                        "description": DESCRIPTION,
-                        "name": f"Fuzzing task {pool.platform}-{pool.pool_id} - {i}/{pool.tasks}",
-                        "owner": OWNER_EMAIL,
-                        "source": "https://github.com/MozillaSecurity/fuzzing-tc",
-                    },
-                    "payload": {
-                        "artifacts": {
-                            "project/fuzzing/private/logs": {
-                                "expires": stringDate(fromNow("1 week", now)),
-                                "path": "/logs/",
-                                "type": "directory",
-                            }
-                        },
-                        "cache": {},
-                        "capabilities": {},
-                        "env": {
-                            "TASKCLUSTER_FUZZING_POOL": pool.pool_id,
-                            "TASKCLUSTER_SECRET": DECISION_TASK_SECRET,
-                        },
-                        "features": {"taskclusterProxy": True},
-                        "image": pool.container,
-                        "maxRunTime": pool.max_run_time,
-                    },
-                    "priority": "high",
-                    "provisionerId": PROVISIONER_ID,
-                    "workerType": self.task_id,
-                    "retries": 5,
-                    "routes": [],
-                    "schedulerId": SCHEDULER_ID,
-                    "scopes": pool.scopes + [f"secrets:get:{DECISION_TASK_SECRET}"],
-                    "tags": {},
-                }
-                add_capabilities_for_scopes(task)
-                if env is not None:
-                    assert set(task["payload"]["env"]).isdisjoint(set(env))
-                    task["payload"]["env"].update(env)
-
-                yield task_id, task
-
-
-class PoolConfigLoader:
-    @staticmethod
-    def from_file(pool_yml):
-        assert pool_yml.is_file()
-        data = yaml.safe_load(pool_yml.read_text())
-        for cls in (PoolConfiguration, PoolConfigMap):
-            if set(cls.FIELD_TYPES) >= set(data.keys()) >= cls.REQUIRED_FIELDS:
-                return cls(pool_yml.stem, data, base_dir=pool_yml.parent)
-        LOG.error(
-            f"{pool_yml} has keys {data.keys()} and expected all of either "
-            f"{PoolConfiguration.REQUIRED_FIELDS} or {PoolConfigMap.REQUIRED_FIELDS} to "
-            f"exist."
-        )
-        raise RuntimeError(f"{pool_yml} type could not be identified!")
+                yield template.stamp(
+                    task_slug(parent_task_id, pool.pool_id, i),
+                    f"Fuzzing task {pool.task_id} - {i}/{pool.tasks}",
+                    deps,
+                )
+
+
+class PoolConfigLoader(CommonPoolConfigLoader):
+    POOL_TYPES = (PoolConfiguration, PoolConfigMap)
@@ -1,23 +1,106 @@
 # -*- coding: utf-8 -*-
 
+import abc
+import copy
 import hashlib
 import json
 import logging
 
 import yaml
 
+from ..common.pool import Size
+
 logger = logging.getLogger()
 
 
-class Provider(object):
-    def __init__(self, base_dir):
+class Provider(abc.ABC):
+    def __init__(self, base_dir, max_launch_configs=None):
         self.imagesets = yaml.safe_load(
             (base_dir / "config" / "imagesets.yml").read_text()
         )
+        # keep only the cheapest launch configs of each pool, if set
+        self.max_launch_configs = max_launch_configs
+
+    @abc.abstractmethod
+    def placements(self, imageset, machines):
+        """Generate the places a pool can run in
+
+        Args:
+            imageset (str): imageset name in community-tc-config/config/imagesets.yml
+            machines (list): (instance, capacity, zone blacklist) for each machine type
+
+        Returns:
+            generator of (str, int, str, str): instance, capacity, region and zone
+        """
+
+    @abc.abstractmethod
+    def build_launch_config(self, imageset, placement, worker_config, disk_size):
+        """Build the worker-manager launch config for a placement
+
+        Args:
+            imageset (str): imageset name in community-tc-config/config/imagesets.yml
+            placement (tuple): instance, capacity, region and zone from `placements()`
+            worker_config (dict): worker config for the imageset
+            disk_size (Size): disk size of the instance
+
+        Returns:
+            dict: launch config
+        """
+
+    def rank_placements(self, imageset, machines, prices=None):
+        """Sort placements by cost per task slot, and truncate to `max_launch_configs`
+
+        Placements with an unknown cost come after the others, in their original
+        order. Nothing is truncated if no cost is known, since there is no way to tell
+        which placements are the cheapest.
+
+        Args:
+            imageset (str): imageset name in community-tc-config/config/imagesets.yml
+            machines (list): (instance, capacity, zone blacklist) for each machine type
+            prices (callable): (instance, region, zone) -> hourly price or None
+
+        Returns:
+            list of (tuple, float): each placement and its hourly cost per task slot
+        """
+        ranked = []
+        for placement in self.placements(imageset, machines):
+            cost = None
+            if prices is not None:
+                instance, capacity, region, zone = placement
+                price = prices(instance, region, zone)
+                if price is not None:
+                    cost = price / capacity
+            ranked.append((placement, cost))
+        if prices is not None:
+            ranked.sort(key=lambda item: (item[1] is None, item[1] or 0))
+        if self.max_launch_configs and any(cost is not None for _, cost in ranked):
+            ranked = ranked[: self.max_launch_configs]
+        return ranked
+
+    def build_launch_configs(self, imageset, machines, disk_size, prices=None):
+        """Build the worker-manager launch configs for a pool
+
+        Args:
+            imageset (str): imageset name in community-tc-config/config/imagesets.yml
+            machines (list): (instance, capacity, zone blacklist) for each machine type
+            disk_size (Size): disk size of the instances
+            prices (callable): (instance, region, zone) -> hourly price or None, to
+                sort launch configs cheapest first
+
+        Returns:
+            list of dict: launch configs
+        """
+        ranked = self.rank_placements(imageset, machines, prices)
+        worker_config = self.get_worker_config(imageset)
+        return [
+            self.build_launch_config(imageset, placement, worker_config, disk_size)
+            for placement, _ in ranked
+        ]
 
     def get_worker_config(self, worker):
         assert worker in self.imagesets, f"Missing worker {worker}"
-        out = self.imagesets[worker].get("workerConfig", {})
+        # Copy so the deploymentId doesn't depend on previous calls
+        out = copy.deepcopy(self.imagesets[worker].get("workerConfig", {}))
         out.setdefault("dockerConfig", {})
         out.setdefault("genericWorker", {})
         out["genericWorker"].setdefault("config", {})
@@ -47,9 +130,9 @@ class Provider(object):
 class AWS(Provider):
     """Amazon Cloud provider config for Taskcluster"""
 
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, max_launch_configs=None):
         # Load configuration from cloned community config
-        super().__init__(base_dir)
+        super().__init__(base_dir, max_launch_configs)
         self.regions = self.load_regions(base_dir / "config" / "aws.yml")
         logger.info("Loaded AWS configuration")
 
@@ -73,42 +156,42 @@ class AWS(Provider):
         assert worker in self.imagesets, f"Missing worker {worker}"
         return self.imagesets[worker]["aws"]["amis"]
 
-    def build_launch_configs(self, imageset, machines, disk_size):
-        # Load the AWS infos for that imageset
+    def placements(self, imageset, machines):
         amis = self.get_amis(imageset)
-        worker_config = self.get_worker_config(imageset)
-
-        return [
-            {
-                "capacityPerInstance": capacity,
-                "region": region_name,
-                "launchConfig": {
-                    "ImageId": amis[region_name],
-                    "Placement": {"AvailabilityZone": az},
-                    "SubnetId": subnet,
-                    "SecurityGroupIds": [
-                        # Always use the no-inbound sec group
-                        region["security_groups"]["no-inbound"]
-                    ],
-                    "InstanceType": instance,
-                    # Always use spot instances
-                    "InstanceMarketOptions": {"MarketType": "spot"},
-                },
-                "workerConfig": worker_config,
-            }
-            for instance, capacity, az_blacklist in machines
-            for region_name, region in self.regions.items()
-            for az, subnet in region["subnets"].items()
-            if region_name in amis and az not in az_blacklist
-        ]
+        for instance, capacity, az_blacklist in machines:
+            for region_name, region in self.regions.items():
+                for az in region["subnets"]:
+                    if region_name in amis and az not in az_blacklist:
+                        yield instance, capacity, region_name, az
+
+    def build_launch_config(self, imageset, placement, worker_config, disk_size):
+        instance, capacity, region_name, az = placement
+        region = self.regions[region_name]
+        return {
+            "capacityPerInstance": capacity,
+            "region": region_name,
+            "launchConfig": {
+                "ImageId": self.get_amis(imageset)[region_name],
+                "Placement": {"AvailabilityZone": az},
+                "SubnetId": region["subnets"][az],
+                "SecurityGroupIds": [
+                    # Always use the no-inbound sec group
+                    region["security_groups"]["no-inbound"]
+                ],
+                "InstanceType": instance,
+                # Always use spot instances
+                "InstanceMarketOptions": {"MarketType": "spot"},
+            },
+            "workerConfig": worker_config,
+        }
 
 
 class GCP(Provider):
     """Google Cloud provider config for Taskcluster"""
 
-    def __init__(self, base_dir):
+    def __init__(self, base_dir, max_launch_configs=None):
         # Load configuration from cloned community config
-        super().__init__(base_dir)
+        super().__init__(base_dir, max_launch_configs)
         gcp_config = yaml.safe_load((base_dir / "config" / "gcp.yml").read_text())
         assert "regions" in gcp_config, "Missing regions in gcp config"
         self.regions = {
@@ -117,39 +200,37 @@ class GCP(Provider):
         }
         logger.info("Loaded GCP configuration")
 
-    def build_launch_configs(self, imageset, machines, disk_size):
-
-        # Load source image
+    def placements(self, imageset, machines):
+        # Check the imageset supports GCP
         assert imageset in self.imagesets, f"Missing imageset {imageset}"
         assert (
             "gcp" in self.imagesets[imageset]
         ), f"No GCP implementation for imageset {imageset}"
-        source_image = self.imagesets[imageset]["gcp"]["image"]
-        worker_config = self.get_worker_config(imageset)
-
-        return [
-            {
-                "capacityPerInstance": capacity,
-                "machineType": f"zones/{zone}/machineTypes/{instance}",
-                "region": region,
-                "zone": zone,
-                "scheduling": {"onHostMaintenance": "terminate"},
-                "disks": [
-                    {
-                        "type": "PERSISTENT",
-                        "boot": True,
-                        "autoDelete": True,
-                        "initializeParams": {
-                            "sourceImage": source_image,
-                            "diskSizeGb": disk_size,
-                        },
-                    }
-                ],
-                "networkInterfaces": [{"accessConfigs": [{"type": "ONE_TO_ONE_NAT"}]}],
-                "workerConfig": worker_config,
-            }
-            for instance, capacity, zone_blacklist in machines
-            for region, zones in self.regions.items()
-            for zone in zones
-            if zone not in zone_blacklist
-        ]
+        for instance, capacity, zone_blacklist in machines:
+            for region, zones in self.regions.items():
+                for zone in zones:
+                    if zone not in zone_blacklist:
+                        yield instance, capacity, region, zone
+
+    def build_launch_config(self, imageset, placement, worker_config, disk_size):
+        instance, capacity, region, zone = placement
+        return {
+            "capacityPerInstance": capacity,
+            "machineType": f"zones/{zone}/machineTypes/{instance}",
+            "region": region,
+            "zone": zone,
+            "scheduling": {"onHostMaintenance": "terminate"},
+            "disks": [
+                {
+                    "type": "PERSISTENT",
+                    "boot": True,
+                    "autoDelete": True,
+                    "initializeParams": {
+                        "sourceImage": self.imagesets[imageset]["gcp"]["image"],
+                        "diskSizeGb": disk_size // Size.GIGABYTE,
+                    },
+                }
+            ],
+            "networkInterfaces": [{"accessConfigs": [{"type": "ONE_TO_ONE_NAT"}]}],
+            "workerConfig": worker_config,
+        }
@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+
+# This Source Code Form is subject to the terms of the Mozilla Public License,
+# v. 2.0. If a copy of the MPL was not distributed with this file, You can
+# obtain one at http://mozilla.org/MPL/2.0/.
+
+import collections
+import heapq
+import itertools
+import math
+import random
+
+from ..common.pool import parse_time
+
+# durations used when no samples were recorded, in seconds
+DEFAULT_SAMPLES = {
+    # from a task being pending to a new worker claiming it
+    "start_latency": 300,
+    # run time of the decision task
+    "decision": 120,
+}
+# time a worker waits for a new task before shutting down
+DEFAULT_IDLE_TIMEOUT = 600
+
+SimulationResult = collections.namedtuple(
+    "SimulationResult",
+    "pool_id max_capacity peak_capacity mean_capacity peak_workers mean_workers "
+    "busy_core_hours idle_core_hours",
+)
+
+
+def load_samples(data, pool_id):
+    """Get the samples recorded for a pool
+
+    Samples are lists of durations (numbers of seconds, or strings like "1h30m"),
+    for each of "start_latency", "decision", "preprocess" and "duration". Lists
+    under `pools: {pool_id: {...}}` replace the global ones for that pool.
+
+    Args:
+        data (dict): recorded samples, as loaded from YAML
+        pool_id (str): pool to get the samples of
+
+    Returns:
+        dict: name -> list of seconds
+    """
+    samples = {key: value for key, value in data.items() if key != "pools"}
+    samples.update(data.get("pools", {}).get(pool_id, {}))
+    result = {}
+    for name, values in samples.items():
+        assert isinstance(values, list) and values, f"{name} must be a list of times"
+        result[name] = [
+            value if isinstance(value, (int, float)) else parse_time(value)
+            for value in values
+        ]
+    return result
+
+
+class _Task:
+    __slots__ = ("duration", "created", "dependents", "waiting", "state", "worker")
+
+    def __init__(self, duration, waiting=0):
+        self.duration = duration
+        # tasks created once this one starts running
+        self.created = []
+        self.dependents = []
+        self.waiting = waiting
+        self.state = "blocked" if waiting else "pending"
+        self.worker = None
+
+
+class _Worker:
+    __slots__ = ("ready", "running", "idle_token")
+
+    def __init__(self):
+        self.ready = False
+        self.running = 0
+        self.idle_token = 0
+
+
+class PoolSimulator:
+    """Discrete-event simulation of the worker pool of a pool (or pool map).
+
+    The hook fires every `cycle_time` and its decision task creates the preprocess
+    and fuzzing tasks once it runs. Fuzzing tasks only become pending once the
+    preprocess task completed, if any.
+    Pending tasks are claimed by idle workers if any are running, otherwise workers
+    are launched for them and become available after a start latency. Workers shut
+    down once idle for `idle_timeout`.
+
+    Args:
+        pool (PoolConfiguration or PoolConfigMap): pool configuration
+        machine_types (MachineTypes): database of all machine types
+        samples (dict): name -> list of recorded seconds (see `load_samples`)
+        idle_timeout (int): seconds an idle worker waits for a new task
+        cancel (bool): each fire cancels the tasks of the previous ones, as when the
+            hook is triggered manually
+        seed (int): seed of the samples selection
+    """
+
+    def __init__(
+        self,
+        pool,
+        machine_types,
+        samples=None,
+        idle_timeout=DEFAULT_IDLE_TIMEOUT,
+        cancel=False,
+        seed=0,
+    ):
+        self.pool = pool
+        self.samples = samples or {}
+        self.idle_timeout = idle_timeout
+        self.cancel = cancel
+        self._random = random.Random(seed)
+
+        # workers are assumed to use the preferred machine type
+        machine, self.capacity, _ = next(iter(pool.get_machine_list(machine_types)))
+        self.cpus = machine_types.cpus(pool.cloud, pool.cpu, machine)
+
+    def _sample(self, name, default=None):
+        values = self.samples.get(name)
+        if values is None:
+            return DEFAULT_SAMPLES[name] if default is None else default
+        return self._random.choice(values)
+
+    def _fire(self):
+        """Create the tasks of one decision
+
+        Returns:
+            list of _Task: all tasks created, the decision task first
+        """
+        decision = _Task(min(self._sample("decision"), parse_time("1h")))
+        created = [decision]
+        for member in self.pool.iterpools():
+            deps = []
+            preprocess = member.create_preprocess()
+            if preprocess is not None:
+                task = _Task(
+                    min(
+                        self._sample("preprocess", preprocess.max_run_time),
+                        preprocess.max_run_time,
+                    ),
+                    waiting=1,
+                )
+                decision.created.append(task)
+                deps.append(task)
+                created.append(task)
+            for _ in range(member.tasks):
+                # waiting to be created by the decision task, and for the
+                # preprocess task
+                task = _Task(
+                    min(
+                        self._sample("duration", member.max_run_time),
+                        member.max_run_time,
+                    ),
+                    waiting=1 + len(deps),
+                )
+                decision.created.append(task)
+                for dep in deps:
+                    dep.dependents.append(task)
+                created.append(task)
+        return created
+
+    def run(self, horizon, warmup=None):
+        """Simulate the pool
+
+        Args:
+            horizon (int): seconds to measure the pool for
+            warmup (int): seconds simulated before measuring, so the pool reaches its
+                steady state (default: twice the longest of cycle_time and
+                max_run_time)
+
+        Returns:
+            SimulationResult: usage of the pool during `horizon`. Idle cores include
+                those of workers which are still starting.
+        """
+        assert horizon > 0, "horizon must be positive"
+        if warmup is None:
+            longest = max(member.max_run_time for member in self.pool.iterpools())
+            warmup = 2 * max(self.pool.cycle_time, longest)
+        end = warmup + horizon
+        cores_per_task = self.pool.cores_per_task
+
+        sequence = itertools.count()
+        events = []
+
+        def _schedule(when, kind, *args):
+            heapq.heappush(events, (when, next(sequence), kind, args))
+
+        # insertion ordered, so tasks are always assigned to the oldest workers
+        workers = {}
+        pending = collections.deque()
+        fires = []
+
+        # time integrals and peaks of (workers, capacity, busy slots, idle cores)
+        totals = [0, 0, 0, 0]
+        peaks = [0, 0]
+        busy = 0
+        last = 0
+
+        def _measure(now):
+            start, stop = max(last, warmup), min(now, end)
+            if stop <= start:
+                return
+            capacity = len(workers) * self.capacity
+            idle = len(workers) * self.cpus - busy * cores_per_task
+            for index, value in enumerate((len(workers), capacity, busy, idle)):
+                totals[index] += value * (stop - start)
+            peaks[0] = max(peaks[0], len(workers))
+            peaks[1] = max(peaks[1], capacity)
+
+        def _release(task, now):
+            nonlocal busy
+            worker = task.worker
+            worker.running -= 1
+            busy -= 1
+            if not worker.running:
+                worker.idle_token += 1
+                _schedule(now + self.idle_timeout, "idle", worker, worker.idle_token)
+
+        def _unblock(task):
+            task.waiting -= 1
+            if not task.waiting and task.state == "blocked":
+                task.state = "pending"
+                pending.append(task)
+
+        def _dispatch(now):
+            nonlocal busy
+            while pending and pending[0].state != "pending":
+                pending.popleft()
+            free = [
+                worker
+                for worker in workers
+                if worker.ready and worker.running < self.capacity
+            ]
+            for worker in free:
+                while pending and worker.running < self.capacity:
+                    task = pending.popleft()
+                    if task.state != "pending":
+                        continue
+                    task.state = "running"
+                    task.worker = worker
+                    worker.running += 1
+                    busy += 1
+                    _schedule(now + task.duration, "done", task)
+                    for created in task.created:
+                        _unblock(created)
+            waiting = sum(task.state == "pending" for task in pending)
+            booting = sum(
+                self.capacity - worker.running for worker in workers if not worker.ready
+            )
+            for _ in range(math.ceil(max(0, waiting - booting) / self.capacity)):
+                worker = _Worker()
+                workers[worker] = None
+                _schedule(now + self._sample("start_latency"), "boot", worker)
+
+        _schedule(0, "fire")
+        while events:
+            now, _, kind, args = heapq.heappop(events)
+            if now >= end:
+                break
+            _measure(now)
+            last = now
+
+            if kind == "fire":
+                if self.cancel:
+                    for task in itertools.chain.from_iterable(fires):
+                        if task.state == "running":
+                            _release(task, now)
+                        if task.state in {"blocked", "pending", "running"}:
+                            task.state = "cancelled"
+                    fires = []
+                created = self._fire()
+                if self.cancel:
+                    fires.append(created)
+                pending.append(created[0])
+                _schedule(now + self.pool.cycle_time, "fire")
+            elif kind == "boot":
+                (worker,) = args
+                worker.ready = True
+                worker.idle_token += 1
+                _schedule(now + self.idle_timeout, "idle", worker, worker.idle_token)
+            elif kind == "done":
+                (task,) = args
+                if task.state != "running":
+                    # cancelled while running
+                    continue
+                task.state = "completed"
+                _release(task, now)
+                for dependent in task.dependents:
+                    _unblock(dependent)
+            elif kind == "idle":
+                worker, token = args
+                if worker.idle_token == token and not worker.running:
+                    del workers[worker]
+            _dispatch(now)
+        _measure(end)
+
+        return SimulationResult(
+            pool_id=self.pool.pool_id,
+            max_capacity=self.pool.max_capacity(),
+            peak_capacity=peaks[1],
+            mean_capacity=totals[1] / horizon,
+            peak_workers=peaks[0],
+            mean_workers=totals[0] / horizon,
+            busy_core_hours=totals[2] * cores_per_task / 3600,
+            idle_core_hours=totals[3] / 3600,
+        )
@@ -5,27 +5,54 @@
 # obtain one at http://mozilla.org/MPL/2.0/.
 
 import atexit
+import concurrent.futures
+import functools
 import logging
 import pathlib
 import shutil
 import tempfile
 
 import yaml
+from taskcluster.exceptions import TaskclusterRestFailure
 from tcadmin.appconfig import AppConfig
+from tcadmin.resources.resources import Resource
 
-from ..common import taskcluster
 from ..common.pool import MachineTypes
+from ..common.pool import PoolRepository
 from ..common.workflow import Workflow as CommonWorkflow
 from . import HOOK_PREFIX
 from . import WORKER_POOL_PREFIX
+from .cache import ResourceCache
+from .cache import machines_digest
+from .pool import TASKCLUSTER_BACKOFF
+from .pool import TASKCLUSTER_RETRIES
 from .pool import PoolConfigLoader
 from .pool import cancel_tasks
+from .pool import previous_tasks
+from .pool import replace_tasks
+from .pool import retry_call
+from .pool import slot_cost
+from .pool import task_fingerprints
+from .pool import thread_clients
 from .providers import AWS
 from .providers import GCP
+from .simulate import PoolSimulator
+from .simulate import load_samples
 
 logger = logging.getLogger()
 
 
+def _build_pool_resources(pool, providers, machine_types, env):
+    """Build resources for a pool in a worker process
+
+    Resources can't be pickled, so they are returned as JSON.
+    """
+    return [
+        resource.to_json()
+        for resource in pool.build_resources(providers, machine_types, env)
+    ]
+
+
 class Workflow(CommonWorkflow):
     """Fuzzing decision task workflow"""
 
@@ -60,13 +87,28 @@ class Workflow(CommonWorkflow):
             secret=appconfig.options.get("fuzzing_taskcluster_secret"),
             fuzzing_git_repository=appconfig.options.get("fuzzing_git_repository"),
             fuzzing_git_revision=appconfig.options.get("fuzzing_git_revision"),
+            git_cache_dir=appconfig.options.get("fuzzing_git_cache"),
         )
 
         # Retrieve remote repositories
         workflow.clone(config)
 
         # Then generate all our Taskcluster resources
-        workflow.generate(resources, config)
+        resource_cache = appconfig.options.get("fuzzing_resource_cache")
+        if resource_cache is not None:
+            resource_cache = pathlib.Path(resource_cache)
+        jobs = int(appconfig.options.get("fuzzing_jobs") or 1)
+        max_launch_configs = appconfig.options.get("fuzzing_max_launch_configs")
+        if max_launch_configs:
+            max_launch_configs = int(max_launch_configs)
+        workflow.generate(
+            resources,
+            config,
+            resource_cache=resource_cache,
+            jobs=jobs,
+            max_launch_configs=max_launch_configs,
+            pool_bundle=appconfig.options.get("fuzzing_pool_bundle"),
+        )
 
     def clone(self, config):
         """Clone remote repositories according to current setup"""
@@ -76,31 +118,201 @@ class Workflow(CommonWorkflow):
         self.fuzzing_config_dir = self.git_clone(**config["fuzzing_config"])
         self.community_config_dir = self.git_clone(**config["community_config"])
 
-    def generate(self, resources, config):
+    def generate(
+        self,
+        resources,
+        config,
+        resource_cache=None,
+        jobs=1,
+        max_launch_configs=None,
+        pool_bundle=None,
+    ):
+        """Generate Taskcluster resources for all the pools
+
+        Args:
+            resources (tcadmin.resources.Resources): resources to update
+            config (dict): workflow configuration
+            resource_cache (pathlib.Path): if given, only regenerate pools affected by
+                changes since the run which wrote this file, and update it
+            jobs (int): number of processes used to build pool resources
+            max_launch_configs (int): keep only the cheapest launch configs of each
+                pool, if set
+            pool_bundle (str): path of a compiled pool bundle provided in the decision
+                task image, passed to decision tasks if set
+        """
 
         # Setup resources manager to track only fuzzing instances
         for pattern in self.build_resources_patterns():
             resources.manage(pattern)
 
-        # Load the cloud configuration from community config
-        clouds = {
-            "aws": AWS(self.community_config_dir),
-            "gcp": GCP(self.community_config_dir),
-        }
-
-        # Load the machine types
-        machines = MachineTypes.from_file(self.fuzzing_config_dir / "machines.yml")
-
         # Pass fuzzing-tc-config repository through to decision tasks, if specified
         env = {}
         if set(config["fuzzing_config"]) >= {"url", "revision"}:
             env["FUZZING_GIT_REPOSITORY"] = config["fuzzing_config"]["url"]
             env["FUZZING_GIT_REVISION"] = config["fuzzing_config"]["revision"]
+        if pool_bundle:
+            env["FUZZING_POOL_BUNDLE"] = str(pool_bundle)
+
+        # Reuse all the cached resources if nothing changed since the cached run
+        cache = invalidated = None
+        if resource_cache is not None:
+            cache = ResourceCache(resource_cache)
+            if cache.up_to_date(
+                self.fuzzing_config_dir,
+                self.community_config_dir,
+                env,
+                max_launch_configs,
+            ):
+                logger.info(f"Reusing the resources of {len(cache.pools)} pools")
+                for pool_id in cache.pools:
+                    resources.update(cache.resources(pool_id))
+                return
+
+        # Load the cloud configuration from community config
+        clouds = self.load_providers(max_launch_configs)
 
-        # Browse the files in the repo
-        for config_file in self.fuzzing_config_dir.glob("pool*.yml"):
-            pool_config = PoolConfigLoader.from_file(config_file)
-            resources.update(pool_config.build_resources(clouds, machines, env))
+        # Load the machine types
+        machines = MachineTypes.from_file(self.fuzzing_config_dir / "machines.yml")
+
+        # Resolve all the pools in the repo
+        repository = PoolRepository(self.fuzzing_config_dir, PoolConfigLoader)
+
+        # Find which pools changed since the cached run
+        if cache is not None:
+            invalidated = cache.invalidated(
+                repository,
+                self.fuzzing_config_dir,
+                self.community_config_dir,
+                env,
+                max_launch_configs,
+            )
+            if invalidated is not None:
+                logger.info(
+                    f"Regenerating {len(invalidated)}/{len(repository.pools)} pools"
+                )
+
+        # Build the pools which can't be reused from the cache
+        pools = [
+            pool_config
+            for pool_id, pool_config in repository.pools.items()
+            if invalidated is None or pool_id in invalidated
+        ]
+        built = self.build_pool_resources(pools, clouds, machines, env, jobs)
+        built = {pool.pool_id: result for pool, result in zip(pools, built)}
+
+        # Add them in a deterministic order
+        generated = {}
+        for pool_id in repository.pools:
+            if pool_id in built:
+                pool_resources = built[pool_id]
+            else:
+                pool_resources = cache.resources(pool_id)
+            generated[pool_id] = pool_resources
+            resources.update(pool_resources)
+
+        if cache is not None:
+            revisions = {
+                "fuzzing": self.git_revision(self.fuzzing_config_dir),
+                "community": self.git_revision(self.community_config_dir),
+            }
+            cache.save(
+                revisions,
+                env,
+                generated,
+                repository.pools,
+                all(
+                    self.git_clean(path)
+                    for path in (self.fuzzing_config_dir, self.community_config_dir)
+                ),
+                machines_digest(self.fuzzing_config_dir),
+                max_launch_configs,
+            )
+
+    def load_providers(self, max_launch_configs=None):
+        """Load the cloud configuration from community config
+
+        Args:
+            max_launch_configs (int): keep only the cheapest launch configs of each
+                pool, if set
+
+        Returns:
+            dict: cloud name -> Provider
+        """
+        return {
+            "aws": AWS(self.community_config_dir, max_launch_configs),
+            "gcp": GCP(self.community_config_dir, max_launch_configs),
+        }
+
+    def cost_report(self):
+        """Estimate the hourly cost of each pool when running at full capacity
+
+        Returns:
+            list of (str, int, float, float): pool id, maximum capacity, hourly cost of
+                a task slot and of the whole pool (costs are None if unknown)
+        """
+        providers = self.load_providers()
+        machines = MachineTypes.from_file(self.fuzzing_config_dir / "machines.yml")
+        repository = PoolRepository(self.fuzzing_config_dir, PoolConfigLoader)
+        result = []
+        for pool_id, pool in repository.pools.items():
+            cost = slot_cost(pool, providers, machines)
+            capacity = pool.max_capacity()
+            total = None if cost is None else cost * capacity
+            result.append((pool_id, capacity, cost, total))
+        return result
+
+    def simulation_report(self, horizon, samples=None, **kwds):
+        """Simulate the worker pool of each pool, to compare the capacity it uses with
+        its configured maximum
+
+        Args:
+            horizon (int): seconds to simulate each pool for
+            samples (dict): recorded durations (see `simulate.load_samples`)
+            **kwds: passed to PoolSimulator
+
+        Returns:
+            list of SimulationResult: usage of each pool
+        """
+        machines = MachineTypes.from_file(self.fuzzing_config_dir / "machines.yml")
+        repository = PoolRepository(self.fuzzing_config_dir, PoolConfigLoader)
+        return [
+            PoolSimulator(
+                pool, machines, load_samples(samples or {}, pool_id), **kwds
+            ).run(horizon)
+            for pool_id, pool in repository.pools.items()
+        ]
+
+    @staticmethod
+    def build_pool_resources(pools, providers, machine_types, env, jobs=1):
+        """Build the tc-admin resources of several pools
+
+        Args:
+            pools (list): pool configurations
+            providers (dict): cloud providers
+            machine_types (MachineTypes): database of all machine types
+            env (dict): environment passed to decision tasks
+            jobs (int): number of processes to use (1 to build in this process)
+
+        Returns:
+            list: list of resources for each pool, in the same order as `pools`
+        """
+        if jobs <= 1 or len(pools) <= 1:
+            return [
+                pool.build_resources(providers, machine_types, env) for pool in pools
+            ]
+
+        build = functools.partial(
+            _build_pool_resources,
+            providers=providers,
+            machine_types=machine_types,
+            env=env,
+        )
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            chunksize = max(1, len(pools) // (jobs * 4))
+            return [
+                [Resource.from_json(resource) for resource in result]
+                for result in executor.map(build, pools, chunksize=chunksize)
+            ]
 
     def build_resources_patterns(self):
         """Build regex patterns to manage our resources"""
@@ -143,31 +355,179 @@ class Workflow(CommonWorkflow):
             rf"Role=hook-id:{HOOK_PREFIX}/{role_suffix}",
         ]
 
-    def build_tasks(self, pool_name, task_id, config, dry_run=False):
-        path = self.fuzzing_config_dir / f"{pool_name}.yml"
-        assert path.exists(), f"Missing pool {pool_name}"
+    def build_tasks(
+        self,
+        pool_name,
+        task_id,
+        config,
+        dry_run=False,
+        pool_bundle=None,
+        concurrency=1,
+        cancel_first=False,
+    ):
+        # Use the compiled configuration if it matches our checkout
+        bundle = None
+        if pool_bundle is not None:
+            bundle = PoolConfigLoader.load_bundle(
+                pool_bundle, self.git_revision(self.fuzzing_config_dir)
+            )
+        if bundle is None:
+            path = self.fuzzing_config_dir / f"{pool_name}.yml"
+            assert path.exists(), f"Missing pool {pool_name}"
 
         # Pass fuzzing-tc-config repository through to tasks, if specified
         env = {}
         if set(config["fuzzing_config"]) >= {"url", "revision"}:
             env["FUZZING_GIT_REPOSITORY"] = config["fuzzing_config"]["url"]
             env["FUZZING_GIT_REVISION"] = config["fuzzing_config"]["revision"]
+        # Only point tasks to the bundle when it matches their configuration
+        if bundle is not None:
+            env["FUZZING_POOL_BUNDLE"] = str(pool_bundle)
 
         # Build tasks needed for a specific pool
-        pool_config = PoolConfigLoader.from_file(path)
-
-        # cancel any previously running tasks
+        if bundle is not None:
+            pool_config = PoolConfigLoader.from_bundle(
+                bundle, pool_name, self.fuzzing_config_dir
+            )
+        else:
+            pool_config = PoolConfigLoader.from_file(path)
+
+        # find the previously running tasks, and cancel them right away if asked to.
+        # the tasks of members which didn't change keep running, and aren't created
+        # again
+        previous = {}
+        members = None
+        fingerprints = task_fingerprints(pool_config)
+        keep = {fingerprint: [] for fingerprint in fingerprints.values()}
         if not dry_run:
-            cancel_tasks(pool_config.task_id)
+            max_run_time = max(pool.max_run_time for pool in pool_config.iterpools())
+            if cancel_first:
+                cancel_tasks(pool_config.task_id, max_run_time, concurrency, keep)
+            else:
+                previous = previous_tasks(
+                    pool_config.task_id, max_run_time, concurrency, keep
+                )
+            members = {
+                pool_id
+                for pool_id, fingerprint in fingerprints.items()
+                if not keep[fingerprint]
+            }
+            logger.info(
+                f"Creating tasks for {len(members)} of {len(fingerprints)} members, "
+                f"keeping {sum(len(ids) for ids in keep.values())} unchanged tasks"
+            )
 
-        tasks = pool_config.build_tasks(task_id, env)
+        tasks = list(pool_config.build_tasks(task_id, env, members))
 
         if not dry_run:
             # Create all the tasks on taskcluster
-            queue = taskcluster.get_service("queue")
-            for task_id, task in tasks:
-                logger.info(f"Creating task {task['metadata']['name']} as {task_id}")
-                queue.createTask(task_id, task)
+            self.create_tasks(tasks, concurrency)
+
+            # then cancel the previous tasks as the new ones start
+            if previous:
+                replace_tasks(
+                    previous,
+                    [task_id for task_id, _ in tasks],
+                    # the kept tasks also use slots of the worker pool
+                    pool_config.max_capacity() - sum(len(ids) for ids in keep.values()),
+                    concurrency,
+                )
+
+    @staticmethod
+    def create_tasks(
+        tasks, concurrency=1, retries=TASKCLUSTER_RETRIES, backoff=TASKCLUSTER_BACKOFF
+    ):
+        """Create tasks in Taskcluster, several at once.
+
+        A task is only created once the tasks it depends on in `tasks` were, so
+        dependencies (like the preprocess task) are created first. Transient errors
+        are retried with an exponential backoff, and tasks which already exist (from
+        an earlier run of the decision task) are skipped. Tasks which can't be created, and
+        those depending on them, are reported together once all others are created.
+
+        Args:
+            tasks (list): (task id, task definition) to create
+            concurrency (int): maximum number of tasks created at once
+            retries (int): retries of each createTask call
+            backoff (float): seconds before the first retry, doubled for each retry
+
+        Raises:
+            RuntimeError: if any task couldn't be created
+        """
+        queue = thread_clients("queue")
+
+        def _create(task_id, task):
+            try:
+                retry_call(
+                    queue().createTask, task_id, task, retries=retries, backoff=backoff
+                )
+            except TaskclusterRestFailure as exc:
+                if exc.status_code != 409:
+                    raise
+                # task ids are deterministic: it was created by an earlier run of this
+                # decision task
+                logger.info(f"Task {task_id} already exists")
+
+        ids = {task_id for task_id, _ in tasks}
+        waiting = {
+            task_id: {dep for dep in task["dependencies"] if dep in ids}
+            for task_id, task in tasks
+        }
+        dependents = {task_id: [] for task_id in ids}
+        for task_id, deps in waiting.items():
+            for dep in deps:
+                dependents[dep].append(task_id)
+        definitions = dict(tasks)
+        failed = {}
+
+        def _skip(task_id, reason):
+            waiting.pop(task_id, None)
+            failed[task_id] = reason
+            for dependent in dependents[task_id]:
+                if dependent in waiting:
+                    _skip(dependent, f"depends on {task_id}")
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            running = {}
+
+            def _submit_ready():
+                for task_id in [
+                    task_id for task_id, deps in waiting.items() if not deps
+                ]:
+                    del waiting[task_id]
+                    task = definitions[task_id]
+                    logger.info(
+                        f"Creating task {task['metadata']['name']} as {task_id}"
+                    )
+                    running[executor.submit(_create, task_id, task)] = task_id
+
+            _submit_ready()
+            while running:
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    task_id = running.pop(future)
+                    try:
+                        future.result()
+                    except Exception as exc:
+                        logger.error(f"Failed to create task {task_id}: {exc}")
+                        _skip(task_id, str(exc))
+                        continue
+                    for dependent in dependents[task_id]:
+                        if dependent in waiting:
+                            waiting[dependent].discard(task_id)
+                _submit_ready()
+
+        for task_id in waiting:
+            failed[task_id] = "circular dependencies"
+        if failed:
+            raise RuntimeError(
+                f"{len(failed)}/{len(tasks)} task(s) could not be created:\n"
+                + "\n".join(
+                    f"{task_id}: {reason}" for task_id, reason in failed.items()
+                )
+            )
 
     def cleanup(self):
         """Cleanup temporary folders at end of execution"""
@@ -7,6 +7,7 @@
 import argparse
 import logging
 import os
+import pathlib
 
 from fuzzing_tc.common.cli import build_cli_parser
 
@@ -27,6 +28,13 @@ def main(args=None):
         help="Load the pre-process config instead of the normal pool config",
         default=os.environ.get("TASKCLUSTER_FUZZING_PREPROCESS") == "1",
     )
+    parser.add_argument(
+        "--pool-bundle",
+        type=pathlib.Path,
+        help="Compiled pool configurations to use instead of the fuzzing repository "
+        "YAML, if they match its revision",
+        default=os.environ.get("FUZZING_POOL_BUNDLE"),
+    )
     parser.add_argument(
         "--dry-run",
         action="store_true",
@@ -39,12 +47,15 @@ def main(args=None):
     logging.basicConfig(level=args.log_level)
 
     # Configure workflow using the secret or local configuration
-    launcher = PoolLauncher(args.command, args.pool_name, args.preprocess)
+    launcher = PoolLauncher(
+        args.command, args.pool_name, args.preprocess, args.pool_bundle
+    )
     config = launcher.configure(
         local_path=args.configuration,
         secret=args.taskcluster_secret,
         fuzzing_git_repository=args.git_repository,
         fuzzing_git_revision=args.git_revision,
+        git_cache_dir=args.git_cache,
     )
 
     if config is not None:
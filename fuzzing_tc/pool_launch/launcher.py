@@ -11,6 +11,7 @@ import pathlib
 import sys
 
 from ..common.pool import PoolConfigLoader
+from ..common.pool import PoolConfigMap
 from ..common.workflow import Workflow
 
 logger = logging.getLogger()
@@ -19,7 +20,7 @@ logger = logging.getLogger()
 class PoolLauncher(Workflow):
     """Launcher for a fuzzing pool, using docker parameters from a private repo."""
 
-    def __init__(self, command, pool_name, preprocess=False):
+    def __init__(self, command, pool_name, preprocess=False, pool_bundle=None):
         super().__init__()
 
         self.command = command.copy()
@@ -30,6 +31,7 @@ class PoolLauncher(Workflow):
             self.pool_name = pool_name
             self.apply = None
         self.preprocess = preprocess
+        self.pool_bundle = pool_bundle
         self.log_dir = pathlib.Path("/logs")
 
     def clone(self, config):
@@ -40,21 +42,46 @@ class PoolLauncher(Workflow):
         self.fuzzing_config_dir = self.git_clone(**config["fuzzing_config"])
 
     def load_params(self):
+        pool_config = None
+        if self.pool_bundle is not None:
+            pool_config = self.load_bundled_pool()
+        if pool_config is None:
+            pool_config = self.load_pool()
+
+        if pool_config.command:
+            assert not self.command, "Specify command-line args XOR pool.command"
+            self.command = pool_config.command.copy()
+        self.environment.update(pool_config.macros)
+
+    def load_pool(self):
         path = self.fuzzing_config_dir / f"{self.pool_name}.yml"
         assert path.exists(), f"Missing pool {self.pool_name}"
 
         # Build tasks needed for a specific pool
-        pool_config = PoolConfigLoader.from_file(path)
+        if self.apply is not None:
+            # only the requested member of the map needs to be resolved
+            pool_config = PoolConfigMap.from_file(path, lazy=True)
+            pool_config = pool_config.apply(self.apply)
+        else:
+            pool_config = PoolConfigLoader.from_file(path)
         if self.preprocess:
             pool_config = pool_config.create_preprocess()
             assert pool_config is not None, "preprocess given, but could not be loaded"
+        return pool_config
+
+    def load_bundled_pool(self):
+        """Load the pool from the compiled bundle, or None if it can't be used"""
+        bundle = PoolConfigLoader.load_bundle(
+            self.pool_bundle, self.git_revision(self.fuzzing_config_dir)
+        )
+        if bundle is None:
+            return None
+        pool_id = self.pool_name
         if self.apply is not None:
-            pool_config = pool_config.apply(self.apply)
-
-        if pool_config.command:
-            assert not self.command, "Specify command-line args XOR pool.command"
-            self.command = pool_config.command.copy()
-        self.environment.update(pool_config.macros)
+            pool_id = f"{self.apply}/{pool_id}"
+        if self.preprocess:
+            pool_id += "/preprocess"
+        return PoolConfigLoader.from_bundle(bundle, pool_id, self.fuzzing_config_dir)
 
     def exec(self):
         assert self.command
@@ -10,8 +10,8 @@ from tcadmin.appconfig import AppConfig
 from tcadmin.resources import Hook
 from tcadmin.resources import WorkerPool
 
+from fuzzing_tc.decision.callbacks import HookTrigger
 from fuzzing_tc.decision.callbacks import cancel_pool_tasks
-from fuzzing_tc.decision.callbacks import trigger_hook
 from fuzzing_tc.decision.workflow import Workflow
 
 appconfig = AppConfig()
@@ -36,6 +36,41 @@ appconfig.options.add(
     help="A git revision for the fuzzing git repository",
     default=os.environ.get("FUZZING_GIT_REVISION"),
 )
+appconfig.options.add(
+    "--fuzzing-git-cache",
+    help="Directory keeping mirrors of the cloned git repositories between runs",
+    default=os.environ.get("FUZZING_GIT_CACHE"),
+)
+appconfig.options.add(
+    "--fuzzing-resource-cache",
+    help="Only regenerate resources for pools changed since the run which wrote "
+    "this file, and update it",
+    default=os.environ.get("FUZZING_RESOURCE_CACHE"),
+)
+appconfig.options.add(
+    "--fuzzing-jobs",
+    help="Number of processes used to generate pool resources (default: 1, "
+    "generating them in the tc-admin process)",
+    default=os.environ.get("FUZZING_JOBS", "1"),
+)
+appconfig.options.add(
+    "--fuzzing-max-launch-configs",
+    help="Keep only the cheapest launch configs of each pool (by machines.yml prices)",
+    default=os.environ.get("FUZZING_MAX_LAUNCH_CONFIGS"),
+)
+appconfig.options.add(
+    "--fuzzing-pool-bundle",
+    help="Path of a compiled pool bundle provided in the decision and fuzzing "
+    "images, passed to decision tasks",
+    default=os.environ.get("FUZZING_POOL_BUNDLE"),
+)
+appconfig.options.add(
+    "--fuzzing-cancel-first",
+    help="Cancel the tasks of hooks with updated task definitions right away, "
+    "instead of letting decision tasks replace them as their new tasks start "
+    "(1, true or yes to enable)",
+    default=os.environ.get("FUZZING_CANCEL_FIRST"),
+)
 
 # We always want to run against community Taskcluster instance
 os.environ["TASKCLUSTER_ROOT_URL"] = "https://community-tc.services.mozilla.com"
@@ -45,12 +80,19 @@ appconfig.generators.register(Workflow.tc_admin_boot)
 appconfig.callbacks.add(
     "before_apply",
     cancel_pool_tasks,
-    actions=["update", "delete"],
+    actions=["delete"],
     resources=[WorkerPool],
 )
+hook_trigger = HookTrigger()
+appconfig.callbacks.add(
+    "before_apply",
+    hook_trigger.check,
+    actions=["update"],
+    resources=[Hook],
+)
 appconfig.callbacks.add(
     "after_apply",
-    trigger_hook,
+    hook_trigger.trigger,
     actions=["create", "update"],
     resources=[Hook],
 )
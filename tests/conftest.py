@@ -7,6 +7,7 @@ from unittest.mock import patch
 
 import pytest
 import responses
+import yaml
 
 from fuzzing_tc.common import taskcluster
 from fuzzing_tc.common.pool import MachineTypes
@@ -17,6 +18,36 @@ from fuzzing_tc.decision.workflow import Workflow
 FIXTURES_DIR = pathlib.Path(__file__).parent / "fixtures"
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark", action="store_true", help="Run the benchmarks, and only them"
+    )
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: performance measurement")
+    config._benchmark_results = []
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if config._benchmark_results:
+        terminalreporter.section("benchmark results")
+        for line in config._benchmark_results:
+            terminalreporter.write_line(line)
+
+
+def pytest_collection_modifyitems(config, items):
+    run_benchmarks = config.getoption("--benchmark")
+    skip = pytest.mark.skip(
+        reason="benchmarks only run with --benchmark"
+        if not run_benchmarks
+        else "only benchmarks run with --benchmark"
+    )
+    for item in items:
+        if ("benchmark" in item.keywords) != run_benchmarks:
+            item.add_marker(skip)
+
+
 @pytest.fixture
 def mock_taskcluster_workflow():
     """Mock Taskcluster HTTP services"""
@@ -54,6 +85,31 @@ def mock_machines():
     return MachineTypes.from_file(path)
 
 
+@pytest.fixture
+def benchmark_results(pytestconfig):
+    """Lines of benchmark results, reported after the tests ran"""
+    return pytestconfig._benchmark_results
+
+
+@pytest.fixture
+def pool_tree(tmp_path):
+    """Write pool configurations in a temporary directory
+
+    The returned function writes `base.yml`, a complete pool configuration updated
+    with the `base` fields, and each of the given {name: configuration}. It returns
+    the directory.
+    """
+
+    def _write(pools, base=None):
+        data = yaml.safe_load((FIXTURES_DIR / "pools" / "pool1.yml").read_text())
+        data.update(base or {})
+        for name, config in dict(pools, base=data).items():
+            (tmp_path / f"{name}.yml").write_text(yaml.dump(config))
+        return tmp_path
+
+    return _write
+
+
 @pytest.fixture(autouse=True)
 def disable_cleanup():
     """Disable workflow cleanup in unit tests as tmpdir is automatically removed"""
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 
+import json
 import os
 from unittest.mock import Mock
 from unittest.mock import patch
@@ -7,6 +8,7 @@ from unittest.mock import patch
 import pytest
 import yaml
 
+from fuzzing_tc.common.pool import PoolConfigLoader
 from fuzzing_tc.pool_launch import cli
 from fuzzing_tc.pool_launch.launcher import PoolLauncher
 
@@ -128,6 +130,101 @@ def test_load_params(tmp_path):
     assert launcher.environment == {"STATIC": "value", "PREPROC": "1"}
 
 
+@patch("os.environ", {})
+def test_load_params_map(tmp_path):
+    pool_data = {
+        "cloud": "aws",
+        "disk_size": "120g",
+        "cycle_time": "1h",
+        "cores_per_task": 10,
+        "metal": False,
+        "name": "Amazing fuzzing pool",
+        "tasks": 3,
+        "command": ["command", "arg"],
+        "container": "MozillaSecurity/fuzzer:latest",
+        "minimum_memory_per_core": "1g",
+        "imageset": "generic-worker-A",
+        "cpu": "arm64",
+        "platform": "linux",
+        "macros": {"ENVVAR1": "123456"},
+    }
+    (tmp_path / "test-pool.yml").write_text(yaml.dump(pool_data))
+    (tmp_path / "other-pool.yml").write_text(yaml.dump({"name": "broken"}))
+    (tmp_path / "test-map.yml").write_text(
+        yaml.dump(
+            {
+                "name": "map",
+                "apply_to": ["test-pool", "other-pool"],
+                "macros": {"ENVVAR2": "789abc"},
+            }
+        )
+    )
+
+    # only the requested pool in the map is resolved
+    launcher = PoolLauncher([], "test-pool/test-map")
+    launcher.fuzzing_config_dir = tmp_path
+    launcher.load_params()
+    assert launcher.command == ["command", "arg"]
+    assert launcher.environment == {"ENVVAR1": "123456", "ENVVAR2": "789abc"}
+
+
+@patch("os.environ", {})
+def test_load_params_bundle(tmp_path):
+    pool_data = {
+        "cloud": "aws",
+        "disk_size": "120g",
+        "cycle_time": "1h",
+        "cores_per_task": 10,
+        "metal": False,
+        "name": "Amazing fuzzing pool",
+        "tasks": 1,
+        "command": ["command", "arg"],
+        "container": "MozillaSecurity/fuzzer:latest",
+        "minimum_memory_per_core": "1g",
+        "imageset": "generic-worker-A",
+        "cpu": "arm64",
+        "platform": "linux",
+        "macros": {"ENVVAR1": "123456"},
+    }
+    (tmp_path / "pool-base.yml").write_text(yaml.dump(pool_data))
+    (tmp_path / "pool-test.yml").write_text(
+        yaml.dump({"name": "test", "parents": ["pool-base"], "preprocess": "preproc"})
+    )
+    (tmp_path / "preproc.yml").write_text(
+        yaml.dump(
+            {"name": "preproc", "tasks": 1, "command": ["pre"], "macros": {"PRE": "1"}}
+        )
+    )
+    (tmp_path / "pool-map.yml").write_text(
+        yaml.dump({"name": "map", "apply_to": ["pool-base"], "macros": {"A": "1"}})
+    )
+    bundle_json = tmp_path / "bundle.json"
+    bundle_json.write_text(json.dumps(PoolConfigLoader.compile(tmp_path, "abc")))
+    # the YAML isn't read when the bundle is used
+    for pool_yml in tmp_path.glob("*.yml"):
+        pool_yml.unlink()
+
+    with patch.object(PoolLauncher, "git_revision", return_value="abc"):
+        launcher = PoolLauncher([], "pool-base/pool-map", pool_bundle=bundle_json)
+        launcher.fuzzing_config_dir = tmp_path
+        launcher.load_params()
+        assert launcher.command == ["command", "arg"]
+        assert launcher.environment == {"ENVVAR1": "123456", "A": "1"}
+
+        launcher = PoolLauncher([], "pool-test", True, bundle_json)
+        launcher.fuzzing_config_dir = tmp_path
+        launcher.load_params()
+        assert launcher.command == ["pre"]
+        assert launcher.environment == {"ENVVAR1": "123456", "PRE": "1"}
+
+        # bundle for another revision falls back to the YAML
+        PoolLauncher.git_revision.return_value = "def"
+        launcher = PoolLauncher([], "pool-test", pool_bundle=bundle_json)
+        launcher.fuzzing_config_dir = tmp_path
+        with pytest.raises(AssertionError, match="Missing pool pool-test"):
+            launcher.load_params()
+
+
 def test_launch_exec(tmp_path, monkeypatch):
     # Start with taskcluster detection disabled, even on CI
     monkeypatch.delenv("TASK_ID", raising=False)
@@ -1,20 +1,53 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import copy
 import datetime
+import itertools
+import json
+import os
+import string
+import subprocess
+import sys
+import time
 from pathlib import Path
+from unittest.mock import Mock
+from unittest.mock import patch
 
 import pytest
 import slugid
+import yaml
+from taskcluster.exceptions import TaskclusterFailure
+from taskcluster.exceptions import TaskclusterRestFailure
 
+from fuzzing_tc.common.cli import parse_flag
+from fuzzing_tc.common.cli import stagger_main
+from fuzzing_tc.common.pool import Duration
+from fuzzing_tc.common.pool import MachineTypes
+from fuzzing_tc.common.pool import PoolConfigError
 from fuzzing_tc.common.pool import PoolConfigLoader as CommonPoolConfigLoader
 from fuzzing_tc.common.pool import PoolConfigMap as CommonPoolConfigMap
 from fuzzing_tc.common.pool import PoolConfiguration as CommonPoolConfiguration
+from fuzzing_tc.common.pool import PoolRepository
+from fuzzing_tc.common.pool import PoolValidator
+from fuzzing_tc.common.pool import ResolvedPool
+from fuzzing_tc.common.pool import Size
+from fuzzing_tc.common.pool import freeze
 from fuzzing_tc.common.pool import parse_size
+from fuzzing_tc.common.pool import parse_time
+from fuzzing_tc.common.stagger import PoolDemand
+from fuzzing_tc.common.stagger import Stagger
+from fuzzing_tc.decision import callbacks
 from fuzzing_tc.decision.pool import DOCKER_WORKER_DEVICES
 from fuzzing_tc.decision.pool import PoolConfigLoader
 from fuzzing_tc.decision.pool import PoolConfigMap
 from fuzzing_tc.decision.pool import PoolConfiguration
+from fuzzing_tc.decision.pool import TaskTemplate
+from fuzzing_tc.decision.pool import cancel_tasks
+from fuzzing_tc.decision.pool import replace_tasks
+from fuzzing_tc.decision.pool import task_fingerprints
+from fuzzing_tc.decision.pool import task_slug
+from fuzzing_tc.decision.providers import GCP
 
 POOL_FIXTURES = Path(__file__).parent / "fixtures" / "pools"
 
@@ -35,6 +68,45 @@ def test_parse_size(size, divisor, result):
     assert parse_size(size) / divisor == result
 
 
+def test_parse_size_exact():
+    size = parse_size("1.5g")
+    assert isinstance(size, Size)
+    assert size == 3 * 512 * 1024 * 1024
+    assert size.gigabytes == 1.5
+    assert parse_size(".1k") == 102
+    assert Size.parse(size) is size
+    with pytest.raises(ValueError):
+        parse_size("1x")
+
+
+@pytest.mark.parametrize(
+    "time, result",
+    [
+        ("30", 30),
+        (30, 30),
+        ("1h30m", 5400),
+        ("2w1d", 15 * 24 * 3600),
+        ("PT1H30M", 5400),
+        ("P1DT1S", 24 * 3600 + 1),
+        ("p2w", 14 * 24 * 3600),
+        ("1h30", ValueError),
+        ("P", ValueError),
+        ("PT", ValueError),
+        ("P1Y", ValueError),
+    ],
+)
+def test_parse_time(time, result):
+    if isinstance(result, int):
+        parsed = Duration.parse(time)
+        assert isinstance(parsed, Duration)
+        assert parsed == result
+        if isinstance(time, str):
+            assert parse_time(time) == result
+    else:
+        with pytest.raises(result):
+            Duration.parse(time)
+
+
 @pytest.mark.parametrize(
     "provider, cpu, cores, ram, metal, result",
     [
@@ -61,6 +133,66 @@ def test_machine_filters(mock_machines, provider, cpu, ram, cores, metal, result
             list(mock_machines.filter(provider, cpu, cores, ram, metal))
 
 
+def test_machine_query(mock_machines):
+    result = mock_machines.query("gcp", "x64", 2, 1)
+    assert [name for name, _, _ in result] == ["2-cpus", "more-ram"]
+    assert all(cpus == 2 for _, cpus, _ in result)
+    assert result[1][2] == frozenset(("us-west1-b",))
+    # identical requirements share the result
+    assert mock_machines.query("gcp", "x64", 2, 1) is result
+    assert mock_machines.query("gcp", "x64", 3, 1) == ()
+
+
+def test_machine_query_pack(mock_machines):
+    # ranked by ram per cpu without prices
+    result = mock_machines.query("gcp", "x64", 1, 1, pack=True)
+    assert [name for name, _, _ in result] == ["base", "metal", "2-cpus", "more-ram"]
+    assert mock_machines.query("gcp", "x64", 2, 4, pack=True) == (
+        ("more-ram", 2, frozenset(("us-west1-b",))),
+    )
+    assert mock_machines.query("gcp", "x64", 1, 1, metal=True, pack=True) == (
+        ("metal", 1, frozenset()),
+    )
+
+    # ranked by price per cpu if every machine has one
+    machines = MachineTypes(
+        {
+            "aws": {
+                "x64": {
+                    "small": {"cpu": 2, "ram": 4, "price": 0.1},
+                    "large": {"cpu": 8, "ram": 16, "price": 0.3},
+                    "odd": {"cpu": 3, "ram": 6, "price": 0.01},
+                }
+            }
+        }
+    )
+    assert [name for name, _, _ in machines.query("aws", "x64", 2, 2, pack=True)] == [
+        "large",
+        "small",
+    ]
+    assert [name for name, _, _ in machines.query("aws", "x64", 2, 2)] == ["small"]
+
+    pool = PoolConfiguration(
+        "test",
+        {
+            "name": "test",
+            "cloud": "aws",
+            "cpu": "x64",
+            "cores_per_task": 2,
+            "minimum_memory_per_core": "2g",
+            "metal": False,
+            "pack_tasks": True,
+        },
+        _flattened={},
+    )
+    assert [
+        (name, capacity) for name, capacity, _ in pool.get_machine_list(machines)
+    ] == [
+        ("large", 4),
+        ("small", 1),
+    ]
+
+
 # Hook & role should be the same across cloud providers
 VALID_HOOK = {
     "kind": "Hook",
@@ -70,7 +202,7 @@ VALID_HOOK = {
     "hookId": "linux-test",
     "name": "linux-test",
     "owner": "fuzzing+taskcluster@mozilla.com",
-    "schedule": ["0 0 12 * * *", "0 0 0 * * *"],
+    "schedule": ["0 0 0,12 * * *"],
     "task": {
         "created": {"$fromNow": "0 seconds"},
         "deadline": {"$fromNow": "1 hour"},
@@ -214,12 +346,86 @@ def test_aws_resources(env, mock_clouds, mock_machines):
 
     # Update env in valid hook
     valid_hook = copy.deepcopy(VALID_HOOK)
+    valid_hook["task"]["extra"] = {"fuzzing": {"fingerprints": task_fingerprints(conf)}}
     if env is not None:
         valid_hook["task"]["payload"]["env"].update(env)
     assert hook.to_json() == valid_hook
     assert role.to_json() == VALID_ROLE
 
 
+def test_launch_config_prices():
+    machines = MachineTypes(
+        {
+            "gcp": {
+                "x64": {
+                    "zonal": {
+                        "cpu": 4,
+                        "ram": 8,
+                        "price": {"us-west1": {"us-west1-a": 0.4, "us-west1-b": 0.2}},
+                    },
+                    "flat": {"cpu": 2, "ram": 4, "price": 0.3},
+                    "unknown": {"cpu": 2, "ram": 4},
+                }
+            }
+        }
+    )
+    assert machines.price("gcp", "x64", "zonal", "us-west1", "us-west1-b") == 0.2
+    assert machines.price("gcp", "x64", "zonal", "us-east1", "us-east1-b") is None
+    assert machines.price("gcp", "x64", "flat", "us-east1") == 0.3
+    with pytest.raises(AssertionError, match="invalid price"):
+        MachineTypes({"aws": {"x64": {"m": {"cpu": 1, "ram": 1, "price": "1$"}}}})
+
+    conf = PoolConfiguration(
+        "test",
+        {
+            "cloud": "gcp",
+            "container": "MozillaSecurity/fuzzer:latest",
+            "cycle_time": "1h",
+            "cores_per_task": 2,
+            "disk_size": "10g",
+            "metal": False,
+            "name": "test",
+            "tasks": 2,
+            "minimum_memory_per_core": "1g",
+            "imageset": "docker-worker",
+            "cpu": "x64",
+            "pack_tasks": True,
+            "platform": "linux",
+        },
+    )
+    community = Path(__file__).parent / "fixtures" / "community"
+    providers = {"gcp": GCP(community)}
+    configs = providers["gcp"].build_launch_configs(
+        conf.imageset,
+        conf.get_machine_list(machines),
+        conf.disk_size,
+        prices=conf.machine_prices(machines),
+    )
+    # cheapest per task slot first, unknown prices last in machines.yml order
+    assert [(c["machineType"], c["capacityPerInstance"]) for c in configs] == [
+        ("zones/us-west1-b/machineTypes/zonal", 2),
+        ("zones/us-west1-a/machineTypes/zonal", 2),
+        ("zones/us-west1-a/machineTypes/flat", 1),
+        ("zones/us-west1-b/machineTypes/flat", 1),
+        ("zones/us-west1-a/machineTypes/unknown", 1),
+        ("zones/us-west1-b/machineTypes/unknown", 1),
+    ]
+    assert conf.max_capacity() == 5
+    assert conf.hourly_cost(providers, machines) == 0.5
+
+    providers = {"gcp": GCP(community, max_launch_configs=2)}
+    pool, _, _ = conf.build_resources(providers, machines)
+    assert [c["machineType"] for c in pool.config["launchConfigs"]] == [
+        "zones/us-west1-b/machineTypes/zonal",
+        "zones/us-west1-a/machineTypes/zonal",
+    ]
+    # without prices, there is no way to tell which are the cheapest
+    configs = providers["gcp"].build_launch_configs(
+        conf.imageset, conf.get_machine_list(machines), conf.disk_size
+    )
+    assert len(configs) == 6
+
+
 @pytest.mark.parametrize("env", [(None), ({"someKey": "someValue"})])
 def test_gcp_resources(env, mock_clouds, mock_machines):
 
@@ -376,6 +582,7 @@ def test_gcp_resources(env, mock_clouds, mock_machines):
 
     # Update env in valid hook
     valid_hook = copy.deepcopy(VALID_HOOK)
+    valid_hook["task"]["extra"] = {"fuzzing": {"fingerprints": task_fingerprints(conf)}}
     if env is not None:
         valid_hook["task"]["payload"]["env"].update(env)
     assert hook.to_json() == valid_hook
@@ -492,8 +699,8 @@ def test_tasks(env, scope_caps):
         #   printed in full on failure
         scopes = task["scopes"]
         assert task == {
-            "dependencies": ["someTaskId"],
-            "extra": {},
+            "dependencies": [],
+            "extra": {"fuzzing": {"fingerprint": task_fingerprints(conf)["test"]}},
             "metadata": {
                 "description": "*DO NOT EDIT* - This resource is configured "
                 "automatically.\n"
@@ -565,10 +772,10 @@ def test_preprocess_tasks():
     expected = [
         {
             "name": "preprocess",
-            "deps": ["someTaskId"],
+            "deps": [],
             "extra_env": {"TASKCLUSTER_FUZZING_PREPROCESS": "1"},
         },
-        {"name": "1/1", "deps": ["someTaskId", task_ids[0]], "extra_env": {}},
+        {"name": "1/1", "deps": [task_ids[0]], "extra_env": {}},
     ]
     for task, expect in zip(tasks, expected):
         created = _check_date(task, "created")
@@ -592,7 +799,7 @@ def test_preprocess_tasks():
         scopes = task["scopes"]
         assert task == {
             "dependencies": expect["deps"],
-            "extra": {},
+            "extra": {"fuzzing": {"fingerprint": task_fingerprints(conf)["pre-pool"]}},
             "metadata": {
                 "description": "*DO NOT EDIT* - This resource is configured "
                 "automatically.\n"
@@ -628,6 +835,318 @@ def test_preprocess_tasks():
         }
 
 
+def test_cancel_tasks(monkeypatch):
+    monkeypatch.setenv("TASK_ID", "self")
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    def _fire(task_id, age, result="success", fired_by="triggerHook"):
+        created = now - datetime.timedelta(hours=age)
+        return {
+            "taskId": task_id,
+            "taskCreateTime": created.isoformat().replace("+00:00", "Z"),
+            "result": result,
+            "firedBy": fired_by,
+        }
+
+    def _task(task_id, group, state, fingerprint=None):
+        return {
+            "status": {
+                "taskId": task_id,
+                "taskGroupId": group,
+                "runs": [{"state": state}],
+            },
+            "task": {"extra": {"fuzzing": {"fingerprint": fingerprint}}},
+        }
+
+    groups = {
+        "self": [{"tasks": [_task("self", "self", "running")]}],
+        "prev": [
+            {
+                "tasks": [_task("t1", "prev", "running"), _task("t2", "prev", "done")],
+                "continuationToken": "page2",
+            },
+            {"tasks": [_task("t3", "prev", "pending")]},
+        ],
+        "older": [{"tasks": [_task("t4", "older", "running", "same")]}],
+    }
+    fires = [
+        _fire("self", 0),
+        _fire("prev", 1),
+        _fire("older", 3),
+        _fire("gone", 1),
+        _fire("error", 1, result="error"),
+    ]
+    # a retried decision task keeps what its earlier run created
+    groups["self"][0]["tasks"].append(_task("kept", "self", "pending"))
+
+    def _list_task_group(group_id, query=None):
+        if group_id == "gone":
+            raise TaskclusterFailure("No task-group with taskGroupId gone")
+        page = 1 if query else 0
+        if query:
+            assert query == {"continuationToken": "page2"}
+        return groups[group_id][page]
+
+    hooks, queue = Mock(), Mock()
+    hooks.listLastFires.return_value = {"lastFires": fires}
+    queue.listTaskGroup.side_effect = _list_task_group
+    queue.cancelTask.side_effect = [
+        TaskclusterRestFailure("down", None, status_code=502),
+        None,
+        None,
+    ]
+    services = {"hooks": hooks, "queue": queue}
+    with patch(
+        "fuzzing_tc.decision.pool.taskcluster.get_service", side_effect=services.get
+    ), patch("fuzzing_tc.decision.pool.time.sleep"):
+        cancel_tasks("linux-pool", max_run_time=3600, concurrency=4)
+        listed = {call[0][0] for call in queue.listTaskGroup.call_args_list}
+        assert listed == {"self", "prev", "gone"}
+        # the first cancellation failed, and was retried
+        cancelled = [call[0][0] for call in queue.cancelTask.call_args_list]
+        assert len(cancelled) == 3
+        assert set(cancelled) == {"t1", "t3"}
+
+        # without max_run_time, every fire is checked
+        queue.reset_mock()
+        queue.cancelTask.side_effect = None
+        cancel_tasks("linux-pool")
+        cancelled = {call[0][0] for call in queue.cancelTask.call_args_list}
+        assert cancelled == {"t1", "t3", "t4"}
+
+        # tasks with an unchanged fingerprint are kept
+        queue.reset_mock()
+        keep = {"same": [], "other": []}
+        cancel_tasks("linux-pool", keep=keep)
+        cancelled = {call[0][0] for call in queue.cancelTask.call_args_list}
+        assert cancelled == {"t1", "t3"}
+        assert keep == {"same": ["t4"], "other": []}
+
+        # scheduled decision tasks don't cancel anything
+        queue.reset_mock()
+        fires[0] = _fire("self", 0, fired_by="schedule")
+        cancel_tasks("linux-pool", max_run_time=3600)
+        queue.listTaskGroup.assert_not_called()
+        queue.cancelTask.assert_not_called()
+
+
+def test_replace_tasks():
+    previous = {"p1": "pending", "r1": "running", "r2": "running", "r3": "running"}
+    new = ["n1", "n2", "n3"]
+    states = {}
+    # state changes of the new tasks during each poll interval
+    changes = []
+    pending = dict.fromkeys(new, "pending")
+
+    def _sleep(_):
+        states.update(changes.pop(0))
+
+    queue = Mock()
+    queue.status.side_effect = lambda task_id: {
+        "status": {"state": states.get(task_id, "unscheduled")}
+    }
+    cancelled = []
+    queue.cancelTask.side_effect = cancelled.append
+
+    with patch(
+        "fuzzing_tc.decision.pool.taskcluster.get_service", return_value=queue
+    ), patch("fuzzing_tc.decision.pool.time.sleep", side_effect=_sleep):
+        # pending tasks are cancelled first, then one running task per new task,
+        # unscheduled and pending new tasks didn't start yet
+        changes[:] = [pending, {"n1": "running"}, {"n2": "running", "n3": "running"}]
+        replace_tasks(previous, new, max_capacity=7)
+        assert cancelled == ["p1", "r1", "r2", "r3"]
+        assert not changes
+
+        # running tasks are cancelled to make room for the new ones
+        states.clear()
+        cancelled.clear()
+        changes[:] = [pending, {"n1": "running"}, {"n2": "running"}]
+        replace_tasks(previous, new, max_capacity=5)
+        assert cancelled == ["p1", "r1", "r2", "r3"]
+        assert changes == [{"n2": "running"}]
+
+        # after the timeout, all previous tasks are cancelled
+        states.clear()
+        cancelled.clear()
+        replace_tasks(previous, new, max_capacity=7, timeout=0)
+        assert cancelled == ["p1", "r1", "r2", "r3"]
+        queue.status.reset_mock()
+
+        # nothing to wait for
+        replace_tasks({"p1": "pending"}, new, max_capacity=7)
+        queue.status.assert_not_called()
+
+
+def test_task_slug():
+    slug = task_slug("someTaskId", "pool", 1)
+    assert slug == task_slug("someTaskId", "pool", 1)
+    assert len(slug) == 22
+    assert slug[0] in string.ascii_uppercase + "abcdef"
+    assert slugid.decode(slug).version == 4
+    others = {
+        task_slug("otherTaskId", "pool", 1),
+        task_slug("someTaskId", "other", 1),
+        task_slug("someTaskId", "pool", 2),
+        task_slug("someTaskId", "pool", 1, preprocess=True),
+    }
+    assert len(others) == 4 and slug not in others
+
+    # a retried decision task builds the same tasks
+    conf = PoolConfiguration.from_file(POOL_FIXTURES / "pre-pool.yml")
+    first, retried = (
+        [task_id for task_id, _ in conf.build_tasks("someTaskId")] for _ in range(2)
+    )
+    assert first == retried
+    assert first[0] == task_slug("someTaskId", "pre-pool", 0, preprocess=True)
+
+
+def test_task_template():
+    conf = PoolConfiguration.from_file(POOL_FIXTURES / "pool1.yml")
+    template = TaskTemplate(
+        conf,
+        "someTaskId",
+        datetime.datetime.utcnow(),
+        conf.task_id,
+        conf.artifact_map("2000-01-01"),
+        {"EXTRA": "1"},
+    )
+    (id_a, task_a), (id_b, task_b) = (
+        template.stamp("idA", "a", ["someTaskId"]),
+        template.stamp("idB", "b", ["someTaskId", "other"]),
+    )
+    assert (id_a, id_b) == ("idA", "idB")
+    assert task_a["metadata"]["name"] == "a"
+    assert task_b["dependencies"] == ["someTaskId", "other"]
+    assert task_a["payload"]["env"]["EXTRA"] == "1"
+
+    # stamped tasks share nothing
+    task_a["payload"]["artifacts"]["project/fuzzing/private/logs"]["path"] = "/x"
+    task_a["scopes"].append("other")
+    assert task_b["payload"]["artifacts"]["project/fuzzing/private/logs"] == {
+        "expires": "2000-01-01",
+        "path": "/logs/",
+        "type": "directory",
+    }
+    assert task_b["scopes"] == ["scope1", "secrets:get:project/fuzzing/decision"]
+    assert template.stamp("idC", "c", [])[1]["scopes"] == task_b["scopes"]
+
+    with pytest.raises(AssertionError):
+        TaskTemplate(
+            conf,
+            "someTaskId",
+            datetime.datetime.utcnow(),
+            "w",
+            {},
+            {"TASKCLUSTER_SECRET": "other"},
+        )
+
+
+def test_task_fingerprint(tmp_path, mock_clouds, mock_machines):
+    data = {
+        "cloud": "gcp",
+        "scopes": ["docker-worker:capability:privileged", "scope1"],
+        "disk_size": "120g",
+        "cycle_time": "12h",
+        "max_run_time": "12h",
+        "schedule_start": None,
+        "cores_per_task": 2,
+        "metal": False,
+        "name": "Amazing fuzzing pool",
+        "tasks": 3,
+        "command": ["run-fuzzing.sh"],
+        "container": "MozillaSecurity/fuzzer:latest",
+        "minimum_memory_per_core": "1g",
+        "imageset": "docker-worker",
+        "parents": [],
+        "cpu": "x64",
+        "platform": "linux",
+        "preprocess": None,
+        "macros": {"A": "1"},
+    }
+
+    def _fingerprint(**changes):
+        return task_fingerprints(PoolConfiguration("test", {**data, **changes}))["test"]
+
+    fingerprint = _fingerprint()
+    assert len(fingerprint) == 64
+    # cosmetic changes keep the running tasks
+    assert _fingerprint(scopes=list(reversed(data["scopes"]))) == fingerprint
+    assert _fingerprint(tasks=10, cycle_time="1h", disk_size="60g") == fingerprint
+    changed = {
+        _fingerprint(container="MozillaSecurity/fuzzer:other"),
+        _fingerprint(command=["other.sh"]),
+        _fingerprint(macros={"A": "2"}),
+        _fingerprint(scopes=["scope1"]),
+        _fingerprint(max_run_time="1h"),
+    }
+    assert len(changed) == 5 and fingerprint not in changed
+
+    # each member of a map has its own
+    (tmp_path / "pool-a.yml").write_text(yaml.dump(data))
+    (tmp_path / "pool-b.yml").write_text(yaml.dump({**data, "macros": {"B": "1"}}))
+    (tmp_path / "pool-map.yml").write_text(
+        yaml.dump({"name": "map", "apply_to": ["pool-a", "pool-b"]})
+    )
+    fingerprints = task_fingerprints(PoolConfigMap.from_file(tmp_path / "pool-map.yml"))
+    assert sorted(fingerprints) == ["pool-a/pool-map", "pool-b/pool-map"]
+    (tmp_path / "pool-b.yml").write_text(yaml.dump({**data, "macros": {"B": "2"}}))
+    changed = task_fingerprints(PoolConfigMap.from_file(tmp_path / "pool-map.yml"))
+    assert changed["pool-a/pool-map"] == fingerprints["pool-a/pool-map"]
+    assert changed["pool-b/pool-map"] != fingerprints["pool-b/pool-map"]
+
+    # stored in the hook
+    conf = PoolConfiguration("test", data)
+    hook = conf.build_resources(mock_clouds, mock_machines)[1]
+    assert callbacks.hook_fingerprints(hook.task) == {"test": fingerprint}
+
+    # only triggered when updated with other tasks
+    trigger = callbacks.HookTrigger()
+    hooks = Mock()
+    hooks.hook.return_value = {"task": hook.task}
+    with patch.object(callbacks.taskcluster, "get_service", return_value=hooks):
+        asyncio.run(trigger.check("update", hook))
+        asyncio.run(trigger.trigger("update", hook))
+        hooks.triggerHook.assert_not_called()
+        # what was recorded is only used once, and a new run starts afresh
+        asyncio.run(trigger.trigger("update", hook))
+        hooks.triggerHook.assert_called_once()
+        asyncio.run(callbacks.HookTrigger().trigger("create", hook))
+        assert hooks.triggerHook.call_count == 2
+
+        hooks.hook.return_value = {"task": {**hook.task, "extra": {}}}
+        with patch.object(callbacks, "AppConfig") as appconfig:
+            appconfig.current.return_value.options.get.return_value = None
+            asyncio.run(trigger.check("update", hook))
+        asyncio.run(trigger.trigger("update", hook))
+        assert hooks.triggerHook.call_count == 3
+
+        # with --fuzzing-cancel-first, only the changed tasks are cancelled
+        with patch.object(callbacks, "AppConfig") as appconfig, patch.object(
+            callbacks, "cancel_tasks"
+        ) as cancel:
+            appconfig.current.return_value.options.get.return_value = "1"
+            asyncio.run(trigger.check("update", hook))
+        cancel.assert_called_once_with(hook.hookId, keep={fingerprint: []})
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        (None, False),
+        ("", False),
+        ("0", False),
+        ("false", False),
+        ("no", False),
+        ("1", True),
+        ("True", True),
+        (" yes ", True),
+    ],
+)
+def test_parse_flag(value, expected):
+    assert parse_flag(value) is expected
+
+
 @pytest.mark.parametrize("pool_path", POOL_FIXTURES.glob("pool*.yml"))
 def test_flatten(pool_path):
     class PoolConfigNoFlatten(CommonPoolConfiguration):
@@ -658,6 +1177,185 @@ def test_flatten(pool_path):
     assert pool.macros == expect.macros
 
 
+def test_flatten_diamond(pool_tree):
+    base = {"name": "base", "scopes": ["scope1"], "macros": {"A": "1"}}
+    tmp_path = pool_tree(
+        {
+            "left": {"name": "left", "parents": ["base"], "scopes": ["scope2"]},
+            "right": {"name": "right", "parents": ["base"], "macros": {"B": "2"}},
+            "child": {"name": "child", "parents": ["left", "right"]},
+            "cycle1": {"name": "cycle1", "parents": ["cycle2"]},
+            "cycle2": {"name": "cycle2", "parents": ["cycle1"]},
+        },
+        base,
+    )
+
+    pool = CommonPoolConfiguration.from_file(tmp_path / "child.yml")
+    assert set(pool.scopes) == {"scope1", "scope2"}
+    assert pool.macros == {"A": "1", "B": "2"}
+
+    # base is only read once, even though it is reached twice
+    with patch("yaml.safe_load", wraps=yaml.safe_load) as load:
+        pool = CommonPoolConfiguration.from_file(tmp_path / "child.yml")
+    assert load.call_count == 1
+    assert set(pool.scopes) == {"scope1", "scope2"}
+
+    # modified parents are reloaded
+    (tmp_path / "right.yml").write_text(
+        yaml.dump({"name": "right", "parents": ["base"], "macros": {"B": "changed"}})
+    )
+    pool = CommonPoolConfiguration.from_file(tmp_path / "child.yml")
+    assert pool.macros == {"A": "1", "B": "changed"}
+
+    # so are modified grandparents
+    pool_tree({}, dict(base, tasks=7))
+    pool = CommonPoolConfiguration.from_file(tmp_path / "child.yml")
+    assert pool.tasks == 7
+
+    # merged values aren't shared with the cached parents
+    artifact = {"type": "file", "url": "project/artifact"}
+    pool_tree({}, dict(base, artifacts={"/artifact": artifact}))
+    pool = CommonPoolConfiguration.from_file(tmp_path / "child.yml")
+    pool.artifacts["/artifact"]["url"] = "changed"
+    pool = CommonPoolConfiguration.from_file(tmp_path / "child.yml")
+    assert pool.artifacts == {"/artifact": artifact}
+
+    with pytest.raises(AssertionError, match="cyclic"):
+        CommonPoolConfiguration.from_file(tmp_path / "cycle1.yml")
+
+    # a cycle through a cached parent is still detected
+    (tmp_path / "cycle5.yml").write_text(
+        yaml.dump({"name": "cycle5", "parents": ["base"]})
+    )
+    (tmp_path / "cycle3.yml").write_text(
+        yaml.dump({"name": "cycle3", "parents": ["cycle5"]})
+    )
+    (tmp_path / "cycle4.yml").write_text(
+        yaml.dump({"name": "cycle4", "parents": ["cycle3"]})
+    )
+    (tmp_path / "cycle6.yml").write_text(
+        yaml.dump({"name": "cycle6", "parents": ["cycle4"]})
+    )
+    CommonPoolConfiguration.from_file(tmp_path / "cycle6.yml")
+    # same size and mtime, so only the cycle check can catch it
+    stat = (tmp_path / "cycle3.yml").stat()
+    (tmp_path / "cycle3.yml").write_text(
+        yaml.dump({"name": "cycle3", "parents": ["cycle4"]})
+    )
+    os.utime(tmp_path / "cycle3.yml", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert (tmp_path / "cycle3.yml").stat().st_size == stat.st_size
+    with pytest.raises(AssertionError, match="cyclic"):
+        CommonPoolConfiguration.from_file(tmp_path / "cycle3.yml")
+
+
+@pytest.mark.benchmark
+def test_build_tasks_benchmark(pool_tree, benchmark_results):
+    """Measure the tasks built per second by build_tasks(), for a pool and a map"""
+    pools = {f"pool{i}": {"name": f"{i}", "parents": ["base"]} for i in range(5)}
+    pools["map"] = {"name": "map", "apply_to": sorted(pools)}
+    tmp_path = pool_tree(
+        pools,
+        {
+            "tasks": 100,
+            "artifacts": {
+                f"/artifact{i}": {"type": "file", "url": f"project/artifact{i}"}
+                for i in range(5)
+            },
+        },
+    )
+    env = {"someKey": "someValue"}
+
+    for name in ("pool0", "map"):
+        pool = PoolConfigLoader.from_file(tmp_path / f"{name}.yml")
+        count, elapsed = 0, 0.0
+        while elapsed < 2:
+            start = time.perf_counter()
+            count += sum(1 for _ in pool.build_tasks("someTaskId", env=env))
+            elapsed += time.perf_counter() - start
+        benchmark_results.append(f"{name}: {count / elapsed:.0f} tasks/s")
+
+
+def test_config_errors(pool_tree):
+    tmp_path = pool_tree(
+        {
+            "small": {"name": "small", "parents": ["base"], "cores_per_task": 2},
+            "incomplete": {"name": "incomplete", "cloud": "aws"},
+            "pre": {"name": "pre", "tasks": 2, "cloud": "gcp", "metal": True},
+            "with-pre": {"name": "with-pre", "parents": ["base"], "preprocess": "pre"},
+            "map": {"name": "map", "apply_to": ["base", "small"]},
+        }
+    )
+
+    with pytest.raises(PoolConfigError) as exc:
+        CommonPoolConfiguration.from_file(tmp_path / "incomplete.yml")
+    assert exc.value.source == str(tmp_path / "incomplete.yml")
+    assert ("cycle_time", "Pool is missing field: cycle_time") in exc.value.errors
+
+    pool = CommonPoolConfiguration.from_file(tmp_path / "with-pre.yml")
+    with pytest.raises(PoolConfigError) as exc:
+        pool.create_preprocess()
+    assert exc.value.source == str(tmp_path / "pre.yml")
+    assert exc.value.errors == [("tasks", "pre must set tasks = 1")]
+    (tmp_path / "pre.yml").write_text(
+        yaml.dump({"name": "pre", "tasks": 1, "cloud": "gcp", "metal": True})
+    )
+    with pytest.raises(PoolConfigError) as exc:
+        pool.create_preprocess()
+    assert exc.value.errors == [
+        ("cloud", "pre cannot set cloud"),
+        ("metal", "pre cannot set metal"),
+    ]
+
+    with pytest.raises(PoolConfigError) as exc:
+        CommonPoolConfigMap.from_file(tmp_path / "map.yml")
+    assert exc.value.source == str(tmp_path / "map.yml")
+    assert exc.value.errors == [
+        ("cores_per_task", "cores_per_task has multiple values")
+    ]
+
+
+def test_resources_deterministic(pool_tree):
+    pools = {
+        name: {
+            "name": name,
+            "parents": ["base"],
+            "scopes": [f"{name}{i}" for i in range(8)],
+        }
+        for name in ("left", "right")
+    }
+    pools["map"] = {"name": "map", "apply_to": ["left", "right"]}
+    tmp_path = pool_tree(
+        pools,
+        {"name": "base", "cores_per_task": 2, "scopes": [f"base{i}" for i in range(8)]},
+    )
+
+    script = f"""
+import json, pathlib
+from fuzzing_tc.common.pool import MachineTypes
+from fuzzing_tc.decision.pool import PoolConfigLoader
+from fuzzing_tc.decision.providers import AWS
+fixtures = pathlib.Path({str(POOL_FIXTURES.parent)!r})
+clouds = {{"aws": AWS(fixtures / "community")}}
+machines = MachineTypes.from_file(fixtures / "machines.yml")
+for name in ("left", "right", "map"):
+    pool = PoolConfigLoader.from_file(pathlib.Path({str(tmp_path)!r}) / f"{{name}}.yml")
+    for resource in pool.build_resources(clouds, machines):
+        print(json.dumps(resource.to_json(), sort_keys=True))
+    for _, task in pool.build_tasks("someTaskId"):
+        print(json.dumps(task["scopes"]))
+"""
+    outputs = {
+        subprocess.run(
+            [sys.executable, "-c", script],
+            check=True,
+            stdout=subprocess.PIPE,
+            env={**os.environ, "PYTHONHASHSEED": str(seed)},
+        ).stdout
+        for seed in (1, 2, 3)
+    }
+    assert len(outputs) == 1
+
+
 def test_pool_map():
     class PoolConfigNoFlatten(CommonPoolConfiguration):
         def _flatten(self, _):
@@ -687,6 +1385,9 @@ def test_pool_map():
 
     pools = list(cfg_map.iterpools())
     assert len(pools) == 1
+    # member pools are only resolved once
+    assert cfg_map.pools == tuple(pools)
+    assert cfg_map.pools[0] is pools[0]
     pool = pools[0]
     assert pool.cloud == expect.cloud
     assert set(pool.scopes) == set(expect.scopes)
@@ -709,6 +1410,22 @@ def test_pool_map():
     assert pool.macros == expect.macros
 
 
+def test_pool_map_lazy():
+    cfg_map = CommonPoolConfigMap.from_file(POOL_FIXTURES / "map1.yml", lazy=True)
+    with patch.object(cfg_map, "apply", wraps=cfg_map.apply) as apply:
+        pool = cfg_map.apply("pool1")
+        apply.assert_called_once_with("pool1")
+        assert pool.pool_id == "pool1/map1"
+        assert pool.name == "parent (mixed)"
+
+        # resolving the whole map happens on first use
+        apply.reset_mock()
+        assert len(cfg_map.pools) == 1
+        assert len(cfg_map.pools) == 1
+        apply.assert_called_once_with("pool1")
+    assert cfg_map.cloud == "aws"
+
+
 @pytest.mark.parametrize(
     "loader, config_cls, map_cls",
     [
@@ -723,6 +1440,192 @@ def test_pool_loader(loader, config_cls, map_cls):
     assert isinstance(obj, map_cls)
 
 
+def test_pool_repository():
+    with patch("yaml.safe_load", wraps=yaml.safe_load) as load:
+        repository = PoolRepository(POOL_FIXTURES, PoolConfigLoader)
+    # the pools and their references are read exactly once, other files never
+    assert load.call_count == len(repository.edges)
+    assert "load-map" not in repository.edges
+    assert sorted(repository.pools) == sorted(
+        path.stem for path in POOL_FIXTURES.glob("pool*.yml")
+    )
+    assert repository.edges["pool5"] == {
+        "parents": ["pool3", "pool4"],
+        "apply_to": [],
+        "preprocess": [],
+    }
+
+    for pool_id, pool in repository.pools.items():
+        assert isinstance(pool, PoolConfiguration)
+        assert repository[pool_id] is pool
+        expect = PoolConfigLoader.from_file(POOL_FIXTURES / f"{pool_id}.yml")
+        for field in pool.FIELD_TYPES:
+            if field == "scopes":
+                assert set(pool.scopes) == set(expect.scopes)
+            else:
+                assert getattr(pool, field) == getattr(expect, field), field
+
+
+def test_resolved_pool(pool_tree):
+    pools = {f"pool-{name}": {"name": name, "parents": ["base"]} for name in "ab"}
+    pools["pool-map"] = {"name": "map", "apply_to": ["pool-a"]}
+    repository = PoolRepository(pool_tree(pools))
+    resolved = repository.resolved()
+    assert sorted(resolved) == ["pool-a", "pool-b", "pool-map"]
+    assert [pool.pool_id for pool in resolved["pool-map"]] == [
+        "pool-map",
+        "pool-a/pool-map",
+    ]
+
+    (pool_a,), (pool_b,) = resolved["pool-a"], resolved["pool-b"]
+    assert pool_a.macros == repository["pool-a"].macros
+    assert pool_a.scopes == tuple(repository["pool-a"].scopes)
+    # inherited values are only stored once
+    assert pool_a.scopes is pool_b.scopes
+    assert pool_a.macros is pool_b.macros
+    assert pool_a.artifacts is pool_b.artifacts
+    assert not hasattr(pool_a, "__dict__")
+    with pytest.raises(AttributeError):
+        pool_a.tasks = 1
+
+    assert pool_a != pool_b
+    assert pool_a == repository["pool-a"].freeze()
+    assert len({pool_a, pool_b, repository["pool-a"].freeze()}) == 2
+    assert copy.deepcopy(pool_a) == pool_a
+
+    # values of different types are never shared, nor equal
+    interned = {}
+    assert freeze({"A": ("x", True)}, interned) == {"A": ("x", True)}
+    assert type(freeze({"A": ("x", 1)}, interned)["A"][1]) is int
+    assert type(freeze([1.0], interned)[0]) is float
+    assert type(freeze([1], interned)[0]) is int
+    fields = dict(zip(ResolvedPool.FIELDS, pool_a._values()))
+    fields["macros"] = {key: 1 for key in pool_a.macros}
+    other = ResolvedPool(**fields)
+    fields["macros"] = {key: True for key in pool_a.macros}
+    assert ResolvedPool(**fields) != other
+
+
+def test_pool_repository_errors(pool_tree):
+    tmp_path = pool_tree(
+        {
+            "pool-ok": {"name": "ok", "parents": ["base"]},
+            "pool-cycle1": {"name": "cycle1", "parents": ["base", "pool-cycle2"]},
+            "pool-cycle2": {"name": "cycle2", "parents": ["pool-cycle1"]},
+            "pool-orphan": {"name": "orphan", "parents": ["missing1"]},
+            "pool-child": {"name": "child", "parents": ["pool-orphan"]},
+            "pool-map": {"name": "map", "apply_to": ["pool-ok", "missing2"]},
+            "pool-bad": {"name": "bad", "parents": ["base"], "tasks": "many"},
+            "pool-pre": {"name": "pre", "parents": ["base"], "preprocess": "missing3"},
+            # YAML files which aren't pools, nor referenced by one, are ignored
+            "unused": {"name": "unused", "tasks": "x"},
+        }
+    )
+    (tmp_path / "broken.yml").write_text("key: [")
+
+    with pytest.raises(RuntimeError) as exc:
+        PoolRepository(tmp_path)
+    assert str(exc.value).splitlines() == [
+        "5 error(s) in pool configuration:",
+        "pool-map: apply_to 'missing2' does not exist",
+        "pool-orphan: parents 'missing1' does not exist",
+        "pool-pre: preprocess 'missing3' does not exist",
+        "cyclic configuration: pool-cycle1 -> pool-cycle2 -> pool-cycle1",
+        "pool-bad: expected 'tasks' to be 'int', got 'str'",
+    ]
+
+
+def test_pool_bundle(tmp_path):
+    for src, dst in (
+        ("pool1.yml", "pool1.yml"),
+        ("pool2.yml", "pool2.yml"),
+        ("pre-pool.yml", "pool-pre.yml"),
+        ("pre.yml", "pre.yml"),
+        ("expect1.yml", "expect1.yml"),
+    ):
+        (tmp_path / dst).write_text((POOL_FIXTURES / src).read_text())
+    (tmp_path / "pool-map.yml").write_text(
+        yaml.dump({"name": "mixed", "apply_to": ["pool1"]})
+    )
+
+    with patch("fuzzing_tc.common.pool.package_version", return_value="1.0"):
+        bundle = json.loads(json.dumps(PoolConfigLoader.compile(tmp_path, "abc")))
+    assert bundle["revision"] == "abc"
+    assert bundle["version"] == "1.0"
+    assert set(bundle["pools"]) == {
+        "pool1",
+        "pool2",
+        "pool-pre",
+        "pool-pre/preprocess",
+        "pool-map",
+        "pool1/pool-map",
+    }
+
+    def _fields(pool):
+        return {field: getattr(pool, field) for field in pool.FIELD_TYPES}
+
+    with patch("yaml.safe_load") as load:
+        bundled = {
+            pool_id: PoolConfigLoader.from_bundle(bundle, pool_id, tmp_path)
+            for pool_id in ("pool2", "pool-pre", "pool-map", "pool1/pool-map")
+        }
+        pre = bundled["pool-pre"].create_preprocess()
+        members = bundled["pool-map"].pools
+    load.assert_not_called()
+    assert isinstance(bundled["pool2"], PoolConfiguration)
+    assert isinstance(bundled["pool-map"], PoolConfigMap)
+    assert _fields(bundled["pool2"]) == _fields(
+        PoolConfigLoader.from_file(tmp_path / "pool2.yml")
+    )
+    expect_pre = PoolConfigLoader.from_file(tmp_path / "pool-pre.yml")
+    assert _fields(pre) == _fields(expect_pre.create_preprocess())
+    assert pre.pool_id == "pool-pre/preprocess"
+    expect_map = PoolConfigLoader.from_file(tmp_path / "pool-map.yml")
+    assert _fields(bundled["pool-map"]) == _fields(expect_map)
+    assert _fields(bundled["pool1/pool-map"]) == _fields(expect_map.pools[0])
+    assert [_fields(pool) for pool in members] == [_fields(expect_map.pools[0])]
+
+    # bundles are only used for the revision and version they were compiled for
+    bundle_json = tmp_path / "bundle.json"
+    bundle_json.write_text(json.dumps(bundle))
+    with patch("fuzzing_tc.common.pool.package_version", return_value="1.0"):
+        assert PoolConfigLoader.load_bundle(bundle_json, "abc") == bundle
+        assert PoolConfigLoader.load_bundle(bundle_json, "def") is None
+        assert PoolConfigLoader.load_bundle(bundle_json, None) is None
+        assert PoolConfigLoader.load_bundle(tmp_path / "missing.json", "abc") is None
+    with patch("fuzzing_tc.common.pool.package_version", return_value="2.0"):
+        assert PoolConfigLoader.load_bundle(bundle_json, "abc") is None
+
+
+def _expand_crons(crons):
+    """Expand cron patterns to the set of (second, minute, hour, day, month) matched"""
+    bounds = ((0, 59), (0, 59), (0, 23), (1, 31), (1, 12))
+
+    def _values(field, low, high):
+        result = set()
+        for part in field.split(","):
+            part, _, step = part.partition("/")
+            if part == "*":
+                first, last = low, high
+            else:
+                first, _, last = part.partition("-")
+                first = int(first)
+                last = int(last or first)
+            result.update(range(first, last + 1, int(step or 1)))
+        return result
+
+    result = set()
+    for cron in crons:
+        fields = cron.split()
+        assert fields[5] == "*"
+        result.update(
+            itertools.product(
+                *(_values(f, low, high) for f, (low, high) in zip(fields, bounds))
+            )
+        )
+    return result
+
+
 def test_cycle_crons():
     conf = CommonPoolConfiguration(
         "test",
@@ -750,12 +1653,7 @@ def test_cycle_crons():
     )
 
     # cycle time 6h
-    assert list(conf.cycle_crons()) == [
-        "0 0 6 * * *",
-        "0 0 12 * * *",
-        "0 0 18 * * *",
-        "0 0 0 * * *",
-    ]
+    assert list(conf.cycle_crons()) == ["0 0 */6 * * *"]
 
     # cycle time 3.5 days
     conf.cycle_time = 3600 * 24 * 3.5
@@ -764,45 +1662,149 @@ def test_cycle_crons():
         "0 0 0 * * 4",
     ]
 
-    # cycle time 17h
-    conf.cycle_time = 3600 * 17
-    crons = list(conf.cycle_crons())
-    assert len(crons) == (365 * 24 // 17) + 1
-    assert crons[:4] == ["0 0 17 1 1 *", "0 0 10 2 1 *", "0 0 3 3 1 *", "0 0 20 3 1 *"]
-
-    # cycle time 48h
-    conf.cycle_time = 3600 * 48
-    crons = list(conf.cycle_crons())
-    assert len(crons) == (365 * 24 // 48) + 1
-    assert crons[:4] == ["0 0 0 3 1 *", "0 0 0 5 1 *", "0 0 0 7 1 *", "0 0 0 9 1 *"]
-
-    # cycle time 72h
-    conf.cycle_time = 3600 * 72
-    crons = list(conf.cycle_crons())
-    assert len(crons) == (365 * 24 // 72) + 1
-    assert crons[:4] == ["0 0 0 4 1 *", "0 0 0 7 1 *", "0 0 0 10 1 *", "0 0 0 13 1 *"]
-
-    # cycle time 17d
-    conf.cycle_time = 3600 * 24 * 17
-    crons = list(conf.cycle_crons())
-    assert len(crons) == (365 // 17) + 1
-    assert crons[:4] == ["0 0 0 18 1 *", "0 0 0 4 2 *", "0 0 0 21 2 *", "0 0 0 10 3 *"]
-
-    # using schedule_start should be the same as using datetime.now()
+    # cycle times which need an annual schedule
+    start = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+    for hours, max_crons in ((5, 31), (17, 120), (48, 5), (72, 6), (24 * 17, 7)):
+        conf.cycle_time = 3600 * hours
+        crons = list(conf.cycle_crons())
+        assert len(crons) <= max_crons
+        expect = set()
+        when = start
+        while when < start + datetime.timedelta(days=365):
+            when += datetime.timedelta(hours=hours)
+            expect.add((when.second, when.minute, when.hour, when.day, when.month))
+        assert _expand_crons(crons) == expect
+
+    # without schedule_start, the phase is stable and derived from the pool id
     conf.schedule_start = None
     conf.cycle_time = 3600 * 12
-    start = datetime.datetime.now(datetime.timezone.utc)
     calc_none = list(conf.cycle_crons())
-    fin = datetime.datetime.now(datetime.timezone.utc)
-    for offset in range(int((fin - start).total_seconds()) + 1):
-        conf.schedule_start = start + datetime.timedelta(seconds=offset)
-        if calc_none == list(conf.cycle_crons()):
-            break
-    else:
-        assert calc_none == list(conf.cycle_crons())
+    assert calc_none == list(conf.cycle_crons())
+    conf.schedule_start = conf.schedule_phase()
+    assert calc_none == list(conf.cycle_crons())
+    assert conf.schedule_start - datetime.datetime(
+        1970, 1, 1, tzinfo=datetime.timezone.utc
+    ) < datetime.timedelta(hours=12)
+    conf.schedule_start = None
+    conf.pool_id = "other"
+    assert list(conf.cycle_crons()) != calc_none
+
+
+def test_stagger(pool_tree, capsys):
+    pools = {
+        f"pool-{name}": {
+            "name": name,
+            "parents": ["base"],
+            "schedule_start": "1970-01-01T00:00:00Z",
+        }
+        for name in "abc"
+    }
+    pools["pool-d"] = {
+        "name": "d",
+        "parents": ["base"],
+        "cycle_time": "2h",
+        "max_run_time": "30m",
+    }
+    pools["pool-map"] = {"name": "map", "apply_to": ["pool-d"]}
+    tmp_path = pool_tree(pools)
+    repository = PoolRepository(tmp_path)
+
+    stagger = Stagger.from_pools(repository.pools)
+    assert stagger.pools["pool-a"] == PoolDemand(3600, 3600, 4, 30, 0, True)
+    assert stagger.pools["pool-map"] == PoolDemand(
+        7200, 1800, 4, 30, stagger.pools["pool-map"].phase, False
+    )
+    before = stagger.report(stagger.current())
+    assert before["hooks"] >= 3
+    assert before["tasks"] >= 12
+
+    # fixed pools keep their schedule
+    after = stagger.optimize()
+    assert [after[pool_id] for pool_id in ("pool-a", "pool-b", "pool-c")] == [0] * 3
+    assert after["pool-d"] % 3600 != 0
+    assert after["pool-map"] % 3600 not in {0, after["pool-d"] % 3600}
+
+    # every pool gets its own slot, and the short runs don't overlap
+    stagger = Stagger.from_pools(repository.pools, reassign=True)
+    after = stagger.optimize()
+    assert after["pool-a"] == 0
+    assert len({phase % 3600 for phase in after.values()}) == 5
+    assert all(phase % 300 == 0 for phase in after.values())
+    assert stagger.report(after) == {"hooks": 1, "tasks": 4, "cores": 120}
+
+    output = tmp_path / "offsets.yml"
+    stagger_main([str(tmp_path), "--reassign", "--resolution", "1m", "-o", str(output)])
+    offsets = yaml.safe_load(output.read_text())
+    assert sorted(offsets) == sorted(repository.pools)
+    assert offsets["pool-a"] == "1970-01-01T00:00:00+00:00"
+    report = capsys.readouterr().out.splitlines()
+    assert report[0].split() == ["peak", "in", "60s", "before", "after"]
+    assert report[2].split() == ["tasks", "12", "4"]
 
 
 def test_required():
     CommonPoolConfiguration("test", {"name": "test pool"}, _flattened={})
     with pytest.raises(AssertionError):
         CommonPoolConfiguration("test", {}, _flattened={})
+
+
+def test_validator_errors(tmp_path):
+    data = {
+        "name": "test pool",
+        "tasks": "many",
+        "cloud": "azure",
+        "cycle_time": "1x",
+        "container": {"type": "docker-image", "name": "img", "path": "x"},
+        "artifacts": {"a": {"url": "u", "type": "link"}},
+        "macros": {"A": []},
+        "extra": 1,
+    }
+    with pytest.raises(PoolConfigError) as exc:
+        CommonPoolConfiguration("test", data, base_dir=tmp_path, _flattened={})
+    assert exc.value.errors == [
+        ("", "configuration has extra fields: ['extra']"),
+        (
+            "artifacts.a.type",
+            "expected artifact 'a' .type to be one of: file, directory",
+        ),
+        ("cloud", "Invalid cloud - use aws,gcp"),
+        (
+            "container",
+            "unknown keys for 'container' with type 'docker-image': path",
+        ),
+        (
+            "cycle_time",
+            "invalid 'cycle_time': trailing data",
+        ),
+        ("macros.A", "expected macro 'A' value to be 'int' or 'str', got 'list'"),
+        ("tasks", "expected 'tasks' to be 'int', got 'str'"),
+    ]
+    assert str(exc.value).splitlines()[0] == (
+        f"{tmp_path / 'test.yml'}: configuration has extra fields: ['extra']"
+    )
+
+
+def test_validator_cache():
+    validator = PoolValidator({"name": str, "tasks": int}, {"name"})
+    error = ("tasks", "expected 'tasks' to be 'int', got 'str'")
+    assert validator.errors({"name": "a", "tasks": "1"}) == [error]
+    # the same content is not checked again
+    with patch.object(validator, "_checks", []):
+        assert validator.errors({"tasks": "1", "name": "a"}) == [error]
+        assert validator.errors({"name": "a", "tasks": "2"}) == []
+    assert validator.errors({"name": "a", "tasks": 1}) == []
+    # values of different types don't share results
+    assert validator.errors({"name": "a", "tasks": 1.0}) == [
+        ("tasks", "expected 'tasks' to be 'int', got 'float'")
+    ]
+    validator = PoolValidator({"command": list, "name": str}, {"name"})
+    assert validator.errors({"name": "a", "command": ["a"]}) == []
+    assert validator.errors({"name": "a", "command": ("a",)}) == [
+        ("command", "expected 'command' to be 'list', got 'tuple'")
+    ]
+    validator = PoolValidator({"command": list, "name": str}, {"name"})
+    assert validator.errors({"name": "a", "command": ("a",)})
+    assert validator.errors({"name": "a", "command": ["a"]}) == []
+    assert validator.errors({"name": None}) == [
+        ("name", "name is required for every configuration")
+    ]
@@ -1,13 +1,27 @@
 # -*- coding: utf-8 -*-
 
+import json
+import logging
 import pathlib
 import re
+import shutil
+import subprocess
+from unittest.mock import patch
 
 import pytest
 import yaml
+from taskcluster.exceptions import TaskclusterRestFailure
+from tcadmin.resources import Resources
 
+from fuzzing_tc.common.pool import PoolConfigLoader
+from fuzzing_tc.common.pool import parse_time
+from fuzzing_tc.decision.pool import PoolConfigMap
+from fuzzing_tc.decision.pool import PoolConfiguration
+from fuzzing_tc.decision.pool import task_fingerprints
 from fuzzing_tc.decision.workflow import Workflow
 
+FIXTURES_DIR = pathlib.Path(__file__).parent / "fixtures"
+
 YAML_CONF = """---
 fuzzing_config:
   path: /path/to/secret_conf
@@ -102,3 +116,333 @@ def test_configure_secret(mock_taskcluster_workflow):
         "fuzzing_config": {"revision": "deadbeef", "url": "git@server:repo.git"},
         "private_key": "ssh super secret",
     }
+
+
+def _git(path, *args):
+    subprocess.check_output(
+        ["git", "-c", "user.name=test", "-c", "user.email=test@test", *args],
+        cwd=str(path),
+    )
+
+
+def _commit(path):
+    _git(path, "add", "-A")
+    _git(path, "commit", "-q", "-m", "update")
+
+
+def _generate_setup(tmp_path):
+    """Create fuzzing & community git checkouts with 3 pools"""
+    fuzzing = tmp_path / "fuzzing"
+    fuzzing.mkdir()
+    (fuzzing / "machines.yml").write_text((FIXTURES_DIR / "machines.yml").read_text())
+    pool_a = yaml.safe_load((FIXTURES_DIR / "pools" / "pool1.yml").read_text())
+    pool_a.update({"name": "A", "cores_per_task": 2, "schedule_start": "1970-01-01"})
+    (fuzzing / "pool-a.yml").write_text(yaml.dump(pool_a))
+    (fuzzing / "pool-b.yml").write_text(yaml.dump({"name": "B", "parents": ["pool-a"]}))
+    pool_c = dict(pool_a, name="C", cloud="gcp", cpu="x64", imageset="docker-worker")
+    pool_c["cores_per_task"] = 1
+    (fuzzing / "pool-c.yml").write_text(yaml.dump(pool_c))
+    community = tmp_path / "community"
+    shutil.copytree(str(FIXTURES_DIR / "community"), str(community))
+    (community / "config" / "projects").mkdir()
+    (community / "config" / "projects" / "fuzzing.yml").write_text(
+        yaml.dump({"fuzzing": {}})
+    )
+    for repo in (fuzzing, community):
+        _git(repo, "init", "-q")
+        _commit(repo)
+
+    workflow = Workflow()
+    workflow.fuzzing_config_dir = fuzzing
+    workflow.community_config_dir = community
+    return workflow, pool_a
+
+
+def test_generate_incremental(tmp_path):
+    workflow, pool_a = _generate_setup(tmp_path)
+    fuzzing = workflow.fuzzing_config_dir
+    community = workflow.community_config_dir
+    config = {"fuzzing_config": {"path": str(fuzzing)}}
+    cache = tmp_path / "cache.json"
+
+    def _generate():
+        resources = Resources()
+        with patch.object(
+            PoolConfiguration,
+            "build_resources",
+            autospec=True,
+            side_effect=PoolConfiguration.build_resources,
+        ) as build:
+            workflow.generate(resources, config, resource_cache=cache)
+        return resources, {call[0][0].pool_id for call in build.call_args_list}
+
+    full, built = _generate()
+    assert built == {"pool-a", "pool-b", "pool-c"}
+    assert cache.is_file()
+
+    # nothing changed: everything comes from the cache, without parsing the pools
+    with patch("fuzzing_tc.decision.workflow.PoolRepository") as repository:
+        cached, built = _generate()
+    repository.assert_not_called()
+    assert built == set()
+    assert cached.to_json() == full.to_json()
+
+    # uncommitted changes are compared with the cached run
+    (fuzzing / "pool-d.yml").write_text(yaml.dump(dict(pool_a, name="D")))
+    _, built = _generate()
+    assert built == {"pool-d"}
+    (fuzzing / "pool-d.yml").unlink()
+    resources, built = _generate()
+    assert built == set()
+    assert resources.to_json() == full.to_json()
+
+    # a changed pool invalidates its children
+    pool_a["tasks"] = 5
+    (fuzzing / "pool-a.yml").write_text(yaml.dump(pool_a))
+    _commit(fuzzing)
+    resources, built = _generate()
+    assert built == {"pool-a", "pool-b"}
+    assert resources.to_json() != full.to_json()
+
+    # edits which don't change the resolved configurations invalidate nothing
+    (fuzzing / "pool-a.yml").write_text("# comment\n" + yaml.dump(pool_a))
+    _commit(fuzzing)
+    _, built = _generate()
+    assert built == set()
+
+    # community changes invalidate pools using the changed cloud or imageset
+    (community / "config" / "gcp.yml").write_text("regions: {us-west2: {zones: [a]}}")
+    _commit(community)
+    _, built = _generate()
+    assert built == {"pool-c"}
+    imagesets = yaml.safe_load((community / "config" / "imagesets.yml").read_text())
+    imagesets["generic-worker-A"]["aws"]["amis"]["us-west-1"] = "ami-5678"
+    (community / "config" / "imagesets.yml").write_text(yaml.dump(imagesets))
+    _commit(community)
+    _, built = _generate()
+    assert built == {"pool-a", "pool-b"}
+
+    # machines.yml is used by every pool
+    (fuzzing / "machines.yml").write_text(
+        (FIXTURES_DIR / "machines.yml").read_text() + "\n"
+    )
+    _commit(fuzzing)
+    _, built = _generate()
+    assert built == {"pool-a", "pool-b", "pool-c"}
+
+
+def test_git_clone_cached(tmp_path, caplog):
+    source = tmp_path / "source"
+    source.mkdir()
+    _git(source, "init", "-q")
+    _git(source, "config", "uploadpack.allowAnySHA1InWant", "true")
+    revisions = []
+    for content in ("first", "second"):
+        (source / "pool.yml").write_text(content)
+        _commit(source)
+        revisions.append(Workflow.git_revision(source))
+    url = source.as_uri()
+
+    conf = tmp_path / "config.yml"
+    conf.write_text(YAML_CONF)
+    workflow = Workflow()
+    workflow.configure(local_path=conf, git_cache_dir=tmp_path / "cache")
+    assert workflow.git_cache_dir == tmp_path / "cache"
+
+    def _clone(revision, fetched):
+        caplog.clear()
+        with caplog.at_level(logging.INFO):
+            path = workflow.git_clone(url=url, revision=revision)
+        try:
+            assert ("Fetching" in caplog.text) == fetched
+            assert "cloning" not in caplog.text
+            assert Workflow.git_clean(path)
+            return Workflow.git_revision(path), (path / "pool.yml").read_text()
+        finally:
+            shutil.rmtree(str(path))
+
+    assert _clone(revisions[0], True) == (revisions[0], "first")
+    assert _clone(None, True) == (revisions[1], "second")
+    # commits already in the mirror aren't fetched again
+    assert _clone(revisions[0], False) == (revisions[0], "first")
+    assert len(list((tmp_path / "cache").glob("*.git"))) == 1
+
+    # falls back to a full clone if the mirror can't be used
+    workflow.git_cache_dir = tmp_path / "config.yml"
+    caplog.clear()
+    path = workflow.git_clone(url=url, revision=revisions[0])
+    assert "cloning" in caplog.text
+    assert Workflow.git_revision(path) == revisions[0]
+    shutil.rmtree(str(path))
+
+
+def test_generate_parallel(tmp_path):
+    workflow, _ = _generate_setup(tmp_path)
+    config = {"fuzzing_config": {"path": str(workflow.fuzzing_config_dir)}}
+
+    serial = Resources()
+    workflow.generate(serial, config)
+    parallel = Resources()
+    workflow.generate(parallel, config, jobs=2)
+    assert len(parallel.resources) == 9
+    assert parallel.to_json() == serial.to_json()
+
+
+def test_build_tasks_unchanged_members(tmp_path):
+    workflow, _ = _generate_setup(tmp_path)
+    fuzzing = workflow.fuzzing_config_dir
+    (fuzzing / "pool-map.yml").write_text(
+        yaml.dump({"name": "map", "apply_to": ["pool-a", "pool-b"]})
+    )
+    fingerprints = task_fingerprints(PoolConfigMap.from_file(fuzzing / "pool-map.yml"))
+
+    def _previous(worker_type, max_run_time, concurrency, keep):
+        # pool-a is still running with the same definition
+        keep[fingerprints["pool-a/pool-map"]].append("old-a")
+        return {"old-b": "running"}
+
+    with patch(
+        "fuzzing_tc.decision.workflow.previous_tasks", side_effect=_previous
+    ), patch.object(Workflow, "create_tasks") as create, patch(
+        "fuzzing_tc.decision.workflow.replace_tasks"
+    ) as replace:
+        workflow.build_tasks("pool-map", "someTaskId", {"fuzzing_config": {}})
+
+    tasks = create.call_args[0][0]
+    assert {
+        task["payload"]["env"]["TASKCLUSTER_FUZZING_POOL"] for _, task in tasks
+    } == {"pool-b/pool-map"}
+    max_capacity = PoolConfigMap.from_file(fuzzing / "pool-map.yml").max_capacity()
+    replace.assert_called_once_with(
+        {"old-b": "running"}, [task_id for task_id, _ in tasks], max_capacity - 1, 1
+    )
+
+
+def test_pool_bundle_env(tmp_path):
+    workflow, _ = _generate_setup(tmp_path)
+    fuzzing = workflow.fuzzing_config_dir
+    config = {"fuzzing_config": {"path": str(fuzzing)}}
+    bundle_json = tmp_path / "pools.json"
+
+    # decision tasks are given the bundle path configured in tc-admin
+    resources = Resources()
+    workflow.generate(resources, config, pool_bundle=bundle_json)
+    hooks = [res for res in resources.resources if res.kind == "Hook"]
+    assert hooks
+    for hook in hooks:
+        env = hook.task["payload"]["env"]
+        assert env["FUZZING_POOL_BUNDLE"] == str(bundle_json)
+
+    def _task_env(pool_bundle):
+        with patch(
+            "fuzzing_tc.decision.workflow.previous_tasks", return_value={}
+        ), patch.object(Workflow, "create_tasks") as create:
+            workflow.build_tasks(
+                "pool-b", "someTaskId", config, pool_bundle=pool_bundle
+            )
+        return [task["payload"]["env"] for _, task in create.call_args[0][0]]
+
+    # the path is only passed on to fuzzing tasks when the bundle can be used
+    assert all("FUZZING_POOL_BUNDLE" not in env for env in _task_env(bundle_json))
+    bundle = PoolConfigLoader.compile(fuzzing, workflow.git_revision(fuzzing))
+    bundle_json.write_text(json.dumps(bundle))
+    assert all(
+        env["FUZZING_POOL_BUNDLE"] == str(bundle_json) for env in _task_env(bundle_json)
+    )
+
+
+def test_cost_report(tmp_path):
+    workflow, _ = _generate_setup(tmp_path)
+    machines = yaml.safe_load(
+        (workflow.fuzzing_config_dir / "machines.yml").read_text()
+    )
+    machines["aws"]["arm64"]["a2"]["price"] = {"us-west-1": 0.5}
+    (workflow.fuzzing_config_dir / "machines.yml").write_text(yaml.dump(machines))
+
+    assert workflow.cost_report() == [
+        ("pool-a", 7, 0.5, 3.5),
+        ("pool-b", 7, 0.5, 3.5),
+        ("pool-c", 7, None, None),
+    ]
+
+
+def test_simulation_report(tmp_path):
+    workflow, _ = _generate_setup(tmp_path)
+    week = parse_time("7d")
+    results = {result.pool_id: result for result in workflow.simulation_report(week)}
+    assert sorted(results) == ["pool-a", "pool-b", "pool-c"]
+
+    # every hour, 3 tasks run for 1h after a 2m decision task, using 2 cores each
+    pool_a = results["pool-a"]
+    assert pool_a.max_capacity == 7
+    assert pool_a.busy_core_hours == pytest.approx(168 * 2 * (3 + 120 / 3600), rel=1e-3)
+    # the new tasks are created as the decision task starts, while the previous ones
+    # are still running
+    assert pool_a.peak_capacity == 7
+    assert pool_a.peak_workers == pool_a.peak_capacity
+    assert 3 < pool_a.mean_capacity < pool_a.peak_capacity
+    assert pool_a.idle_core_hours > 0
+
+    # recorded durations are used, up to max_run_time
+    samples = {"duration": ["30m"], "pools": {"pool-b": {"duration": [7200]}}}
+    recorded = {
+        result.pool_id: result for result in workflow.simulation_report(week, samples)
+    }
+    assert recorded["pool-a"].busy_core_hours == pytest.approx(
+        168 * 2 * (1.5 + 120 / 3600), rel=1e-3
+    )
+    assert recorded["pool-a"].peak_capacity < pool_a.peak_capacity
+    assert recorded["pool-b"] == results["pool-b"]
+
+    # cancelling the previous tasks when the hook fires
+    cancelled = workflow.simulation_report(week, cancel=True)[0]
+    assert cancelled.busy_core_hours < pool_a.busy_core_hours
+
+
+def test_create_tasks():
+    tasks = [("pre", {"dependencies": ["decision"], "metadata": {"name": "pre"}})]
+    tasks.extend(
+        (f"task{i}", {"dependencies": ["decision", "pre"], "metadata": {"name": i}})
+        for i in range(5)
+    )
+    created = []
+    errors = {}
+
+    def _create_task(task_id, task):
+        error = errors.get(task_id, [])
+        if error:
+            raise error.pop(0)
+        created.append(task_id)
+
+    with patch("fuzzing_tc.decision.pool.taskcluster.get_service") as service:
+        service.return_value.createTask.side_effect = _create_task
+
+        # the preprocess task is created first
+        Workflow.create_tasks(tasks, concurrency=4)
+        assert created[0] == "pre"
+        assert sorted(created) == sorted(task_id for task_id, _ in tasks)
+
+        # transient errors are retried
+        created.clear()
+        errors["task1"] = [TaskclusterRestFailure("down", None, status_code=503)]
+        Workflow.create_tasks(tasks, concurrency=4, backoff=0)
+        assert sorted(created) == sorted(task_id for task_id, _ in tasks)
+
+        # tasks created by an earlier run of the decision task are kept
+        created.clear()
+        errors["task1"] = [TaskclusterRestFailure("exists", None, status_code=409)]
+        Workflow.create_tasks(tasks, concurrency=4, backoff=0)
+        assert sorted(created) == ["pre", "task0", "task2", "task3", "task4"]
+
+        # other errors fail the task and its dependents, after creating the others
+        created.clear()
+        errors["task1"] = [TaskclusterRestFailure("bad", None, status_code=400)]
+        with pytest.raises(RuntimeError, match=r"1/6 task\(s\) could not be created"):
+            Workflow.create_tasks(tasks, concurrency=4, backoff=0)
+        assert sorted(created) == ["pre", "task0", "task2", "task3", "task4"]
+
+        created.clear()
+        errors["pre"] = [TaskclusterRestFailure("bad", None, status_code=400)]
+        with pytest.raises(RuntimeError, match="task3: depends on pre"):
+            Workflow.create_tasks(tasks, concurrency=4, backoff=0)
+        assert created == []